@@ -13,15 +13,21 @@ logger.info("Commands module loaded - command handlers should be registered")
 
 from config.config import (
     ADMIN_USER_IDS, MAX_CONCURRENT_DOWNLOADS, TOTAL_COMPLETED_DOWNLOADS,
-    RESOURCE_MONITOR_ENABLED
+    RESOURCE_MONITOR_ENABLED, SHARED_DOWNLOADS_ENABLED, RESULT_CACHE_ENABLED,
+    CANCEL_GRACE_PERIOD, DOWNLOAD_PATH
 )
 from downloader.m3u8_downloader import M3U8Downloader
+from downloader.variant_selector import set_user_preference, get_user_preference
+from downloader.audio_rendition import set_user_language, get_user_language
+from downloader.download_registry import get_download_registry, canonicalize_url
 from processor.video_processor import VideoProcessor
 from utils.helpers import (
     is_valid_m3u8_url, generate_unique_filename, format_size,
     active_downloads, sanitize_filename
 )
 from utils.system_monitor import get_all_stats
+from utils.result_cache import get_result_cache
+from utils.bandwidth_governor import get_bandwidth_governor, parse_rate
 from utils.resource_manager import get_resource_manager
 
 # Command handlers
@@ -58,6 +64,9 @@ async def help_command(client: Client, message: Message):
         "/help - Show this help message\n"
         "/status - Check your download status\n"
         "/cancel - Cancel your current download\n"
+        "/quality - Choose the stream quality for your downloads\n"
+        "/language - Choose the audio language for your downloads\n"
+        "/audio <url> - Download only the audio of a stream\n"
     )
 
     # Add admin commands if the user is an admin
@@ -65,6 +74,8 @@ async def help_command(client: Client, message: Message):
         help_text += (
             "\n**Admin Commands:**\n"
             "/stats - View detailed system and bot statistics\n"
+            "/invalidate <url> - Forget the cached uploads of a stream\n"
+            "/bandwidth - View or change download bandwidth limits\n"
         )
 
     help_text += (
@@ -94,18 +105,98 @@ async def status_command(client: Client, message: Message):
         start_time = download.get('start_time', time.time())
         elapsed = time.time() - start_time
 
-        await message.reply_text(
+        status_text = (
             f"📥 **Download Status:**\n\n"
             f"File: `{filename}`\n"
             f"Status: {status}\n"
             f"Progress: {progress}%\n"
-            f"Elapsed Time: {int(elapsed)} seconds"
         )
+        ladder = [step['resolution'] or f"{step['bandwidth'] // 1000} kbps" for step in download.get('ladder', [])]
+        if ladder:
+            status_text += f"Quality: {' → '.join(ladder)}\n"
+        if download.get('estimated_size'):
+            status_text += f"Estimated Size: {format_size(download['estimated_size'])}\n"
+        if download.get('audio_only'):
+            status_text += "Mode: Audio only\n"
+        audio_label = download.get('audio', {}).get('name') or download.get('audio', {}).get('language')
+        if audio_label:
+            status_text += f"Audio: {audio_label}\n"
+        if download.get('mirrors'):
+            status_text += f"Mirrors: {download['mirrors']}\n"
+        if download.get('peak_rate'):
+            status_text += f"Speed: {format_size(download.get('rate', 0))}/s (peak {format_size(download['peak_rate'])}/s)\n"
+        if download.get('live'):
+            status_text += f"Live: {download.get('live_duration', 0)} seconds captured\n"
+        if download.get('phase') == 'merging':
+            status_text += f"Merging: {download.get('merge_progress', 0)}%\n"
+        status_text += f"Elapsed Time: {int(elapsed)} seconds"
+
+        await message.reply_text(status_text)
     else:
         await message.reply_text(
             "You don't have any active downloads."
         )
 
+@Client.on_message(filters.command("quality"))
+async def quality_command(client: Client, message: Message):
+    """
+    Handle the /quality command.
+    Sets the user's preferred stream quality for master playlists.
+    """
+    user_id = message.from_user.id
+
+    logger.info(f"Quality command received from user {user_id}")
+
+    args = message.command[1:] if message.command else []
+    if not args:
+        current = get_user_preference(user_id) or 'auto'
+        await message.reply_text(
+            f"🎚️ **Stream Quality:** {current}\n\n"
+            "Usage: /quality <auto|best|smallest|1080|720|480|360>\n\n"
+            "`auto` picks the best stream that fits the download size limit."
+        )
+        return
+
+    choice = args[0].lower().rstrip('p')
+    if choice not in ('auto', 'best', 'smallest') and not (choice.isdigit() and int(choice) > 0):
+        await message.reply_text(
+            "❌ Unknown quality. Use one of: auto, best, smallest, or a maximum height such as 720."
+        )
+        return
+
+    set_user_preference(user_id, None if choice == 'auto' else choice)
+    await message.reply_text(f"✅ Stream quality set to {choice}.")
+
+@Client.on_message(filters.command("language"))
+async def language_command(client: Client, message: Message):
+    """
+    Handle the /language command.
+    Sets the user's preferred audio language for streams with separate audio tracks.
+    """
+    user_id = message.from_user.id
+
+    logger.info(f"Language command received from user {user_id}")
+
+    args = message.command[1:] if message.command else []
+    if not args:
+        current = get_user_language(user_id) or 'auto'
+        await message.reply_text(
+            f"🔊 **Audio Language:** {current}\n\n"
+            "Usage: /language <auto|en|de|fr|...>\n\n"
+            "`auto` uses the stream's default audio track."
+        )
+        return
+
+    choice = args[0].lower()
+    if choice != 'auto' and not all(part.isalnum() for part in choice.split('-')):
+        await message.reply_text(
+            "❌ Unknown language. Use auto or a language code such as en or pt-BR."
+        )
+        return
+
+    set_user_language(user_id, None if choice == 'auto' else choice)
+    await message.reply_text(f"✅ Audio language set to {choice}.")
+
 @Client.on_message(filters.command("cancel"))
 async def cancel_command(client: Client, message: Message):
     """
@@ -117,7 +208,24 @@ async def cancel_command(client: Client, message: Message):
 
     # Check if there's an active task for this user
     if user_id in active_tasks and not active_tasks[user_id].done():
-        active_tasks[user_id].cancel()
+        # The first /cancel of a live capture stops recording and keeps what was captured
+        download = active_downloads.get(user_id, {})
+        if (
+            download.get('live') and not download.get('stop_requested') and
+            download.get('phase') != 'merging' and not get_download_registry().is_shared(user_id)
+        ):
+            download['stop_requested'] = True
+            await message.reply_text(
+                "⏹ Stopping the live capture. The recording so far will be saved.\n\n"
+                "Send /cancel again to discard it."
+            )
+            return
+
+        task = active_tasks[user_id]
+        task.cancel()
+
+        # Wait for the segment fetches and ffmpeg to stop, so the slot this frees is really free
+        await asyncio.wait({task}, timeout=CANCEL_GRACE_PERIOD)
 
         if user_id in active_downloads:
             del active_downloads[user_id]
@@ -134,7 +242,7 @@ async def cancel_command(client: Client, message: Message):
 active_tasks = {}
 
 # Define the process_download function
-async def process_download(client, message, status_message, url, filename, user_id):
+async def process_download(client, message, status_message, url, filename, user_id, audio_only=False):
     """
     Process an M3U8 download request.
 
@@ -145,18 +253,27 @@ async def process_download(client, message, status_message, url, filename, user_
         url: The M3U8 URL to download
         filename: The filename to save as
         user_id: The user ID who requested the download
+        audio_only: Whether to download and send only the audio
     """
     try:
         # Update status
         active_downloads[user_id]['status'] = 'downloading'
 
-        # Create downloader and processor instances
-        downloader = M3U8Downloader(user_id)
-        processor = VideoProcessor()
+        # Identical requests share one download; later ones subscribe to its result
+        registry = get_download_registry()
+        job = registry.join(
+            download_key(url, user_id, audio_only), user_id,
+            lambda: M3U8Downloader(user_id),
+            lambda d: d.download_m3u8(url, filename, audio_only=audio_only)
+        )
+        downloader = job.downloader
 
         # Download the video using the real downloader
-        await status_message.edit_text("📥 Downloading video... 0%")
-        success, msg, output_path = await downloader.download_m3u8(url, filename)
+        if job.owner != user_id:
+            await status_message.edit_text("📥 This stream is already being downloaded, joining it...")
+        else:
+            await status_message.edit_text("📥 Downloading audio... 0%" if audio_only else "📥 Downloading video... 0%")
+        success, msg, output_path = await registry.wait(job, user_id)
 
         if not success or not output_path:
             await status_message.edit_text(f"❌ Download failed: {msg}")
@@ -164,13 +281,28 @@ async def process_download(client, message, status_message, url, filename, user_
                 del active_downloads[user_id]
             return
 
-        # Simulate processing (optional, or call processor if needed)
-        active_downloads[user_id]['status'] = 'processing'
-        await status_message.edit_text("🔄 Processing video...")
-        await asyncio.sleep(2)
+        # Subscribers of a shared job take turns: the first uploads, the rest resend its file_id
+        key = request_identity(url, user_id, audio_only)
+        try:
+            async with get_result_cache().lock(key):
+                if not await send_cached_result(message, key, downloader.playlist_digest):
+                    active_downloads[user_id]['status'] = 'uploading'
+                    await status_message.edit_text("📤 Uploading audio..." if audio_only else "📤 Uploading video...")
+                    sent = await upload_result(message, output_path, audio_only)
+
+                    # Live captures are one-off recordings and are never reused
+                    kind, file_id = sent_media(sent)
+                    if RESULT_CACHE_ENABLED and file_id and downloader.playlist_digest:
+                        await get_result_cache().set(
+                            key, file_id, kind, downloader.playlist_digest, os.path.getsize(output_path)
+                        )
+        finally:
+            # A later subscriber without a usable file_id still uploads the file, so only the last one removes it
+            if registry.release(job, user_id):
+                remove_output_file(output_path)
 
         # Notify user of completion
-        await status_message.edit_text("✅ Download complete!\n\nSaved to: " + output_path)
+        await status_message.edit_text("✅ Download complete!")
 
         # Clean up temp files after user is notified
         downloader._cleanup()
@@ -264,8 +396,80 @@ async def stats_command(client: Client, message: Message):
 
     await message.reply_text(stats_text)
 
+@Client.on_message(filters.command("invalidate") & filters.user(ADMIN_USER_IDS))
+async def invalidate_command(client: Client, message: Message):
+    """
+    Handle the /invalidate command (admin only).
+    Drops the cached uploads of a stream so the next request downloads it again.
+    """
+    user_id = message.from_user.id
+    logger.info(f"Invalidate command received from admin {user_id}")
+
+    args = message.command[1:] if message.command else []
+    if not args:
+        await message.reply_text(
+            "🗑 **Invalidate Cached Uploads**\n\n"
+            "Usage: /invalidate <m3u8 url>"
+        )
+        return
+
+    removed = await get_result_cache().invalidate_url(canonicalize_url(args[0]) + '|')
+    await message.reply_text(f"✅ Removed {removed} cached upload(s) of this stream.")
+
+@Client.on_message(filters.command("bandwidth") & filters.user(ADMIN_USER_IDS))
+async def bandwidth_command(client: Client, message: Message):
+    """
+    Handle the /bandwidth command (admin only).
+    Shows the bandwidth limits or changes them for running and future downloads.
+    """
+    user_id = message.from_user.id
+    logger.info(f"Bandwidth command received from admin {user_id}")
+
+    governor = get_bandwidth_governor()
+    args = message.command[1:] if message.command else []
+
+    if args:
+        applied = False
+        if len(args) == 2:
+            setting, value = args[0].lower(), args[1].lower()
+            try:
+                if setting == 'global':
+                    governor.set_limits(global_rate=parse_rate(value))
+                    applied = True
+                elif setting == 'user':
+                    governor.set_limits(user_rate=parse_rate(value))
+                    applied = True
+                elif setting == 'fair' and value in ('on', 'off'):
+                    governor.set_limits(fair_share=value == 'on')
+                    applied = True
+            except ValueError:
+                pass
+
+        if not applied:
+            await message.reply_text(
+                "📶 **Bandwidth Limits**\n\n"
+                "Usage:\n"
+                "/bandwidth global <rate> - Limit all downloads together\n"
+                "/bandwidth user <rate> - Limit each user\n"
+                "/bandwidth fair on|off - Split the global limit among active downloads\n\n"
+                "Rates are bytes per second with an optional K, M or G suffix, 0 for unlimited."
+            )
+            return
+
+    def describe(rate: int) -> str:
+        return f"{format_size(rate)}/s" if rate else "Unlimited"
+
+    stats = governor.get_stats()
+    await message.reply_text(
+        "📶 **Bandwidth Limits**\n\n"
+        f"Global: {describe(stats['global_limit'])}\n"
+        f"Per user: {describe(stats['user_limit'])}\n"
+        f"Fair share: {'On' if stats['fair_share'] else 'Off'}\n"
+        f"Current rate: {format_size(stats['rate'])}/s across {stats['jobs']} downloads"
+    )
+
 # URL handler
-@Client.on_message(filters.text & filters.private & ~filters.command(["start", "help", "status", "cancel", "stats"]))
+@Client.on_message(filters.text & filters.private & ~filters.command(["start", "help", "status", "cancel", "quality", "language", "audio", "stats", "invalidate", "bandwidth"]))
 async def handle_url(client: Client, message: Message):
     """
     Handle M3U8 URLs sent by users.
@@ -281,6 +485,175 @@ async def handle_url(client: Client, message: Message):
 
     logger.info(f"Received potential URL from user {user_id}: {url[:50]}{'...' if len(url) > 50 else ''}")
 
+    await start_download(client, message, url, user_id)
+
+@Client.on_message(filters.command("audio") & filters.private)
+async def audio_command(client: Client, message: Message):
+    """
+    Handle the /audio command.
+    Downloads only the audio of an M3U8 stream and sends it as an audio file.
+    """
+    user_id = message.from_user.id
+
+    logger.info(f"Audio command received from user {user_id}")
+
+    args = message.command[1:] if message.command else []
+    if not args:
+        await message.reply_text(
+            "🎧 **Audio Only**\n\n"
+            "Usage: /audio <m3u8 url>\n\n"
+            "Downloads just the soundtrack, skipping the video wherever the stream allows."
+        )
+        return
+
+    await start_download(client, message, args[0].strip(), user_id, audio_only=True)
+
+def request_identity(url, user_id, audio_only=False):
+    """
+    Identify the result a request would produce.
+
+    Args:
+        url: The M3U8 URL to download
+        user_id: The user ID who requested the download
+        audio_only: Whether to download only the audio
+
+    Returns:
+        str: Key covering the URL and everything that decides the selected stream
+    """
+    return get_download_registry().make_key(
+        url, audio_only, get_user_preference(user_id), get_user_language(user_id)
+    )
+
+def download_key(url, user_id, audio_only=False):
+    """
+    Build the shared-download key of a request.
+
+    Args:
+        url: The M3U8 URL to download
+        user_id: The user ID who requested the download
+        audio_only: Whether to download only the audio
+
+    Returns:
+        Optional[str]: Registry key covering everything that decides the selected stream,
+        or None when shared downloads are disabled
+    """
+    if not SHARED_DOWNLOADS_ENABLED:
+        return None
+    return request_identity(url, user_id, audio_only)
+
+def sent_media(sent):
+    """
+    Get the kind and file_id of a sent media message.
+
+    Args:
+        sent: The message returned by a send or reply call
+
+    Returns:
+        Tuple[Optional[str], Optional[str]]: ('video', 'audio' or 'document', file_id), or (None, None)
+    """
+    for kind in ('video', 'audio', 'document'):
+        media = getattr(sent, kind, None)
+        if media is not None:
+            return kind, media.file_id
+    return None, None
+
+async def send_cached_result(message, key, digest=None):
+    """
+    Resend a previously uploaded result by its Telegram file_id.
+
+    Args:
+        message: The message that requested the download
+        key: Request identity
+        digest: Segment list digest the result must match, or None to accept any
+
+    Returns:
+        bool: True if the cached result was sent
+    """
+    if not RESULT_CACHE_ENABLED:
+        return False
+
+    cache = get_result_cache()
+    entry = cache.get(key)
+    if entry is None or (digest is not None and entry['digest'] != digest):
+        return False
+
+    senders = {
+        'video': message.reply_video,
+        'audio': message.reply_audio,
+        'document': message.reply_document
+    }
+    try:
+        await senders[entry['kind']](entry['file_id'], quote=True)
+        logger.info(f"Resent cached upload for {key}")
+        return True
+    except Exception as e:
+        # An expired or revoked file_id is useless; download the stream again
+        logger.warning(f"Cached upload for {key} could not be resent, invalidating it: {str(e)}")
+        await cache.invalidate(key)
+        return False
+
+def remove_output_file(output_path):
+    """
+    Delete a finished download once it has been sent.
+
+    Args:
+        output_path: Path of the finished file
+    """
+    # Security check: only ever delete files in the download directory
+    download_dir = os.path.abspath(DOWNLOAD_PATH)
+    path = os.path.abspath(output_path)
+    if os.path.dirname(path) != download_dir:
+        logger.warning(f"Skipped removal of suspicious output path: {output_path}")
+        return
+
+    try:
+        os.remove(path)
+        logger.debug(f"Removed output file: {output_path}")
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.error(f"Could not remove output file {output_path}: {str(e)}")
+
+async def upload_result(message, output_path, audio_only=False):
+    """
+    Upload a finished download.
+
+    Args:
+        message: The message that requested the download
+        output_path: Path of the finished file
+        audio_only: Whether the file holds only audio
+
+    Returns:
+        The sent message
+    """
+    if audio_only:
+        return await message.reply_audio(output_path, quote=True)
+
+    video_info = await VideoProcessor.get_video_info(output_path)
+    try:
+        return await message.reply_video(
+            output_path,
+            quote=True,
+            duration=int(video_info.get('duration', 0)),
+            width=video_info.get('width', 0),
+            height=video_info.get('height', 0),
+            supports_streaming=True
+        )
+    except Exception as e:
+        logger.error(f"Error sending video, sending it as a document instead: {str(e)}")
+        return await message.reply_document(output_path, quote=True)
+
+async def start_download(client, message, url, user_id, audio_only=False):
+    """
+    Validate a download request and start it in the background.
+
+    Args:
+        client: The Pyrogram client
+        message: The message that requested the download
+        url: The M3U8 URL to download
+        user_id: The user ID who requested the download
+        audio_only: Whether to download only the audio
+    """
     # Check if the URL is valid
     if not is_valid_m3u8_url(url):
         await message.reply_text(
@@ -289,6 +662,10 @@ async def handle_url(client: Client, message: Message):
         )
         return
 
+    # A stream that was sent before is resent without downloading it again
+    if await send_cached_result(message, request_identity(url, user_id, audio_only)):
+        return
+
     # Check if the user already has an active download
     if user_id in active_downloads and active_downloads[user_id].get('status') == 'downloading':
         await message.reply_text(
@@ -297,9 +674,9 @@ async def handle_url(client: Client, message: Message):
         )
         return
 
-    # Check if we've reached the maximum number of concurrent downloads
-    active_count = sum(1 for d in active_downloads.values() if d.get('status') == 'downloading')
-    if active_count >= MAX_CONCURRENT_DOWNLOADS:
+    # Check if we've reached the maximum number of concurrent downloads; joining a running one is free
+    active_count = len({id(d) for d in active_downloads.values() if d.get('status') == 'downloading'})
+    if active_count >= MAX_CONCURRENT_DOWNLOADS and not get_download_registry().has(download_key(url, user_id, audio_only)):
         await message.reply_text(
             "⚠️ The bot is currently at maximum capacity.\n\n"
             "Please try again later."
@@ -313,7 +690,7 @@ async def handle_url(client: Client, message: Message):
     )
 
     # Generate a unique filename
-    filename = generate_unique_filename(url)
+    filename = generate_unique_filename(url, 'm4a' if audio_only else 'mp4')
 
     logger.info(f"Starting download for user {user_id}: {filename}")
 
@@ -327,7 +704,7 @@ async def handle_url(client: Client, message: Message):
 
     # Create a task for the download process
     download_task = asyncio.create_task(
-        process_download(client, message, status_message, url, filename, user_id)
+        process_download(client, message, status_message, url, filename, user_id, audio_only)
     )
 
     # Store the task in the global active_tasks dictionary
@@ -23,6 +23,7 @@ CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 1024 * 1024))  # 1 MB default
 ADMIN_USER_IDS = list(map(int, os.getenv("ADMIN_USER_IDS", "").split(","))) if os.getenv("ADMIN_USER_IDS") else []
 MAX_CONCURRENT_DOWNLOADS = int(os.getenv("MAX_CONCURRENT_DOWNLOADS", 5))
 DOWNLOAD_TIMEOUT = int(os.getenv("DOWNLOAD_TIMEOUT", 3600))  # 1 hour default
+CANCEL_GRACE_PERIOD = float(os.getenv("CANCEL_GRACE_PERIOD", 10.0))  # Seconds a cancelled download gets to stop its fetches and ffmpeg
 
 # Web server settings
 ENABLE_WEB_SERVER = os.getenv("ENABLE_WEB_SERVER", "true").lower() == "true"
@@ -59,13 +60,98 @@ CONNECTION_POOL_TTL_DNS_CACHE = int(os.getenv("CONNECTION_POOL_TTL_DNS_CACHE", 3
 CONNECTION_POOL_TIMEOUT = int(os.getenv("CONNECTION_POOL_TIMEOUT", 30))
 CONNECTION_POOL_CONNECT_TIMEOUT = int(os.getenv("CONNECTION_POOL_CONNECT_TIMEOUT", 10))
 
+# Per-host adaptive concurrency settings
+HOST_CONCURRENCY_ENABLED = os.getenv("HOST_CONCURRENCY_ENABLED", "true").lower() == "true"  # Adapt parallel segment requests to each host
+HOST_CONCURRENCY_INITIAL = int(os.getenv("HOST_CONCURRENCY_INITIAL", 8))  # Starting limit of a new host
+HOST_CONCURRENCY_MIN = int(os.getenv("HOST_CONCURRENCY_MIN", 1))  # Lowest a host's limit can be cut to
+HOST_CONCURRENCY_MAX = int(os.getenv("HOST_CONCURRENCY_MAX", 64))  # Highest a host's limit can grow to
+HOST_CONCURRENCY_BACKOFF = float(os.getenv("HOST_CONCURRENCY_BACKOFF", 0.5))  # Factor the limit is multiplied by on congestion
+HOST_CONCURRENCY_LATENCY_FACTOR = float(os.getenv("HOST_CONCURRENCY_LATENCY_FACTOR", 2.0))  # Latency over the baseline that counts as congestion
+
+# Bandwidth shaping settings
+BANDWIDTH_GLOBAL_LIMIT = int(os.getenv("BANDWIDTH_GLOBAL_LIMIT", 0))  # Bytes per second across all downloads, 0 for unlimited
+BANDWIDTH_USER_LIMIT = int(os.getenv("BANDWIDTH_USER_LIMIT", 0))  # Bytes per second per user, 0 for unlimited
+BANDWIDTH_FAIR_SHARE = os.getenv("BANDWIDTH_FAIR_SHARE", "true").lower() == "true"  # Split the global limit evenly among active downloads
+
 # Cache settings
 CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() == "true"
 CACHE_TTL = int(os.getenv("CACHE_TTL", 3600))  # 1 hour default
 CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", 100 * 1024 * 1024))  # 100 MB default
+RESOLVED_PLAYLIST_CACHE_ENABLED = os.getenv("RESOLVED_PLAYLIST_CACHE_ENABLED", "true").lower() == "true"  # Reuse the parsed segment table and stream selection of a repeated request
+
+# Completed-output cache settings
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true"  # Resend finished uploads by Telegram file_id
+RESULT_CACHE_TTL = int(os.getenv("RESULT_CACHE_TTL", 7 * 24 * 3600))  # Seconds a finished upload is reused
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", 10000))  # Uploads remembered before the oldest are dropped
+
+# Shared segment cache settings
+SEGMENT_CACHE_ENABLED = os.getenv("SEGMENT_CACHE_ENABLED", "false").lower() == "true"  # Reuse fetched segment bytes across downloads; every fetched segment is also written to the cache
+SEGMENT_CACHE_MAX_SIZE = int(os.getenv("SEGMENT_CACHE_MAX_SIZE", 1024 * 1024 * 1024))  # 1 GB default
+SEGMENT_CACHE_TTL = int(os.getenv("SEGMENT_CACHE_TTL", 86400))  # Seconds a stored segment is reused
+SEGMENT_CACHE_POLICY = os.getenv("SEGMENT_CACHE_POLICY", "lru").lower()  # Eviction policy: lru or lfu
+SEGMENT_CACHE_VERIFY = os.getenv("SEGMENT_CACHE_VERIFY", "true").lower() == "true"  # Check content hashes on every read
 
 # Resource allocation settings
 RESOURCE_MONITOR_ENABLED = os.getenv("RESOURCE_MONITOR_ENABLED", "true").lower() == "true"
 RESOURCE_CPU_THRESHOLD = float(os.getenv("RESOURCE_CPU_THRESHOLD", 80.0))  # 80% CPU usage threshold
 RESOURCE_MEMORY_THRESHOLD = float(os.getenv("RESOURCE_MEMORY_THRESHOLD", 80.0))  # 80% memory usage threshold
 RESOURCE_CHECK_INTERVAL = int(os.getenv("RESOURCE_CHECK_INTERVAL", 5))  # Check every 5 seconds
+
+# Streaming playlist settings
+PLAYLIST_STREAMING_ENABLED = os.getenv("PLAYLIST_STREAMING_ENABLED", "true").lower() == "true"  # Start fetching segments of a VOD playlist while it is still downloading
+
+# Segment scheduler settings
+SEGMENT_WINDOW_SIZE = int(os.getenv("SEGMENT_WINDOW_SIZE", 16))  # In-flight segments per download
+SEGMENT_GLOBAL_CONCURRENCY = int(os.getenv("SEGMENT_GLOBAL_CONCURRENCY", 64))  # In-flight segments across all downloads
+
+# Merge settings
+MERGE_MODE = os.getenv("MERGE_MODE", "stream").lower()  # "stream" (in-order stream file), "pipe" (live ffmpeg remux) or "concat" (per-segment files)
+MERGE_REORDER_BUFFER = int(os.getenv("MERGE_REORDER_BUFFER", 32))  # Out-of-order segments held in memory per download
+
+# Resume settings
+RESUME_ENABLED = os.getenv("RESUME_ENABLED", "true").lower() == "true"
+RESUME_TTL = int(os.getenv("RESUME_TTL", 86400))  # Keep partial downloads for 24 hours
+
+# Decryption settings
+KEY_CACHE_MAX_ENTRIES = int(os.getenv("KEY_CACHE_MAX_ENTRIES", 64))  # AES-128 keys shared across segments and downloads
+
+# Byte-range settings
+BYTERANGE_COALESCE_MAX = int(os.getenv("BYTERANGE_COALESCE_MAX", 4 * 1024 * 1024))  # Largest merged Range request (4 MB)
+
+# Live capture settings
+LIVE_CAPTURE_ENABLED = os.getenv("LIVE_CAPTURE_ENABLED", "true").lower() == "true"
+LIVE_MAX_DURATION = int(os.getenv("LIVE_MAX_DURATION", 3600))  # Stop capturing a live stream after 1 hour of media
+
+# Variant selection settings
+VARIANT_POLICIES = [p.strip() for p in os.getenv("VARIANT_POLICIES", "max_height,size_budget").split(",") if p.strip()]  # Applied in order; the highest remaining bandwidth wins
+VARIANT_MAX_HEIGHT = int(os.getenv("VARIANT_MAX_HEIGHT", 0))  # Maximum vertical resolution, 0 for no cap
+
+# Adaptive rendition switching
+ADAPTIVE_SWITCHING_ENABLED = os.getenv("ADAPTIVE_SWITCHING_ENABLED", "false").lower() == "true"  # Drop to a lower variant when throughput collapses
+
+# Retry settings
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", 10))  # Attempts per segment request
+RETRY_BASE_DELAY = float(os.getenv("RETRY_BASE_DELAY", 0.5))  # Backoff ceiling of the first retry in seconds
+RETRY_MAX_DELAY = float(os.getenv("RETRY_MAX_DELAY", 30.0))  # Upper bound of the backoff delay in seconds
+RETRY_BUDGET = int(os.getenv("RETRY_BUDGET", 200))  # Retries shared by all requests of one download
+CIRCUIT_BREAKER_FAILURE_RATE = float(os.getenv("CIRCUIT_BREAKER_FAILURE_RATE", 0.5))  # Error rate that opens a host's circuit
+CIRCUIT_BREAKER_MIN_REQUESTS = int(os.getenv("CIRCUIT_BREAKER_MIN_REQUESTS", 20))  # Requests seen before the error rate is trusted
+CIRCUIT_BREAKER_OPEN_SECONDS = float(os.getenv("CIRCUIT_BREAKER_OPEN_SECONDS", 30.0))  # Cool-down before a probe request
+
+# Hedged request settings
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", 0.95))  # Latency percentile of sibling segments that triggers a duplicate request
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", 10))  # Completed segments needed before hedging starts
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", 1.0))  # Never hedge before this many seconds
+
+# Mirror settings
+MIRRORS_ENABLED = os.getenv("MIRRORS_ENABLED", "true").lower() == "true"  # Spread segments over equivalent variants on other URLs
+MIRROR_MAX_FAILURES = int(os.getenv("MIRROR_MAX_FAILURES", 3))  # Consecutive failures that bench a mirror
+MIRROR_COOLDOWN = float(os.getenv("MIRROR_COOLDOWN", 30.0))  # Seconds a benched mirror is skipped
+
+# Separate audio rendition settings
+AUDIO_TRACKS_ENABLED = os.getenv("AUDIO_TRACKS_ENABLED", "true").lower() == "true"  # Fetch and mux EXT-X-MEDIA audio renditions
+AUDIO_LANGUAGE = os.getenv("AUDIO_LANGUAGE", "")  # Preferred audio language, empty for the playlist default
+
+# Shared download settings
+SHARED_DOWNLOADS_ENABLED = os.getenv("SHARED_DOWNLOADS_ENABLED", "true").lower() == "true"  # Identical concurrent requests share one download
@@ -0,0 +1,156 @@
+import logging
+from typing import Dict, List, Optional
+
+import m3u8
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class AudioRendition:
+    """
+    An EXT-X-MEDIA audio rendition that a variant references by group.
+    """
+
+    def __init__(self, url: str, group_id: str, language: Optional[str] = None,
+                 name: Optional[str] = None, default: bool = False):
+        """
+        Initialize the rendition.
+
+        Args:
+            url: Absolute media playlist URL
+            group_id: GROUP-ID the rendition belongs to
+            language: LANGUAGE attribute, if any
+            name: NAME attribute, if any
+            default: Whether the rendition is marked DEFAULT=YES
+        """
+        self.url = url
+        self.group_id = group_id
+        self.language = language
+        self.name = name
+        self.default = default
+
+    def describe(self) -> Dict[str, Optional[str]]:
+        """
+        Describe the rendition for the active downloads registry.
+
+        Returns:
+            Dict[str, Optional[str]]: Rendition details
+        """
+        return {
+            'url': self.url,
+            'language': self.language,
+            'name': self.name
+        }
+
+# CODECS prefixes of audio formats found in HLS streams
+AUDIO_CODEC_PREFIXES = ('mp4a', 'ac-3', 'ec-3', 'mp3', 'opus', 'flac', 'alac')
+
+def is_audio_only_variant(codecs: Optional[str]) -> bool:
+    """
+    Check whether a variant's CODECS attribute lists audio codecs only.
+
+    Args:
+        codecs: CODECS attribute of an EXT-X-STREAM-INF tag
+
+    Returns:
+        bool: True for audio-only variants, False if any video codec is listed or CODECS is missing
+    """
+    if not codecs:
+        return False
+    return all(
+        codec.strip().lower().startswith(AUDIO_CODEC_PREFIXES)
+        for codec in codecs.split(',') if codec.strip()
+    )
+
+def find_audio_renditions(playlist: m3u8.M3U8, group_id: Optional[str], base_url: str,
+                          resolve) -> List[AudioRendition]:
+    """
+    List the audio renditions of a group in a master playlist.
+
+    Renditions without a URI are carried inside the video segments and are
+    left out, since there is nothing separate to fetch.
+
+    Args:
+        playlist: M3U8 master playlist
+        group_id: AUDIO group of the selected variant
+        base_url: Base URL for resolving relative URLs
+        resolve: Function joining a base URL and a URI
+
+    Returns:
+        List[AudioRendition]: Renditions in playlist order
+    """
+    if not group_id:
+        return []
+
+    renditions = []
+    for media in playlist.media:
+        if (media.type or '').upper() != 'AUDIO' or media.group_id != group_id or not media.uri:
+            continue
+        renditions.append(AudioRendition(
+            resolve(base_url, media.uri),
+            group_id,
+            language=media.language,
+            name=media.name,
+            default=(media.default or '').upper() == 'YES'
+        ))
+    return renditions
+
+def select_audio_rendition(renditions: List[AudioRendition],
+                           language: Optional[str] = None) -> Optional[AudioRendition]:
+    """
+    Pick an audio rendition.
+
+    A requested language matches exactly or by its primary subtag ('en'
+    matches 'en-US'). Without a match the DEFAULT=YES rendition is used, and
+    failing that the first one.
+
+    Args:
+        renditions: Renditions of the variant's audio group
+        language: Preferred language code, if any
+
+    Returns:
+        Optional[AudioRendition]: The chosen rendition, or None if the group is empty
+    """
+    if not renditions:
+        return None
+
+    if language:
+        wanted = language.lower()
+        for rendition in renditions:
+            code = (rendition.language or '').lower()
+            if code == wanted or code.split('-')[0] == wanted.split('-')[0]:
+                return rendition
+        logger.info(f"No audio rendition in language '{language}', using the default")
+
+    for rendition in renditions:
+        if rendition.default:
+            return rendition
+    return renditions[0]
+
+# Per-user audio language preferences
+user_languages: Dict[int, str] = {}
+
+def set_user_language(user_id: int, language: Optional[str]) -> None:
+    """
+    Set or clear a user's audio language preference.
+
+    Args:
+        user_id: Telegram user ID
+        language: Language code such as 'en', or None to use the default
+    """
+    if language:
+        user_languages[user_id] = language
+    else:
+        user_languages.pop(user_id, None)
+
+def get_user_language(user_id: int) -> Optional[str]:
+    """
+    Get a user's audio language preference.
+
+    Args:
+        user_id: Telegram user ID
+
+    Returns:
+        Optional[str]: The language code, or None if the user has not set one
+    """
+    return user_languages.get(user_id)
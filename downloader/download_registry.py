@@ -0,0 +1,256 @@
+import logging
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from config.config import CANCEL_GRACE_PERIOD
+from utils.helpers import active_downloads
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+def canonicalize_url(url: str) -> str:
+    """
+    Normalize a playlist URL so equivalent spellings share one registry key.
+
+    The scheme and host are lowercased, default ports and the fragment are
+    dropped, and query parameters are sorted.
+
+    Args:
+        url: Playlist URL
+
+    Returns:
+        str: Canonical URL
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and not (scheme == 'http' and parts.port == 80) and not (scheme == 'https' and parts.port == 443):
+        host = f"{host}:{parts.port}"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, host, parts.path or '/', query, ''))
+
+class SharedDownload:
+    """
+    One download job and the users waiting on its result.
+    """
+
+    def __init__(self, key: Optional[str], owner: int, downloader, task: asyncio.Task):
+        """
+        Initialize the shared download.
+
+        Args:
+            key: Registry key, None for a job that is not shared
+            owner: User whose status entry the downloader updates
+            downloader: The M3U8Downloader running the job
+            task: Task producing the download result
+        """
+        self.key = key
+        self.owner = owner
+        self.downloader = downloader
+        self.task = task
+        self.subscribers: List[int] = [owner]
+
+        # Every subscriber's status entry is this same dictionary
+        self.status: Dict[str, Any] = active_downloads.setdefault(owner, {})
+
+class DownloadRegistry:
+    """
+    Single-flight registry of in-flight downloads.
+
+    Requests are keyed by the canonical playlist URL and everything that
+    decides which variant is selected (job type, quality and language
+    preference). A request for a key that is already downloading subscribes
+    to that job's progress and result. The job is cancelled only when its
+    last subscriber leaves.
+    """
+
+    def __init__(self):
+        """Initialize the registry."""
+        self.jobs: Dict[str, SharedDownload] = {}
+        self.user_jobs: Dict[int, SharedDownload] = {}
+        self.deduplicated = 0
+
+    @staticmethod
+    def make_key(url: str, audio_only: bool = False, preference: Optional[str] = None,
+                 language: Optional[str] = None) -> str:
+        """
+        Build the registry key of a request.
+
+        Args:
+            url: Playlist URL
+            audio_only: Whether the job downloads only the audio
+            preference: The user's quality preference, if any
+            language: The user's audio language preference, if any
+
+        Returns:
+            str: Registry key
+        """
+        kind = 'audio' if audio_only else 'video'
+        return f"{canonicalize_url(url)}|{kind}|{preference or 'auto'}|{language or 'auto'}"
+
+    def has(self, key: Optional[str]) -> bool:
+        """
+        Check whether a job for a key is in flight.
+
+        Args:
+            key: Registry key, or None for a request that is never shared
+
+        Returns:
+            bool: True if a request for the key would subscribe to a running job
+        """
+        return key is not None and key in self.jobs
+
+    def is_shared(self, user_id: int) -> bool:
+        """
+        Check whether a user's job has other subscribers.
+
+        Args:
+            user_id: Telegram user ID
+
+        Returns:
+            bool: True if someone else is waiting on the same job
+        """
+        job = self.user_jobs.get(user_id)
+        return job is not None and len(job.subscribers) > 1
+
+    def join(self, key: Optional[str], user_id: int, create_downloader: Callable[[], Any],
+             run: Callable[[Any], Awaitable[Tuple[bool, str, Optional[str]]]]) -> SharedDownload:
+        """
+        Subscribe to the job for a key, starting it if none is in flight.
+
+        Args:
+            key: Registry key, or None to always start a private job
+            user_id: Telegram user ID of the requester
+            create_downloader: Creates the downloader for a new job
+            run: Starts the download on a downloader and returns its result
+
+        Returns:
+            SharedDownload: The job the user is now subscribed to
+        """
+        job = self.jobs.get(key) if key is not None else None
+        if job is not None:
+            logger.info(f"User {user_id} joined the in-flight download {key} of user {job.owner}")
+            job.subscribers.append(user_id)
+            active_downloads[user_id] = job.status
+            self.user_jobs[user_id] = job
+            self.deduplicated += 1
+            return job
+
+        downloader = create_downloader()
+        task = asyncio.ensure_future(run(downloader))
+        job = SharedDownload(key, user_id, downloader, task)
+        if key is not None:
+            self.jobs[key] = job
+        self.user_jobs[user_id] = job
+        task.add_done_callback(lambda _: self._finished(job))
+        return job
+
+    async def wait(self, job: SharedDownload, user_id: int) -> Tuple[bool, str, Optional[str]]:
+        """
+        Wait for a job's result on behalf of one subscriber.
+
+        Cancelling the waiting task detaches only this subscriber. If it was
+        the last one, the cancellation returns only once the job has stopped
+        its fetches and ffmpeg, or its grace period ran out, so the capacity
+        it frees is really free.
+
+        Args:
+            job: The job to wait on
+            user_id: Telegram user ID of the subscriber
+
+        Returns:
+            Tuple[bool, str, Optional[str]]: (success, message, output_path if successful)
+        """
+        try:
+            return await asyncio.shield(job.task)
+        except asyncio.CancelledError:
+            if not job.task.done():
+                self.leave(job, user_id)
+                if not job.subscribers:
+                    await asyncio.wait({job.task}, timeout=CANCEL_GRACE_PERIOD)
+            raise
+        finally:
+            if self.user_jobs.get(user_id) is job:
+                del self.user_jobs[user_id]
+
+    def leave(self, job: SharedDownload, user_id: int) -> None:
+        """
+        Detach a subscriber, cancelling the job if nobody is left.
+
+        Args:
+            job: The job to leave
+            user_id: Telegram user ID of the subscriber
+        """
+        if user_id in job.subscribers:
+            job.subscribers.remove(user_id)
+
+        if not job.subscribers:
+            logger.info(f"Last subscriber left download {job.key}, cancelling it")
+            # The job may take a while to unwind; a new request for the key must not join it meanwhile
+            if self.jobs.get(job.key) is job:
+                del self.jobs[job.key]
+            job.task.cancel()
+            return
+
+        if user_id == job.owner:
+            # The downloader keeps reporting through a remaining subscriber's entry
+            job.owner = job.subscribers[0]
+            job.downloader.user_id = job.owner
+            active_downloads[job.owner] = job.status
+            logger.info(f"Download {job.key} handed over to user {job.owner}")
+
+    def release(self, job: SharedDownload, user_id: int) -> bool:
+        """
+        Detach a subscriber that is done with a finished job's result.
+
+        Args:
+            job: The finished job
+            user_id: Telegram user ID of the subscriber
+
+        Returns:
+            bool: True if it was the last subscriber, so the output file is no longer needed
+        """
+        if user_id in job.subscribers:
+            job.subscribers.remove(user_id)
+        return not job.subscribers
+
+    def _finished(self, job: SharedDownload) -> None:
+        """
+        Drop a finished job so later requests start a fresh download.
+
+        Args:
+            job: The finished job
+        """
+        if self.jobs.get(job.key) is job:
+            del self.jobs[job.key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get statistics about shared downloads.
+
+        Returns:
+            Dict[str, Any]: In-flight jobs, subscribers and deduplicated requests
+        """
+        return {
+            "jobs": len(self.jobs),
+            "subscribers": sum(len(job.subscribers) for job in self.jobs.values()),
+            "deduplicated": self.deduplicated
+        }
+
+# Global download registry
+download_registry = None
+
+def get_download_registry() -> DownloadRegistry:
+    """
+    Get or create the global download registry.
+
+    Returns:
+        DownloadRegistry: The global registry
+    """
+    global download_registry
+
+    if download_registry is None:
+        download_registry = DownloadRegistry()
+
+    return download_registry
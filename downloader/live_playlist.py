@@ -0,0 +1,285 @@
+import time
+import logging
+import asyncio
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+import aiohttp
+
+from downloader.playlist_stream import MediaPlaylist, parse_playlist
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Captured segments remembered by media sequence number, to recognize a restarted stream
+RECENT_SEGMENTS = 64
+
+class LivePlaylistMonitor:
+    """
+    Follows a live or EVENT media playlist and reports newly published segments.
+
+    The playlist is reloaded on a schedule derived from EXT-X-TARGETDURATION.
+    After a change the next reload is timed for when the following segment is
+    expected, so polling speeds up as the live edge comes due; while nothing
+    changes the interval backs off. Reloads are conditional requests (ETag /
+    Last-Modified) so an unchanged playlist costs a 304. Segments are
+    deduplicated by media sequence number. When the origin or encoder restarts
+    and the media sequence starts over, deduplication is re-anchored on the
+    new numbering.
+    """
+
+    def __init__(self, url: str, max_duration: float,
+                 stop_requested: Optional[Callable[[], bool]] = None,
+                 max_failures: int = 5):
+        """
+        Initialize the monitor.
+
+        Args:
+            url: Media playlist URL
+            max_duration: Stop after capturing this many seconds of media
+            stop_requested: Optional function returning True when the capture should stop
+            max_failures: Consecutive failed reloads after which the stream is considered gone
+        """
+        self.url = url
+        self.max_duration = max_duration
+        self.stop_requested = stop_requested or (lambda: False)
+        self.max_failures = max_failures
+        self.etag: Optional[str] = None
+        self.last_modified: Optional[str] = None
+        self.last_content: Optional[str] = None
+        self.next_sequence: Optional[int] = None
+        self.recent_uris: 'OrderedDict[int, str]' = OrderedDict()
+        self.captured_duration = 0.0
+        self.captured_segments = 0
+        self.reloads = 0
+        self.unchanged_reloads = 0
+        self.skipped_segments = 0
+        self.restarts = 0
+        self.end_reason: Optional[str] = None
+
+    async def batches(self, pool, playlist: MediaPlaylist) -> AsyncIterator[Tuple[MediaPlaylist, List[int]]]:
+        """
+        Yield new segments from the initial playlist and every reload.
+
+        Args:
+            pool: Connection pool instance
+            playlist: The media playlist as first loaded
+
+        Yields:
+            Tuple[MediaPlaylist, List[int]]: (playlist, positions of new segments in playlist.segments)
+        """
+        failures = 0
+        misses = 0
+        last_change = time.monotonic()
+
+        while True:
+            positions = self._new_positions(playlist)
+            if positions:
+                yield playlist, positions
+
+            if playlist.is_endlist:
+                self.end_reason = 'endlist'
+                break
+            if self.captured_duration >= self.max_duration:
+                self.end_reason = 'duration_limit'
+                break
+
+            # Wait for the next reload, waking up early if a stop is requested
+            delay = self._next_delay(playlist, bool(positions), misses, last_change)
+            if await self._sleep(delay):
+                self.end_reason = 'stopped'
+                break
+
+            content = await self._reload(pool)
+            if content is False:
+                failures += 1
+                misses += 1
+                if failures >= self.max_failures:
+                    logger.warning(f"Live playlist {self.url} failed {failures} reloads in a row, stopping capture")
+                    self.end_reason = 'unavailable'
+                    break
+                continue
+            failures = 0
+
+            if content is None:
+                # Unchanged playlist
+                misses += 1
+                self.unchanged_reloads += 1
+                continue
+
+            misses = 0
+            last_change = time.monotonic()
+            playlist = parse_playlist(content)
+
+    def _new_positions(self, playlist: MediaPlaylist) -> List[int]:
+        """
+        Pick the segments of a playlist that have not been seen yet.
+
+        Args:
+            playlist: Media playlist
+
+        Returns:
+            List[int]: Positions in playlist.segments, limited by the duration cap
+        """
+        first_sequence = playlist.media_sequence or 0
+        positions = []
+
+        if self._is_restart(playlist):
+            logger.warning(f"Live playlist {self.url} restarted at media sequence {first_sequence} "
+                           f"after {self.next_sequence - 1}, following the new numbering")
+            self.restarts += 1
+            self.next_sequence = None
+            self.recent_uris.clear()
+
+        for position, segment in enumerate(playlist.segments):
+            sequence = first_sequence + position
+            if self.next_sequence is not None and sequence < self.next_sequence:
+                continue
+
+            if self.next_sequence is not None and sequence > self.next_sequence:
+                # Segments slid out of the window before we saw them
+                missed = sequence - self.next_sequence
+                self.skipped_segments += missed
+                logger.warning(f"Live playlist {self.url} skipped {missed} segments before media sequence {sequence}")
+
+            if self.captured_duration >= self.max_duration:
+                break
+
+            positions.append(position)
+            self.next_sequence = sequence + 1
+            self.recent_uris[sequence] = segment.uri
+            if len(self.recent_uris) > RECENT_SEGMENTS:
+                self.recent_uris.popitem(last=False)
+            self.captured_duration += segment.duration or 0
+            self.captured_segments += 1
+
+        return positions
+
+    def _is_restart(self, playlist: MediaPlaylist) -> bool:
+        """
+        Check whether the media sequence of a playlist started over.
+
+        Args:
+            playlist: Media playlist
+
+        Returns:
+            bool: True if already captured sequence numbers now name other segments,
+                  or the playlist jumped back past every recently captured segment
+        """
+        if self.next_sequence is None or not playlist.segments:
+            return False
+
+        first_sequence = playlist.media_sequence or 0
+        if first_sequence >= self.next_sequence:
+            return False
+
+        # A stale copy of the playlist lists the same segments under the same numbers
+        for position, segment in enumerate(playlist.segments):
+            sequence = first_sequence + position
+            if sequence >= self.next_sequence:
+                break
+            uri = self.recent_uris.get(sequence)
+            if uri is not None:
+                return uri != segment.uri
+
+        return first_sequence + len(playlist.segments) < self.next_sequence - len(self.recent_uris)
+
+    def _next_delay(self, playlist: MediaPlaylist, changed: bool, misses: int, last_change: float) -> float:
+        """
+        Compute how long to wait before the next reload.
+
+        Args:
+            playlist: Current media playlist
+            changed: Whether the last load published new segments
+            misses: Number of consecutive unchanged reloads
+            last_change: Monotonic time the playlist last changed
+
+        Returns:
+            float: Delay in seconds
+        """
+        target = float(playlist.target_duration or 6)
+
+        if changed or misses == 0:
+            # The next segment is due about one segment duration after the last change
+            last_duration = playlist.segments[-1].duration if playlist.segments else target
+            due = last_change + (last_duration or target) - time.monotonic()
+            return max(0.5, min(target, due))
+
+        # Nothing new: start at half the target duration and back off from there
+        return min(target * 3, target / 2 * (1.5 ** (misses - 1)))
+
+    async def _sleep(self, delay: float) -> bool:
+        """
+        Sleep for a delay, checking for a stop request every half second.
+
+        Args:
+            delay: Delay in seconds
+
+        Returns:
+            bool: True if a stop was requested
+        """
+        deadline = time.monotonic() + delay
+        while True:
+            if self.stop_requested():
+                return True
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            await asyncio.sleep(min(0.5, remaining))
+
+    async def _reload(self, pool):
+        """
+        Reload the playlist with a conditional request.
+
+        Args:
+            pool: Connection pool instance
+
+        Returns:
+            The new content, None if unchanged, or False if the reload failed
+        """
+        headers = {
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+        }
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+
+        self.reloads += 1
+        try:
+            response = await pool.get(self.url, headers=headers)
+            async with response as response_context:
+                if response_context.status == 304:
+                    return None
+                if response_context.status != 200:
+                    logger.warning(f"Failed to reload live playlist {self.url}: HTTP {response_context.status}")
+                    return False
+
+                self.etag = response_context.headers.get('ETag', self.etag)
+                self.last_modified = response_context.headers.get('Last-Modified', self.last_modified)
+                content = (await response_context.read()).decode('utf-8', errors='replace')
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.warning(f"Error reloading live playlist {self.url}: {str(e) or type(e).__name__}")
+            return False
+
+        # Origins without validators still return identical bodies
+        if content == self.last_content:
+            return None
+        self.last_content = content
+        return content
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get statistics about the live capture.
+
+        Returns:
+            Dict[str, Any]: Live capture statistics
+        """
+        return {
+            "captured_duration": round(self.captured_duration, 1),
+            "captured_segments": self.captured_segments,
+            "reloads": self.reloads,
+            "unchanged_reloads": self.unchanged_reloads,
+            "skipped_segments": self.skipped_segments,
+            "restarts": self.restarts,
+            "end_reason": self.end_reason
+        }
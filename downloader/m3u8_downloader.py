@@ -4,30 +4,64 @@ import logging
 import asyncio
 import tempfile
 import m3u8
-import platform
-import subprocess
 import secrets
 import hashlib
-from typing import Optional, Dict, List, Tuple, Any
+import copy
+from typing import Optional, Dict, List, Set, Tuple, Any
 import aiohttp
-import aiofiles
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlparse
 import time
 
 from config.config import (
-    DOWNLOAD_PATH, CHUNK_SIZE, MAX_DOWNLOAD_SIZE, DOWNLOAD_TIMEOUT,
+    DOWNLOAD_PATH, CHUNK_SIZE, MAX_DOWNLOAD_SIZE, DOWNLOAD_TIMEOUT, CANCEL_GRACE_PERIOD,
     CONNECTION_POOL_MAX_CONNECTIONS, CONNECTION_POOL_MAX_KEEPALIVE,
     CONNECTION_POOL_TTL_DNS_CACHE, CONNECTION_POOL_TIMEOUT,
     CONNECTION_POOL_CONNECT_TIMEOUT,
-    CACHE_ENABLED, CACHE_TTL, CACHE_MAX_SIZE
+    CACHE_ENABLED, CACHE_TTL, CACHE_MAX_SIZE, RESOLVED_PLAYLIST_CACHE_ENABLED,
+    SEGMENT_WINDOW_SIZE, SEGMENT_GLOBAL_CONCURRENCY,
+    MERGE_MODE, MERGE_REORDER_BUFFER,
+    RESUME_ENABLED, RESUME_TTL,
+    KEY_CACHE_MAX_ENTRIES, BYTERANGE_COALESCE_MAX,
+    LIVE_CAPTURE_ENABLED, LIVE_MAX_DURATION,
+    VARIANT_POLICIES, VARIANT_MAX_HEIGHT,
+    ADAPTIVE_SWITCHING_ENABLED,
+    RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY, RETRY_BUDGET,
+    HEDGE_ENABLED, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES, HEDGE_MIN_DELAY,
+    MIRRORS_ENABLED, MIRROR_MAX_FAILURES, MIRROR_COOLDOWN,
+    AUDIO_TRACKS_ENABLED, AUDIO_LANGUAGE,
+    SEGMENT_CACHE_ENABLED, HOST_CONCURRENCY_ENABLED, PLAYLIST_STREAMING_ENABLED
 )
 from utils.helpers import (
-    active_downloads, fetch_content, sanitize_filename,
-    create_secure_temp_dir
+    active_downloads, fetch_content, stream_content, sanitize_filename, format_size,
+    create_secure_temp_dir, release_temp_dir, cleanup_stale_temp_dirs
 )
 from utils.connection_pool import get_connection_pool
 from utils.cache_manager import get_cache_manager
+from utils.result_cache import playlist_digest
+from utils.retry_policy import RetryPolicy, RetryBudget, get_circuit_breakers, parse_retry_after
+from utils.host_concurrency import HostConcurrencyController, get_host_concurrency
+from utils.bandwidth_governor import JobMeter, get_bandwidth_governor
 from utils.system_checks import check_ffmpeg
+from downloader.segment_scheduler import SegmentScheduler, get_global_segment_limiter
+from downloader.task_group import TaskGroup
+from downloader.segment_merger import SegmentMerger, TrackStream, create_merger
+from downloader.segment_journal import SegmentJournal
+from downloader.playlist_stream import MediaPlaylist, parse_playlist, pack_playlist, unpack_playlist
+from downloader.live_playlist import LivePlaylistMonitor
+from downloader.variant_selector import VariantCandidate, create_variant_selector, get_user_preference
+from downloader.download_registry import DownloadRegistry
+from downloader.rendition_switcher import RenditionSwitcher
+from downloader.segment_hedger import SegmentHedger, get_hedge_stats
+from downloader.mirror_set import Mirror, MirrorSet
+from downloader.segment_cache import SegmentCache, get_segment_cache, segment_cache_key
+from downloader.audio_rendition import (
+    AudioRendition, find_audio_renditions, select_audio_rendition, get_user_language,
+    is_audio_only_variant
+)
+from downloader.segment_ranges import parse_byterange, parse_byteranges, coalesce_ranges, split_range
+from downloader.segment_decryptor import (
+    METHOD_NONE, METHOD_AES_128, get_key_cache, segment_iv, decrypt_segment
+)
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -59,6 +93,28 @@ class M3U8Downloader:
         self.downloaded_segments = 0
         self.total_size = 0
         self.download_status = {}
+        self.playlist_url: Optional[str] = None
+        self.variant_url: Optional[str] = None
+        self.journal: Optional[SegmentJournal] = None
+        self.live_monitor: Optional[LivePlaylistMonitor] = None
+        self.variant_candidates: List[VariantCandidate] = []
+        self.current_variant: Optional[VariantCandidate] = None
+        self.mirror_candidates: List[VariantCandidate] = []
+        self.mirror_set: Optional[MirrorSet] = None
+        self.audio_rendition: Optional[AudioRendition] = None
+        self.audio_only = False
+        self.strip_video = False
+        self.retry_policy = RetryPolicy(RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY)
+        self.retry_budget = RetryBudget(RETRY_BUDGET)
+        self.hedger: Optional[SegmentHedger] = None
+        self.playlist_digest: Optional[str] = None
+        self.stream_finished = False
+        self.segment_cache: Optional[SegmentCache] = get_segment_cache() if SEGMENT_CACHE_ENABLED else None
+        self.host_limits: Optional[HostConcurrencyController] = (
+            get_host_concurrency() if HOST_CONCURRENCY_ENABLED else None
+        )
+        self.bandwidth: Optional[JobMeter] = None
+        self.tasks = TaskGroup(CANCEL_GRACE_PERIOD)
 
         # Create download directory if it doesn't exist and set secure permissions
         try:
@@ -72,13 +128,15 @@ class M3U8Downloader:
         except Exception as e:
             logger.warning(f"Could not set secure permissions on download directory: {str(e)}")
 
-    async def download_m3u8(self, url: str, output_filename: str) -> Tuple[bool, str, Optional[str]]:
+    async def download_m3u8(self, url: str, output_filename: str,
+                            audio_only: bool = False) -> Tuple[bool, str, Optional[str]]:
         """
         Download an M3U8 playlist and all its segments with enhanced security.
 
         Args:
             url: M3U8 URL
             output_filename: Output filename (will be sanitized)
+            audio_only: Download only the soundtrack, skipping video bytes where the playlist allows
 
         Returns:
             Tuple[bool, str, Optional[str]]: (success, message, output_path if successful)
@@ -101,117 +159,178 @@ class M3U8Downloader:
                 return False, "Invalid filename", None
 
             self.start_time = time.time()
+            self.tasks = TaskGroup(CANCEL_GRACE_PERIOD)
 
-            # Register this download
-            active_downloads[self.user_id] = {
+            # Register this download, keeping the entry that subscribers of a shared job point at
+            active_downloads.setdefault(self.user_id, {}).update({
                 'url': url,
                 'filename': output_filename,
                 'start_time': self.start_time,
                 'progress': 0,
-                'status': 'downloading'
-            }
-
-            # Try to get the M3U8 playlist from cache first if caching is enabled
-            content = None
-            if CACHE_ENABLED:
-                cache = get_cache_manager(
-                    cache_dir=os.path.join(DOWNLOAD_PATH, 'cache'),
-                    ttl=CACHE_TTL,
-                    max_size=CACHE_MAX_SIZE
-                )
-                content = await cache.get(url)
-                if content:
-                    logger.info(f"Using cached M3U8 content for {url}")
-
-            # If not in cache or caching is disabled, fetch from the URL
-            if not content:
-                content = await fetch_content(url)
-                if not content:
-                    return False, "Failed to fetch M3U8 content", None
-
-                # Cache the content if caching is enabled
-                if CACHE_ENABLED:
-                    await cache.set(url, content)
-                    logger.info(f"Cached M3U8 content for {url}")
-
-            playlist = m3u8.loads(content)
+                'status': 'downloading',
+                'audio_only': audio_only
+            })
+            self.audio_only = audio_only
+
+            # Meter received bytes against the global, per-user and fair-share limits
+            self.bandwidth = get_bandwidth_governor().register(self.user_id)
+
+            # Use a stable temp directory so an interrupted download can be resumed
+            self.playlist_url = url
+            if RESUME_ENABLED:
+                cleanup_stale_temp_dirs(RESUME_TTL)
+                self._use_resumable_temp_dir(url)
+
+            # A repeated request goes straight to its resolved segment table, skipping fetch, parse and selection
+            resolved = await self._load_resolved_playlist(url)
+            playlist = resolved[0] if resolved else await self._open_playlist(url)
+            if playlist is None:
+                return False, "Failed to fetch M3U8 content", None
 
             # Handle master playlist (with multiple quality options)
-            if playlist.is_variant:
-                # Choose the highest quality stream
-                playlist_url = self._get_best_playlist_url(playlist, url)
+            if resolved is not None:
+                # The chosen stream was restored along with its playlist
+                base_url = self._get_base_url(self.variant_url)
+            elif playlist.is_variant:
+                if audio_only:
+                    # Prefer a stream that carries no video at all
+                    playlist_url, content, error = await self._select_audio_source(playlist, url)
+                else:
+                    # Choose a stream through the configured selection policies
+                    playlist_url, content, error = await self._select_variant(playlist, url)
                 if not playlist_url:
-                    return False, "No valid streams found in the master playlist", None
+                    return False, error, None
 
-                # Try to get the actual playlist from cache first if caching is enabled
-                content = None
-                if CACHE_ENABLED:
-                    cache = get_cache_manager(
-                        cache_dir=os.path.join(DOWNLOAD_PATH, 'cache'),
-                        ttl=CACHE_TTL,
-                        max_size=CACHE_MAX_SIZE
-                    )
-                    content = await cache.get(playlist_url)
-                    if content:
-                        logger.info(f"Using cached M3U8 content for {playlist_url}")
-
-                # If not in cache or caching is disabled, fetch from the URL
-                if not content:
-                    content = await fetch_content(playlist_url)
-                    if not content:
-                        return False, f"Failed to fetch playlist: {playlist_url}", None
-
-                    # Cache the content if caching is enabled
-                    if CACHE_ENABLED:
-                        await cache.set(playlist_url, content)
-                        logger.info(f"Cached M3U8 content for {playlist_url}")
-
-                playlist = m3u8.loads(content)
+                playlist = await self._open_playlist(playlist_url, content)
+                if playlist is None:
+                    return False, f"Failed to fetch playlist: {playlist_url}", None
                 base_url = self._get_base_url(playlist_url)
+                self.variant_url = playlist_url
             else:
                 base_url = self._get_base_url(url)
+                self.variant_url = url
+                self.strip_video = audio_only
 
-            # Download all segments
+            # Live and EVENT playlists have no EXT-X-ENDLIST yet; follow them until they end
+            live = LIVE_CAPTURE_ENABLED and not playlist.is_endlist
+
+            # Download all segments; a VOD playlist may still be arriving and grow meanwhile
             self.total_segments = len(playlist.segments)
-            if self.total_segments == 0:
+            if self.total_segments == 0 and not live:
                 return False, "No segments found in the playlist", None
 
+            if live:
+                logger.info(f"Capturing live playlist {self.variant_url} for up to {LIVE_MAX_DURATION} seconds")
+                self.live_monitor = LivePlaylistMonitor(
+                    self.variant_url, LIVE_MAX_DURATION,
+                    stop_requested=self._live_stop_requested
+                )
+                active_downloads[self.user_id]['live'] = True
+                active_downloads[self.user_id]['live_duration'] = 0
+
+                # A cached window of a live playlist is stale by the next request
+                if CACHE_ENABLED:
+                    await self._get_playlist_cache().invalidate(self.variant_url)
+
+            # fMP4/CMAF playlists are joined byte-for-byte behind their init segment
+            init_section = self._get_init_section(playlist)
+            if init_section:
+                logger.info(f"Detected fMP4 playlist with init segment {init_section.uri}, skipping ffmpeg remux")
+
+            # An adaptive switch changes the selection while downloading; keep what was resolved
+            selection = self._selection_state()
+
             output_path = os.path.join(self.download_path, output_filename)
-            result = await self._download_segments(playlist, base_url, output_path)
+            result = await self._download_segments(playlist, base_url, output_path, init_section)
 
-            # Clean up
-            self._cleanup()
+            # Fingerprint what a finished VOD result is built from, for the completed-output cache
+            if result[0] and not live:
+                extra_urls = [self.audio_rendition.url] if self.audio_rendition else []
+                self.playlist_digest = resolved[1] if resolved else playlist_digest(playlist, extra_urls)
+                if resolved is None:
+                    await self._store_resolved_playlist(url, playlist, base_url, selection)
 
+            # Clean up, keeping stored segments of a failed download for a later resume
+            await self.tasks.close()
+            self._cleanup(keep_resumable=not result[0])
+
+            # Persist the segment cache index so its blobs survive a restart
+            if self.segment_cache is not None:
+                await self.segment_cache.save()
+
+            # The entry may be gone if the user who owned a shared download just cancelled
             if result[0]:
-                active_downloads[self.user_id]['status'] = 'completed'
-                active_downloads[self.user_id]['progress'] = 100
+                if self.user_id in active_downloads:
+                    active_downloads[self.user_id]['status'] = 'completed'
+                    active_downloads[self.user_id]['progress'] = 100
                 return True, f"Download completed: {output_filename}", output_path
             else:
-                active_downloads[self.user_id]['status'] = 'failed'
+                if self.user_id in active_downloads:
+                    active_downloads[self.user_id]['status'] = 'failed'
                 return False, result[1], None
 
+        except asyncio.CancelledError:
+            logger.info(f"Download for user {self.user_id} cancelled")
+            if self.user_id in active_downloads:
+                active_downloads[self.user_id]['status'] = 'cancelled'
+            # Every child fetch must be gone before the directory it writes to is deleted
+            await self.tasks.close()
+            self._cleanup()
+            raise
         except Exception as e:
             logger.error(f"Error downloading M3U8: {str(e)}")
             if self.user_id in active_downloads:
                 active_downloads[self.user_id]['status'] = 'failed'
-            self._cleanup()
+            await self.tasks.close()
+            self._cleanup(keep_resumable=True)
             return False, f"Error downloading M3U8: {str(e)}", None
-
-    async def _download_segments(self, playlist: m3u8.M3U8, base_url: str, output_path: str) -> Tuple[bool, str]:
+        finally:
+            await self.tasks.close()
+            # Early returns skip _cleanup; the directory must still become eligible for the stale sweep
+            release_temp_dir(self.temp_dir)
+            if self.bandwidth is not None:
+                get_bandwidth_governor().unregister(self.bandwidth)
+                self.bandwidth = None
+
+    async def _download_segments(self, playlist: MediaPlaylist, base_url: str, output_path: str,
+                                 init_section=None) -> Tuple[bool, str]:
         """
         Download all segments from a playlist and merge them using the connection pool.
 
         Args:
-            playlist: M3U8 playlist object
+            playlist: Media playlist, possibly still arriving
             base_url: Base URL for resolving relative segment URLs
             output_path: Path to save the merged file
+            init_section: EXT-X-MAP init segment of an fMP4 playlist, if any
 
         Returns:
             Tuple[bool, str]: (success, message)
         """
-        segment_files = []
         self.downloaded_segments = 0
 
+        # A separate audio rendition is followed for VOD only
+        if self.audio_rendition is not None and self.live_monitor is not None:
+            logger.warning(f"Ignoring separate audio rendition {self.audio_rendition.url} for a live capture")
+            self.audio_rendition = None
+
+        # The pipe backend starts ffmpeg before the audio track exists and only reads MPEG-TS
+        mode = 'fmp4' if init_section else MERGE_MODE
+        if mode == 'pipe' and (self.audio_rendition is not None or (self.audio_only and not self.strip_video)):
+            mode = 'stream'
+
+        merger = create_merger(
+            mode, self.temp_dir, self.timeout,
+            max_pending=MERGE_REORDER_BUFFER,
+            duration=sum(segment.duration or 0 for segment in playlist.segments),
+            progress_callback=self._update_merge_progress,
+            store_callback=self._record_segment
+        )
+        if self.strip_video:
+            merger.extract_audio()
+
+        audio_track: Optional[TrackStream] = None
+        streaming = cancelled = False
+        self.stream_finished = False
         try:
             # Get the connection pool
             pool = get_connection_pool(
@@ -222,206 +341,1494 @@ class M3U8Downloader:
                 connection_timeout=CONNECTION_POOL_CONNECT_TIMEOUT
             )
 
-            # Download each segment using the connection pool
-            download_tasks = []
+            # Issue segments in playlist order through a bounded sliding window
+            global_limiter = get_global_segment_limiter(SEGMENT_GLOBAL_CONCURRENCY)
+            scheduler = SegmentScheduler(
+                window_size=SEGMENT_WINDOW_SIZE,
+                global_limiter=global_limiter,
+                task_group=self.tasks
+            )
+
+            # Fetch the init segment once; it heads the output file
+            if init_section:
+                init_data = await self._download_init_section(pool, init_section, base_url)
+                if init_data is None:
+                    return False, "Failed to download init segment"
+                merger.set_init_segment(init_data)
+
+            # Segments of a VOD playlist that is still arriving are issued as they are parsed,
+            # unless something needs the whole list up front
+            streaming = isinstance(playlist, MediaPlaylist) and not playlist.complete
+            if streaming and not self._can_stream(merger):
+                await playlist.wait_complete()
+                streaming = False
+                self.total_segments = len(playlist.segments)
+                merger.duration = playlist.segments.total_duration()
+            if isinstance(playlist, MediaPlaylist) and playlist.error:
+                return False, playlist.error
+
+            # Pick up segments stored by an earlier, interrupted run of this job
+            resumed = await self._prepare_journal(playlist, merger)
+            self.downloaded_segments = len(resumed)
+
+            key_cache = get_key_cache(KEY_CACHE_MAX_ENTRIES)
+
+            # Stragglers get a duplicate request once they outlast their siblings
+            if HEDGE_ENABLED:
+                self.hedger = SegmentHedger(
+                    HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES, HEDGE_MIN_DELAY,
+                    stats=get_hedge_stats(), task_group=self.tasks, limiter=global_limiter
+                )
 
-            for i, segment in enumerate(playlist.segments):
-                segment_url = self._resolve_url(base_url, segment.uri)
-                segment_path = os.path.join(self.temp_dir, f"segment_{i:05d}.ts")
-                segment_files.append(segment_path)
+            switcher: Optional[RenditionSwitcher] = None
+            if self.live_monitor is None:
+                # The plan lists are replaced from the switch point on if the rendition changes
+                segment_keys: List[Optional[Tuple[str, bytes]]] = []
+                segment_urls: List[str] = []
+                segment_ranges: List[Optional[Tuple[int, int]]] = []
+                segment_durations: List[float] = []
+                segment_sequences: List[int] = []
+                media_sequence = playlist.media_sequence or 0
+                next_index = 0
+                # Duration of the segments from next_index on, kept up to date as segments are issued
+                remaining_duration = 0.0
+
+                def plan_segments(start: int, end: int) -> None:
+                    nonlocal remaining_duration
+                    segments = playlist.segments[start:end]
+                    if streaming:
+                        self._check_init_section(segments, init_section)
+
+                    # Resolve each segment's EXT-X-KEY as it is planned so unsupported methods fail early
+                    segment_keys.extend(
+                        self._get_segment_key(segment, media_sequence + start + p, base_url)
+                        for p, segment in enumerate(segments)
+                    )
 
-                task = asyncio.create_task(
-                    self._download_segment(pool, segment_url, segment_path, i)
+                    # Resolve EXT-X-BYTERANGE sub-ranges so single-file playlists use Range requests
+                    urls = [self._resolve_url(base_url, segment.uri) for segment in segments]
+                    previous = (segment_urls[-1], segment_ranges[-1][1]) if start and segment_ranges[-1] else None
+                    segment_ranges.extend(parse_byteranges(segments, urls, previous))
+                    segment_urls.extend(urls)
+
+                    durations = [segment.duration or 0 for segment in segments]
+                    segment_durations.extend(durations)
+                    remaining_duration += sum(durations)
+                    segment_sequences.extend(range(media_sequence + start, media_sequence + end))
+                    self.total_segments = len(segment_urls)
+
+                plan_segments(0, len(playlist.segments))
+
+                # Equivalent variants on other URLs share the segment load and take over on failure
+                if self.mirror_candidates:
+                    self.mirror_set = await self._build_mirror_set(playlist, segment_urls, segment_ranges)
+
+                # A separate audio rendition is fetched alongside the video through the same window
+                if self.audio_rendition is not None:
+                    audio_content = await self._fetch_playlist(self.audio_rendition.url)
+                    if not audio_content:
+                        return False, f"Failed to fetch audio playlist: {self.audio_rendition.url}"
+
+                    audio_playlist = parse_playlist(audio_content)
+                    audio_base_url = self._get_base_url(self.audio_rendition.url)
+                    audio_urls = [self._resolve_url(audio_base_url, segment.uri) for segment in audio_playlist.segments]
+                    audio_ranges = parse_byteranges(audio_playlist.segments, audio_urls)
+                    audio_keys = self._get_segment_keys(audio_playlist, audio_base_url)
+                    audio_durations = [segment.duration or 0 for segment in audio_playlist.segments]
+                    audio_downloaded = 0
+
+                    audio_track = TrackStream(
+                        self._audio_track_path(audio_playlist, audio_urls),
+                        max_pending=MERGE_REORDER_BUFFER
+                    )
+                    audio_init = self._get_init_section(audio_playlist)
+                    if audio_init:
+                        audio_track.header = await self._download_init_section(pool, audio_init, audio_base_url)
+                        if audio_track.header is None:
+                            return False, "Failed to download audio init segment"
+                    await audio_track.start()
+                    merger.add_track(audio_track.path)
+
+                def segment_entries():
+                    nonlocal next_index, remaining_duration
+                    while next_index < len(segment_urls):
+                        i = next_index
+                        next_index += 1
+                        remaining_duration -= segment_durations[i]
+                        if i not in resumed:
+                            yield i, segment_urls[i], segment_ranges[i]
+
+                def segment_jobs():
+                    # Adjacent sub-ranges of the same resource are fetched as one request
+                    return coalesce_ranges(segment_entries(), BYTERANGE_COALESCE_MAX)
+
+                async def streamed_segment_jobs():
+                    # Plan and issue each batch of segments as the playlist body arrives
+                    while True:
+                        if len(segment_urls) < len(playlist.segments):
+                            plan_segments(len(segment_urls), len(playlist.segments))
+                        for job in segment_jobs():
+                            yield job
+                        if playlist.complete and len(segment_urls) == len(playlist.segments):
+                            break
+                        await playlist.wait_for(len(segment_urls) + 1)
+
+                    if playlist.error:
+                        raise RuntimeError(playlist.error)
+                    await self._finish_streamed_playlist(playlist, merger)
+
+                switch_lock = asyncio.Lock()
+
+                # Stored segments of the current rendition would not fit in after a switch
+                last_resumed = max(resumed, default=-1)
+
+                async def maybe_switch() -> None:
+                    nonlocal remaining_duration
+                    # One switch decision at a time; segments keep flowing meanwhile
+                    if switch_lock.locked() or next_index <= last_resumed:
+                        return
+                    async with switch_lock:
+                        target = switcher.check(max(0.0, remaining_duration))
+                        if target is None:
+                            return
+
+                        content = await self._fetch_playlist(target.url)
+                        if not content:
+                            logger.warning(f"Could not load rendition {target.url}, staying on the current one")
+                            switcher.lower.remove(target)
+                            return
+
+                        # Segments up to next_index are already issued on the current rendition
+                        switch_index = next_index
+                        plan = self._plan_rendition_switch(
+                            parse_playlist(content), target.url, switch_index,
+                            segment_durations, segment_sequences
+                        )
+                        if plan is None:
+                            logger.warning(f"Rendition {target.url} is not aligned with the current one, staying")
+                            switcher.lower.remove(target)
+                            return
+
+                        urls, ranges, keys, durations, sequences = plan
+                        segment_urls[switch_index:] = urls
+                        segment_ranges[switch_index:] = ranges
+                        segment_keys[switch_index:] = keys
+                        segment_durations[switch_index:] = durations
+                        segment_sequences[switch_index:] = sequences
+                        remaining_duration = sum(segment_durations[next_index:])
+                        self.total_segments = len(segment_urls)
+
+                        switcher.switched(target)
+                        await self._on_rendition_switch(merger, target, switch_index)
+
+                if (
+                    ADAPTIVE_SWITCHING_ENABLED and merger.supports_switching and
+                    self.current_variant is not None and not self.audio_only
+                ):
+                    lower = [c for c in self.variant_candidates if c.bandwidth < self.current_variant.bandwidth]
+                    if lower:
+                        switcher = RenditionSwitcher(
+                            self.current_variant, lower,
+                            deadline=time.monotonic() + self.timeout
+                        )
+            else:
+                # Live segments are numbered in capture order as reloads publish them
+                segment_keys = []
+
+                async def segment_jobs():
+                    async for live_playlist, positions in self.live_monitor.batches(pool, playlist):
+                        urls = [self._resolve_url(base_url, segment.uri) for segment in live_playlist.segments]
+                        ranges = parse_byteranges(live_playlist.segments, urls)
+                        media_sequence = live_playlist.media_sequence or 0
+
+                        entries = []
+                        for position in positions:
+                            entries.append((len(segment_keys), urls[position], ranges[position]))
+                            segment_keys.append(self._get_segment_key(
+                                live_playlist.segments[position], media_sequence + position, base_url
+                            ))
+
+                        self.total_segments = len(segment_keys)
+                        if self.user_id in active_downloads:
+                            active_downloads[self.user_id]['live_duration'] = int(self.live_monitor.captured_duration)
+
+                        for job in coalesce_ranges(entries, BYTERANGE_COALESCE_MAX):
+                            yield job
+
+            async def download_audio_job(job) -> bool:
+                nonlocal audio_downloaded
+                segment_url, byte_range, members = job
+                data = await self._download_segment(pool, segment_url, members[0][0], byte_range, use_mirrors=False)
+                if data is None:
+                    return False
+
+                pieces = split_range(data, byte_range, members) if byte_range else [(members[0][0], data)]
+                for i, piece in pieces:
+                    if audio_keys[i] is not None:
+                        key_url, iv = audio_keys[i]
+                        key = await key_cache.get(key_url, lambda u: self._fetch_key(pool, u))
+                        piece = await decrypt_segment(piece, key, iv)
+                    await audio_track.add(i, piece)
+                    audio_downloaded += 1
+
+                return True
+
+            def interleaved_jobs():
+                # Issue audio and video in step with media time so neither track's buffer runs ahead
+                video_jobs = iter(segment_jobs())
+                audio_jobs = coalesce_ranges(
+                    ((i, audio_urls[i], audio_ranges[i]) for i in range(len(audio_urls))),
+                    BYTERANGE_COALESCE_MAX
                 )
-                download_tasks.append(task)
+                video_time = audio_time = 0.0
+                next_video = next(video_jobs, None)
+                next_audio = next(audio_jobs, None)
+                while next_video is not None or next_audio is not None:
+                    if next_audio is not None and (next_video is None or audio_time <= video_time):
+                        yield download_audio_job, next_audio
+                        audio_time += sum(audio_durations[i] for i, _ in next_audio[2])
+                        next_audio = next(audio_jobs, None)
+                    else:
+                        yield download_job, next_video
+                        video_time += sum(segment_durations[i] for i, _ in next_video[2])
+                        next_video = next(video_jobs, None)
+
+            async def download_tagged_job(tagged) -> bool:
+                job_function, job = tagged
+                return await job_function(job)
+
+            async def download_job(job) -> bool:
+                segment_url, byte_range, members = job
+                first_index = members[0][0]
+                data = await self._fetch_segment(pool, segment_url, first_index, byte_range)
+                if data is None:
+                    return False
+
+                # Watch throughput and drop to a lower rendition if the deadline is at risk
+                if switcher is not None:
+                    switcher.record(len(data), sum(segment_durations[i] for i, _ in members))
+                    await maybe_switch()
+
+                pieces = split_range(data, byte_range, members) if byte_range else [(first_index, data)]
+                for i, piece in pieces:
+                    # Decrypt AES-128 segments; the key is fetched once and shared
+                    if segment_keys[i] is not None:
+                        key_url, iv = segment_keys[i]
+                        key = await key_cache.get(key_url, lambda u: self._fetch_key(pool, u))
+                        piece = await decrypt_segment(piece, key, iv)
+
+                    # Hand the segment to the merger as soon as it lands
+                    await merger.add(i, piece)
+                    self.downloaded_segments += 1
+
+                    # Update progress
+                    if self.user_id in active_downloads:
+                        progress = int((self.downloaded_segments / self.total_segments) * 100)
+                        active_downloads[self.user_id]['progress'] = progress
+                        if self.bandwidth is not None:
+                            active_downloads[self.user_id]['rate'] = int(self.bandwidth.current_rate())
+                            active_downloads[self.user_id]['peak_rate'] = int(self.bandwidth.peak_rate)
+
+                return True
 
-            # Wait for all downloads to complete with timeout
+            # Check if FFmpeg is available before fetching anything
+            if merger.requires_ffmpeg:
+                ffmpeg_available, ffmpeg_message = check_ffmpeg()
+                if not ffmpeg_available:
+                    logger.error(f"FFmpeg not available: {ffmpeg_message}")
+                    return False, f"FFmpeg not available: {ffmpeg_message}"
+
+            await merger.start(output_path)
+
+            # Wait for all downloads to complete with timeout; a live capture may run for its full duration cap
+            timeout = self.timeout + (LIVE_MAX_DURATION if self.live_monitor else 0)
             try:
-                await asyncio.wait_for(asyncio.gather(*download_tasks), timeout=self.timeout)
+                if audio_track is not None:
+                    run = scheduler.run(interleaved_jobs(), download_tagged_job)
+                elif streaming:
+                    run = scheduler.run(streamed_segment_jobs(), download_job)
+                else:
+                    run = scheduler.run(segment_jobs(), download_job)
+                await asyncio.wait_for(run, timeout=timeout)
             except asyncio.TimeoutError:
-                return False, f"Download timed out after {self.timeout} seconds"
+                await merger.abort()
+                return False, f"Download timed out after {timeout} seconds"
+
+            if self.hedger is not None and self.hedger.hedged:
+                logger.info(f"Hedged segment requests for user {self.user_id}: {self.hedger.get_stats()}")
+            if self.mirror_set is not None:
+                logger.info(f"Mirror usage for user {self.user_id}: {self.mirror_set.get_stats()}")
+
+            if self.live_monitor is not None:
+                logger.info(f"Live capture for user {self.user_id} ended ({self.live_monitor.end_reason}): "
+                            f"{self.live_monitor.get_stats()}")
+                if self.total_segments == 0:
+                    await merger.abort()
+                    return False, "No segments were captured from the live stream"
+                merger.duration = self.live_monitor.captured_duration
 
             # Check if all segments were downloaded
             if self.downloaded_segments < self.total_segments:
+                await merger.abort()
                 return False, f"Only {self.downloaded_segments}/{self.total_segments} segments were downloaded"
 
+            if audio_track is not None:
+                await audio_track.close()
+                if audio_downloaded < len(audio_urls):
+                    await merger.abort()
+                    return False, f"Only {audio_downloaded}/{len(audio_urls)} audio segments were downloaded"
+
             # Merge segments
-            return await self._merge_segments(segment_files, output_path)
+            return await self._merge_segments(merger, output_path)
 
+        except asyncio.CancelledError:
+            # The scheduler has stopped the fetches; stop ffmpeg and close the stream file too
+            await merger.abort()
+            cancelled = True
+            raise
         except Exception as e:
             logger.error(f"Error downloading segments: {str(e)}")
+            await merger.abort()
             return False, f"Error downloading segments: {str(e)}"
+        finally:
+            if audio_track is not None:
+                await audio_track.close()
+            if self.journal is not None:
+                # A run that stopped while the playlist was arriving stays resumable once the rest is in
+                if streaming and not self.stream_finished and not cancelled:
+                    try:
+                        await asyncio.wait_for(playlist.wait_complete(), timeout=CANCEL_GRACE_PERIOD)
+                    except asyncio.TimeoutError:
+                        pass
+                    if playlist.complete and not playlist.error:
+                        await self._finish_streamed_playlist(playlist, merger)
+                await self.journal.close()
+
+    def _audio_track_path(self, playlist: MediaPlaylist, urls: List[str]) -> str:
+        """
+        Get the stream file path of a separate audio track.
+
+        Args:
+            playlist: Audio media playlist
+            urls: Resolved audio segment URLs
+
+        Returns:
+            str: Path in the temporary directory, with an extension ffmpeg can probe
+        """
+        if self._get_init_section(playlist):
+            extension = '.mp4'
+        else:
+            extension = os.path.splitext(urlparse(urls[0]).path)[1].lower() if urls else ''
+            if extension not in ('.aac', '.mp3', '.ac3', '.ec3'):
+                extension = '.ts'
+        return os.path.join(self.temp_dir, f"audio{extension}")
+
+    def _get_init_section(self, playlist: MediaPlaylist):
+        """
+        Get the EXT-X-MAP init segment shared by all segments of an fMP4 playlist.
+
+        Args:
+            playlist: Media playlist
+
+        Returns:
+            The init section, or None for MPEG-TS playlists
+
+        Raises:
+            ValueError: If segments use different init segments
+        """
+        sections = {}
+        for segment in playlist.segments:
+            section = segment.init_section
+            if section is not None:
+                sections[(section.uri, section.byterange)] = section
+
+        if not sections:
+            return None
+        if len(sections) > 1 or any(segment.init_section is None for segment in playlist.segments):
+            raise ValueError("Playlists that switch EXT-X-MAP init segments are not supported")
+
+        return next(iter(sections.values()))
+
+    def _check_init_section(self, segments, init_section) -> None:
+        """
+        Check that segments of a playlist still arriving use the init segment it started with.
+
+        Args:
+            segments: Newly parsed segments
+            init_section: Init section the download started with, if any
+
+        Raises:
+            ValueError: If a segment uses a different init segment
+        """
+        expected = (init_section.uri, init_section.byterange) if init_section else None
+        for segment in segments:
+            section = segment.init_section
+            if ((section.uri, section.byterange) if section else None) != expected:
+                raise ValueError("Playlists that switch EXT-X-MAP init segments are not supported")
+
+    def _can_stream(self, merger: SegmentMerger) -> bool:
+        """
+        Check whether segments can be issued before the whole media playlist is known.
+
+        Mirrors, a separate audio track and rendition switches are lined up
+        against the whole segment list, and a resume compares it with the
+        journal, so those wait for the playlist to finish.
+
+        Args:
+            merger: Merge backend that will receive the segments
+
+        Returns:
+            bool: True if segments can be issued as they are parsed
+        """
+        if self.mirror_candidates or self.audio_rendition is not None:
+            return False
+        if (
+            ADAPTIVE_SWITCHING_ENABLED and merger.supports_switching and
+            self.current_variant is not None and not self.audio_only
+        ):
+            return False
+        if RESUME_ENABLED and merger.supports_resume and os.path.exists(os.path.join(self.temp_dir, 'journal.jsonl')):
+            return False
+        return True
+
+    async def _finish_streamed_playlist(self, playlist: MediaPlaylist, merger: SegmentMerger) -> None:
+        """
+        Settle what depends on the whole segment list once a streamed playlist has arrived.
+
+        Args:
+            playlist: The completed media playlist
+            merger: Merge backend receiving the segments
+        """
+        self.stream_finished = True
+        merger.duration = playlist.segments.total_duration()
+        logger.info(f"Playlist {self.variant_url} finished arriving with {len(playlist.segments)} segments")
+
+        # The journal was started before the segment list was known
+        if self.journal is not None:
+            await self.journal.restate(self._journal_fingerprint(playlist), len(playlist.segments))
+
+    async def _download_init_section(self, pool, init_section, base_url: str) -> Optional[bytes]:
+        """
+        Download the EXT-X-MAP init segment of an fMP4 playlist.
+
+        Args:
+            pool: Connection pool instance
+            init_section: Init section from the playlist
+            base_url: Base URL for resolving a relative init segment URI
+
+        Returns:
+            Optional[bytes]: Init segment data if successful, None otherwise
+        """
+        url = self._resolve_url(init_section.base_uri or base_url, init_section.uri)
+
+        # An init segment byte range without an offset starts at the beginning of the resource
+        byte_range = parse_byterange(init_section.byterange, 0) if init_section.byterange else None
+
+        return await self._download_segment(pool, url, -1, byte_range, use_mirrors=False)
 
-    async def _download_segment(self, pool, url: str, path: str, index: int) -> bool:
+    def _plan_rendition_switch(self, playlist: MediaPlaylist, playlist_url: str, switch_index: int,
+                               durations: List[float], sequences: List[int]):
         """
-        Download a single segment using the connection pool with retries.
+        Map the remaining segments onto another rendition.
+
+        Renditions are aligned on media sequence number when the segment at
+        that number starts at the same time, and on timestamp otherwise.
+
+        Args:
+            playlist: Media playlist of the new rendition
+            playlist_url: URL of the new rendition's media playlist
+            switch_index: First segment index that is not yet issued
+            durations: Durations of the current plan
+            sequences: Media sequence numbers of the current plan
+
+        Returns:
+            Tuple of (urls, ranges, keys, durations, sequences) for the new rendition from the
+            switch point on, or None if the renditions cannot be aligned
+        """
+        segments = playlist.segments
+        if not segments or playlist.is_variant:
+            return None
+
+        # Start time of the switch point and of every segment in the new rendition
+        switch_time = sum(durations[:switch_index])
+        starts = []
+        elapsed = 0.0
+        for segment in segments:
+            starts.append(elapsed)
+            elapsed += segment.duration or 0
+        tolerance = max(0.5, (playlist.target_duration or 0) / 2)
+
+        media_sequence = playlist.media_sequence or 0
+        position = None
+        if switch_index < len(sequences):
+            candidate = sequences[switch_index] - media_sequence
+            if 0 <= candidate < len(segments) and abs(starts[candidate] - switch_time) <= tolerance:
+                position = candidate
+        if position is None:
+            nearest = min(range(len(segments)), key=lambda p: abs(starts[p] - switch_time))
+            if abs(starts[nearest] - switch_time) > tolerance:
+                return None
+            position = nearest
+
+        base_url = self._get_base_url(playlist_url)
+        try:
+            urls = [self._resolve_url(base_url, segment.uri) for segment in segments]
+            ranges = parse_byteranges(segments, urls)
+            keys = [
+                self._get_segment_key(segment, media_sequence + p, base_url)
+                for p, segment in enumerate(segments)
+            ]
+        except ValueError as e:
+            logger.warning(f"Cannot switch to {playlist_url}: {str(e)}")
+            return None
+
+        return (
+            urls[position:],
+            ranges[position:],
+            keys[position:],
+            [segment.duration or 0 for segment in segments[position:]],
+            [media_sequence + p for p in range(position, len(segments))]
+        )
+
+    async def _on_rendition_switch(self, merger: SegmentMerger, target: VariantCandidate,
+                                   switch_index: int) -> None:
+        """
+        Record a rendition switch and prepare the merge for it.
+
+        Args:
+            merger: Merge backend receiving the segments
+            target: The new rendition
+            switch_index: First segment index fetched from the new rendition
+        """
+        logger.info(f"Switched user {self.user_id} to {target.url} from segment {switch_index}")
+        self.current_variant = target
+        self.variant_url = target.url
+
+        # Mirrors are copies of the previous rendition
+        self.mirror_set = None
+        if self.user_id in active_downloads:
+            active_downloads[self.user_id].pop('mirrors', None)
+
+        # Mixed resolutions are scaled to the smallest one in a single encode pass
+        if target.width and target.height:
+            merger.output_size = (target.width, target.height)
+
+        # A resumed run would not know about the switch, so stop journaling
+        if self.journal is not None:
+            await self.journal.close()
+            try:
+                os.remove(self.journal.path)
+            except OSError:
+                pass
+            self.journal = None
+
+        if self.user_id in active_downloads:
+            active_downloads[self.user_id]['variant'] = target.describe()
+            active_downloads[self.user_id].setdefault('ladder', []).append(
+                {'from_segment': switch_index, **target.describe()}
+            )
+
+    async def _build_mirror_set(self, playlist: MediaPlaylist, segment_urls: List[str],
+                                segment_ranges: List[Optional[Tuple[int, int]]]) -> Optional[MirrorSet]:
+        """
+        Load the media playlists of the mirror candidates and keep the aligned ones.
+
+        A mirror is used only if its playlist lists the same segments: same media
+        sequence, same count, and the same byte ranges within the same resources.
+
+        Args:
+            playlist: Media playlist of the selected variant
+            segment_urls: Segment URLs of the selected variant
+            segment_ranges: Byte ranges of the selected variant
+
+        Returns:
+            Optional[MirrorSet]: The mirror set, or None if no mirror is usable
+        """
+        def resource_breaks(urls: List[str]) -> List[bool]:
+            return [urls[i] != urls[i - 1] for i in range(1, len(urls))]
+
+        mirrors = [Mirror(self.variant_url, segment_urls)]
+        for candidate in self.mirror_candidates:
+            content = await self._fetch_playlist(candidate.url)
+            if not content:
+                logger.warning(f"Could not load mirror {candidate.url}, ignoring it")
+                continue
+
+            mirror_playlist = parse_playlist(content)
+            base_url = self._get_base_url(candidate.url)
+            urls = [self._resolve_url(base_url, segment.uri) for segment in mirror_playlist.segments]
+            try:
+                ranges = parse_byteranges(mirror_playlist.segments, urls)
+            except ValueError:
+                ranges = None
+
+            if (
+                len(urls) != len(segment_urls) or
+                (mirror_playlist.media_sequence or 0) != (playlist.media_sequence or 0) or
+                ranges != segment_ranges or
+                resource_breaks(urls) != resource_breaks(segment_urls)
+            ):
+                logger.warning(f"Mirror {candidate.url} does not list the same segments, ignoring it")
+                continue
+
+            mirrors.append(Mirror(candidate.url, urls))
+
+        if len(mirrors) < 2:
+            return None
+
+        logger.info(f"Spreading segments over {len(mirrors)} mirrors for user {self.user_id}")
+        if self.user_id in active_downloads:
+            active_downloads[self.user_id]['mirrors'] = len(mirrors)
+        return MirrorSet(mirrors, MIRROR_MAX_FAILURES, MIRROR_COOLDOWN)
+
+    def _live_stop_requested(self) -> bool:
+        """
+        Check whether the user asked to stop a live capture.
+
+        Returns:
+            bool: True if the capture should stop
+        """
+        download = active_downloads.get(self.user_id)
+        return download is None or bool(download.get('stop_requested'))
+
+    def _get_segment_keys(self, playlist: MediaPlaylist, base_url: str) -> List[Optional[Tuple[str, bytes]]]:
+        """
+        Resolve the decryption key URL and IV of every segment in a playlist.
+
+        Each segment uses the most recent EXT-X-KEY before it, so keys may
+        rotate within a playlist.
+
+        Args:
+            playlist: Media playlist being downloaded
+            base_url: Base URL for resolving relative key URIs
+
+        Returns:
+            List[Optional[Tuple[str, bytes]]]: (key URL, IV) per segment, None if unencrypted
+
+        Raises:
+            ValueError: If a segment uses an unsupported encryption method
+        """
+        media_sequence = playlist.media_sequence or 0
+        return [
+            self._get_segment_key(segment, media_sequence + i, base_url)
+            for i, segment in enumerate(playlist.segments)
+        ]
+
+    def _get_segment_key(self, segment, sequence: int, base_url: str) -> Optional[Tuple[str, bytes]]:
+        """
+        Resolve the decryption key URL and IV of one segment.
+
+        Args:
+            segment: Playlist segment
+            sequence: Media sequence number of the segment
+            base_url: Base URL for resolving a relative key URI
+
+        Returns:
+            Optional[Tuple[str, bytes]]: (key URL, IV), None if the segment is unencrypted
+
+        Raises:
+            ValueError: If the segment uses an unsupported encryption method
+        """
+        key = segment.key
+        if key is None or not key.method or key.method.upper() == METHOD_NONE:
+            return None
+
+        if key.method.upper() != METHOD_AES_128:
+            raise ValueError(f"Unsupported encryption method: {key.method}")
+        if not key.uri:
+            raise ValueError(f"Encryption key for segment {sequence} has no URI")
+
+        key_url = self._resolve_url(key.base_uri or base_url, key.uri)
+        return key_url, segment_iv(key.iv, sequence)
+
+    async def _fetch_key(self, pool, url: str) -> bytes:
+        """
+        Download an AES-128 key using the connection pool with retries.
+
+        Args:
+            pool: Connection pool instance
+            url: Key URL
+
+        Returns:
+            bytes: Key data
+
+        Raises:
+            RuntimeError: If the key could not be downloaded
+        """
+        retries = 3
+        last_error = ""
+        for attempt in range(retries):
+            retry_after = None
+            try:
+                response = await pool.get(url)
+                async with response as response_context:
+                    if response_context.status == 200:
+                        return await response_context.read()
+                    last_error = f"HTTP {response_context.status}"
+                    if not self.retry_policy.is_retryable_status(response_context.status):
+                        break
+                    retry_after = parse_retry_after(response_context.headers.get('Retry-After'))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                last_error = str(e) or type(e).__name__
+
+            logger.warning(f"Failed to fetch key {url}: {last_error} (Attempt {attempt + 1}/{retries})")
+            if attempt < retries - 1:
+                await asyncio.sleep(self.retry_policy.backoff(attempt, retry_after))
+
+        raise RuntimeError(f"Failed to fetch decryption key: {last_error}")
+
+    async def _prepare_journal(self, playlist: MediaPlaylist, merger: SegmentMerger) -> Set[int]:
+        """
+        Open the segment journal for this job and adopt segments from an earlier run.
+
+        Args:
+            playlist: Media playlist being downloaded
+            merger: Merge backend that will receive the segments
+
+        Returns:
+            Set[int]: Indices of segments that are already stored
+        """
+        self.journal = None
+        if not RESUME_ENABLED or not merger.supports_resume or self.live_monitor is not None:
+            return set()
+
+        journal = SegmentJournal(os.path.join(self.temp_dir, 'journal.jsonl'))
+        fingerprint = self._journal_fingerprint(playlist)
+
+        resumed: Set[int] = set()
+        if journal.load() and journal.matches(self.playlist_url, self.variant_url, fingerprint, self.total_segments):
+            resumed = await merger.resume(journal.completed)
+            if resumed:
+                logger.info(f"Resuming download for user {self.user_id}: "
+                            f"{len(resumed)}/{self.total_segments} segments already stored")
+
+        await journal.begin(self.playlist_url, self.variant_url, fingerprint, self.total_segments, keep=resumed)
+        self.total_size += sum(journal.completed[i]['size'] for i in resumed)
+        self.journal = journal
+        return resumed
+
+    def _journal_fingerprint(self, playlist: MediaPlaylist) -> str:
+        """
+        Fingerprint the segment list of a media playlist for the journal.
+
+        Args:
+            playlist: Media playlist being downloaded
+
+        Returns:
+            str: Hex digest identifying the segment list
+        """
+        return SegmentJournal.fingerprint([
+            f"{segment.uri}@{segment.byterange}" if segment.byterange else segment.uri
+            for segment in playlist.segments
+        ])
+
+    async def _record_segment(self, index: int, data: bytes) -> None:
+        """
+        Record a stored segment in the journal.
+
+        Args:
+            index: Segment index
+            data: Segment data
+        """
+        if self.journal is not None:
+            await self.journal.record(index, data)
+
+    async def _fetch_segment(self, pool, url: str, index: int,
+                             byte_range: Optional[Tuple[int, int]] = None) -> Optional[bytes]:
+        """
+        Download a segment, hedging the request if it becomes a straggler.
+
+        Requests are not hedged while the download is held back by a bandwidth limit,
+        and a hedge waits while every global segment slot is busy.
 
         Args:
             pool: Connection pool instance
             url: Segment URL
-            path: Path to save the segment
             index: Segment index
+            byte_range: Optional (start, end) sub-range of the resource, end exclusive
 
         Returns:
-            bool: True if successful, False otherwise
+            Optional[bytes]: Segment data if successful, None otherwise
         """
-        retries = 10
+        # A duplicate of a request slowed by our own bandwidth limit would only compete with it
+        if self.hedger is None or (self.bandwidth is not None and self.bandwidth.is_throttled()):
+            return await self._download_segment(pool, url, index, byte_range)
+
+        # Cache hits are not raced and do not count as latency samples
+        data = await self._load_cached_segment(url, index, byte_range)
+        if data is not None:
+            return data
+
+        def discard(data: bytes) -> None:
+            # A copy that lost the race no longer counts towards the size limit
+            self.total_size -= len(data)
+
+        # The hedge starts on a mirror the original request has not used
+        claimed: List[Mirror] = []
+        data = await self.hedger.fetch(
+            lambda: self._download_segment(pool, url, index, byte_range, claimed, use_cache=False),
+            lambda: self._download_segment(pool, url, index, byte_range, claimed, use_cache=False),
+            discard=discard
+        )
+        if data is not None:
+            await self._store_cached_segment(url, byte_range, data)
+        return data
+
+    async def _load_cached_segment(self, url: str, index: int,
+                                   byte_range: Optional[Tuple[int, int]] = None) -> Optional[bytes]:
+        """
+        Read a segment from the shared segment cache.
+
+        Args:
+            url: Segment URL
+            index: Segment index
+            byte_range: Optional (start, end) sub-range of the resource, end exclusive
+
+        Returns:
+            Optional[bytes]: Cached segment data, or None on a miss
+        """
+        if self.segment_cache is None:
+            return None
+
+        data = await self.segment_cache.get(segment_cache_key(url, byte_range))
+        if data is None:
+            return None
+
+        # Cached bytes still count towards the size limit of this download
+        if self.total_size + len(data) > self.max_size:
+            logger.error(f"Download would exceed maximum size limit of {self.max_size} bytes")
+            return None
+        self.total_size += len(data)
+
+        logger.debug(f"Segment {index} served from the segment cache ({len(data)} bytes)")
+        return data
+
+    async def _store_cached_segment(self, url: str, byte_range: Optional[Tuple[int, int]],
+                                    data: bytes) -> None:
+        """
+        Add a fetched segment to the shared segment cache.
+
+        Args:
+            url: Segment URL the data was requested under
+            byte_range: Optional (start, end) sub-range of the resource, end exclusive
+            data: Segment data as fetched, before decryption
+        """
+        if self.segment_cache is not None:
+            await self.segment_cache.put(segment_cache_key(url, byte_range), data)
+
+    async def _download_segment(self, pool, url: str, index: int,
+                                byte_range: Optional[Tuple[int, int]] = None,
+                                claimed: Optional[List[Mirror]] = None,
+                                use_mirrors: bool = True, use_cache: bool = True) -> Optional[bytes]:
+        """
+        Download a single segment into memory using the connection pool with retries.
+
+        Transient failures are retried with jittered exponential backoff, honouring
+        Retry-After, while the download's retry budget lasts. Errors such as 403 or
+        404 fail at once, and so does a request to a host whose circuit is open.
+        With a mirror set, a failed request first fails over to a mirror this
+        segment has not tried yet, which costs no backoff and no retry budget.
+        The shared segment cache is consulted before any request is sent, and
+        requests wait for a slot under their host's adaptive concurrency limit.
+        Received chunks are metered by the bandwidth governor, which may pause
+        the read loop to keep the download within its share.
+
+        Args:
+            pool: Connection pool instance
+            url: Segment URL
+            index: Segment index (-1 for the init segment)
+            byte_range: Optional (start, end) sub-range of the resource, end exclusive
+            claimed: Mirrors already used by another copy of this request, extended with ours
+            use_mirrors: False for resources outside the mirrored rendition, such as init segments
+            use_cache: False if the caller consults and fills the segment cache itself
+
+        Returns:
+            Optional[bytes]: Segment data if successful, None otherwise
+        """
+        if use_cache:
+            data = await self._load_cached_segment(url, index, byte_range)
+            if data is not None:
+                return data
+
+        requested_url = url
+        policy = self.retry_policy
+        retries = policy.max_attempts
+        retry_after = None
+
+        mirror_set = self.mirror_set if use_mirrors else None
+        mirror = None
+        tried: List[Mirror] = []
+        if mirror_set is not None:
+            mirror = mirror_set.choose(exclude=claimed or ()) or mirror_set.choose()
+
         for attempt in range(retries):
+            if attempt > 0:
+                alternate = None
+                if mirror is not None:
+                    mirror_set.record_failure(mirror)
+                    tried.append(mirror)
+                    alternate = mirror_set.choose(exclude=tried)
+
+                if alternate is not None:
+                    logger.warning(f"Failing over segment {index} to mirror {alternate.playlist_url}")
+                    mirror = alternate
+                else:
+                    if not self.retry_budget.try_spend():
+                        logger.error(f"Retry budget of {self.retry_budget.total} exhausted, giving up on segment {index}")
+                        return None
+                    await asyncio.sleep(policy.backoff(attempt - 1, retry_after)) # Wait before retrying
+                    retry_after = None
+                    if mirror_set is not None:
+                        tried = []
+                        mirror = mirror_set.choose()
+
+            if mirror is not None:
+                url = mirror.segment_urls[index]
+                if claimed is not None:
+                    claimed.append(mirror)
+            breaker = get_circuit_breakers().get(url)
+
+            if not breaker.allow():
+                logger.warning(f"Circuit for {breaker.host} is open, not requesting segment {index} (Attempt {attempt + 1}/{retries})")
+                # Fail over if a mirror is left; waiting out the cool-down would only burn budget and backoff
+                if mirror is None or mirror_set.choose(exclude=tried + [mirror]) is None:
+                    return None
+                continue
+
+            loaded_mirror = None
+            limiter = None
             try:
                 headers = {
                     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
                 }
-
+                if byte_range:
+                    headers['Range'] = f"bytes={byte_range[0]}-{byte_range[1] - 1}"
+
+                if self.host_limits is not None:
+                    host_limiter = self.host_limits.get(url)
+                    await host_limiter.acquire()
+                    limiter = host_limiter
+
+                started = time.monotonic()
+                if mirror is not None:
+                    loaded_mirror = mirror
+                    mirror.in_flight += 1
                 response = await pool.get(url, headers=headers)
                 async with response as response_context:
-                    if response_context.status != 200:
+                    if byte_range and response_context.status == 206:
+                        pass
+                    elif response_context.status != 200:
                         logger.error(f"Failed to download segment {index}: HTTP {response_context.status} (Attempt {attempt + 1}/{retries})")
-                        print(f"[DEBUG] Failed to download segment {index}: HTTP {response_context.status} (Attempt {attempt + 1}/{retries})")
+                        if limiter is not None and response_context.status in (429, 503):
+                            # The host is throttling us
+                            limiter.record_congestion()
+                        if not policy.is_retryable_status(response_context.status):
+                            # The host is answering; the segment itself is missing or forbidden
+                            breaker.record_success()
+                            if mirror is None or mirror_set.choose(exclude=tried + [mirror]) is None:
+                                return None
+                            continue
+                        breaker.record_failure()
+                        retry_after = parse_retry_after(response_context.headers.get('Retry-After'))
                         continue
 
                     # Check content length if available
                     content_length = response_context.content_length
                     if content_length and self.total_size + content_length > self.max_size:
                         logger.error(f"Download would exceed maximum size limit of {self.max_size} bytes")
-                        print(f"[DEBUG] Segment {index} exceeds max size.")
-                        return False
+                        logger.debug(f"Segment {index} exceeds max size.")
+                        breaker.record_success()
+                        return None
 
-                    async with aiofiles.open(path, 'wb') as f:
-                        print(f"[DEBUG] Writing segment {index} to {path} (Attempt {attempt + 1}/{retries})")
+                    data = bytearray()
+                    throttled = 0.0
+                    try:
                         async for chunk in response_context.content.iter_chunked(self.chunk_size):
-                            await f.write(chunk)
+                            data.extend(chunk)
                             self.total_size += len(chunk)
+                            if self.bandwidth is not None:
+                                throttled += await self.bandwidth.consume(len(chunk), self.user_id)
 
                             # Check if we've exceeded the maximum size
                             if self.total_size > self.max_size:
                                 logger.error(f"Download exceeded maximum size limit of {self.max_size} bytes")
-                                print(f"[DEBUG] Segment {index} exceeded max size during write.")
-                                return False
-
-                    print(f"[DEBUG] Finished writing segment {index} to {path} (Attempt {attempt + 1}/{retries})")
-                    self.downloaded_segments += 1
-
-                    # Update progress
-                    if self.user_id in active_downloads:
-                        progress = int((self.downloaded_segments / self.total_segments) * 100)
-                        active_downloads[self.user_id]['progress'] = progress
-
-                    return True # Success
+                                logger.debug(f"Segment {index} exceeded max size during download.")
+                                breaker.record_success()
+                                return None
+                    except BaseException:
+                        # Don't count a partial body towards the size limit before retrying
+                        self.total_size -= len(data)
+                        raise
+
+                    if byte_range:
+                        if response_context.status == 200:
+                            # The server ignored the Range header; cut the range out of the full body
+                            self.total_size -= len(data)
+                            data = data[byte_range[0]:byte_range[1]]
+                            self.total_size += len(data)
+
+                        if len(data) != byte_range[1] - byte_range[0]:
+                            self.total_size -= len(data)
+                            logger.error(f"Short byte range for segment {index}: got {len(data)} of {byte_range[1] - byte_range[0]} bytes (Attempt {attempt + 1}/{retries})")
+                            breaker.record_failure()
+                            continue
+
+                    # Time spent paused by our own bandwidth limits says nothing about the host
+                    breaker.record_success()
+                    latency = max(time.monotonic() - started - throttled, 0.0)
+                    if limiter is not None:
+                        limiter.record_success(latency, len(data))
+                    if mirror is not None:
+                        mirror.record_success(len(data), latency)
+                    logger.debug(f"Finished downloading segment {index} ({len(data)} bytes, attempt {attempt + 1}/{retries})")
+                    data = bytes(data)
+                    if use_cache:
+                        await self._store_cached_segment(requested_url, byte_range, data)
+                    return data # Success
 
             except aiohttp.ClientError as e:
+                breaker.record_failure()
+                if limiter is not None:
+                    limiter.record_congestion()
                 logger.warning(f"Client error downloading segment {index} (Attempt {attempt + 1}/{retries}): {str(e)}")
-                print(f"[DEBUG] Client error downloading segment {index} (Attempt {attempt + 1}/{retries}): {str(e)}")
             except asyncio.TimeoutError:
+                breaker.record_failure()
+                if limiter is not None:
+                    limiter.record_congestion()
                 logger.warning(f"Timeout downloading segment {index} (Attempt {attempt + 1}/{retries})")
-                print(f"[DEBUG] Timeout downloading segment {index} (Attempt {attempt + 1}/{retries})")
             except Exception as e:
+                breaker.record_failure()
                 logger.warning(f"Error downloading segment {index} (Attempt {attempt + 1}/{retries}): {str(e)}")
-                print(f"[DEBUG] Error downloading segment {index} (Attempt {attempt + 1}/{retries}): {str(e)}")
-
-            if attempt < retries - 1:
-                await asyncio.sleep(2) # Wait before retrying
+            finally:
+                if loaded_mirror is not None:
+                    loaded_mirror.in_flight -= 1
+                if limiter is not None:
+                    limiter.release()
 
         logger.error(f"Failed to download segment {index} after {retries} attempts.")
-        print(f"[DEBUG] Failed to download segment {index} after {retries} attempts.")
-        return False # Failure after retries
+        return None # Failure after retries
 
-    async def _merge_segments(self, segment_files: List[str], output_path: str) -> Tuple[bool, str]:
+    async def _merge_segments(self, merger: SegmentMerger, output_path: str) -> Tuple[bool, str]:
         """
         Merge downloaded segments into a single file.
 
         Args:
-            segment_files: List of segment file paths
+            merger: Merge backend that received the segments
             output_path: Path to save the merged file
 
         Returns:
             Tuple[bool, str]: (success, message)
         """
         try:
-            # Check if FFmpeg is available
-            ffmpeg_available, ffmpeg_message = check_ffmpeg()
-            if not ffmpeg_available:
-                logger.error(f"FFmpeg not available: {ffmpeg_message}")
-                return False, f"FFmpeg not available: {ffmpeg_message}"
-
-            # Create a file list for ffmpeg
-            file_list_path = os.path.join(self.temp_dir, "filelist.txt")
-
-            # Use platform-safe path handling
-            file_list_path = os.path.normpath(file_list_path)
-
-            async with aiofiles.open(file_list_path, 'w') as f:
-                for segment_file in segment_files:
-                    if os.path.exists(segment_file):
-                        # Normalize path for the current platform
-                        normalized_path = os.path.normpath(segment_file)
-                        # Escape backslashes in Windows paths for the filelist.txt
-                        if platform.system().lower() == 'windows':
-                            normalized_path = normalized_path.replace('\\', '\\\\')
-                        await f.write(f"file '{normalized_path}'\n")
-
-            # Use ffmpeg to concatenate the segments
-            cmd = [
-                'ffmpeg', '-y', '-f', 'concat', '-safe', '0',
-                '-i', file_list_path, '-c', 'copy', output_path
-            ]
+            if self.user_id in active_downloads:
+                active_downloads[self.user_id]['phase'] = 'merging'
+                active_downloads[self.user_id]['merge_progress'] = 0
+
+            return await merger.finish(output_path)
+
+        except Exception as e:
+            logger.error(f"Error merging segments: {str(e)}")
+            await merger.abort()
+            return False, f"Error merging segments: {str(e)}"
+
+    def _update_merge_progress(self, progress: Dict[str, Any]) -> None:
+        """
+        Record ffmpeg merge progress in the active downloads registry.
+
+        Args:
+            progress: Parsed ffmpeg progress block
+        """
+        if self.user_id in active_downloads and 'percent' in progress:
+            active_downloads[self.user_id]['merge_progress'] = progress['percent']
+
+    def _get_playlist_cache(self):
+        """
+        Get the cache manager used for playlist content.
+
+        Returns:
+            CacheManager: The global cache manager
+        """
+        return get_cache_manager(
+            cache_dir=os.path.join(DOWNLOAD_PATH, 'cache'),
+            ttl=CACHE_TTL,
+            max_size=CACHE_MAX_SIZE
+        )
+
+    async def _fetch_playlist(self, url: str) -> Optional[str]:
+        """
+        Fetch playlist content, using the cache if caching is enabled.
+
+        Args:
+            url: Playlist URL
+
+        Returns:
+            Optional[str]: Playlist content or None if it could not be fetched
+        """
+        # Try to get the playlist from cache first if caching is enabled
+        if CACHE_ENABLED:
+            content = await self._get_playlist_cache().get(url)
+            if content:
+                logger.info(f"Using cached M3U8 content for {url}")
+                return content
+
+        # If not in cache or caching is disabled, fetch from the URL
+        content = await fetch_content(url)
+        if content and CACHE_ENABLED:
+            await self._get_playlist_cache().set(url, content)
+            logger.info(f"Cached M3U8 content for {url}")
+
+        return content
+
+    async def _open_playlist(self, url: str, content: Optional[str] = None):
+        """
+        Load a playlist, parsing media playlists into a compact segment table.
+
+        A playlist that is neither given nor cached is parsed while it
+        downloads, and a VOD media playlist is returned as soon as its first
+        segments are known while the rest keeps arriving in the background.
 
-            # Create process with appropriate settings for the platform
+        Args:
+            url: Playlist URL
+            content: Playlist content if it was already fetched
+
+        Returns:
+            The m3u8 master playlist, the MediaPlaylist, or None if it could not be fetched
+        """
+        if content is None and PLAYLIST_STREAMING_ENABLED:
+            return await self._stream_playlist(url)
+
+        if content is None:
+            content = await self._fetch_playlist(url)
+            if not content:
+                return None
+
+        playlist = parse_playlist(content)
+        return m3u8.loads(content) if playlist.is_variant else playlist
+
+    async def _stream_playlist(self, url: str):
+        """
+        Fetch a playlist, parsing it as its body arrives.
+
+        Args:
+            url: Playlist URL
+
+        Returns:
+            The m3u8 master playlist, the MediaPlaylist, or None if it could not be fetched
+        """
+        if CACHE_ENABLED:
+            content = await self._get_playlist_cache().get(url)
+            if content:
+                logger.info(f"Using cached M3U8 content for {url}")
+                return await self._open_playlist(url, content)
+
+        playlist = MediaPlaylist()
+
+        # The raw body is kept only while it may be needed: for the cache, or to load a master playlist
+        body: Optional[bytearray] = bytearray()
+        size = 0
+
+        def feed(chunk: bytes) -> None:
+            nonlocal body, size
+            size += len(chunk)
+            playlist.feed(chunk)
+            if body is not None:
+                body += chunk
+                if not CACHE_ENABLED and len(playlist.segments) > 0:
+                    body = None
+
+        async def fetch() -> Optional[str]:
+            received = False
             try:
-                # For Windows, we need to set shell=True if ffmpeg is not in PATH
-                if platform.system().lower() == 'windows':
-                    process = subprocess.Popen(
-                        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                        text=True, errors='replace'
-                    )
+                # An empty body counts as a failed fetch, as it does for fetch_content callers
+                received = await stream_content(url, feed) and size > 0
+                if not received or body is None:
+                    return None
+
+                content = body.decode('utf-8', errors='replace')
+                if content and CACHE_ENABLED:
+                    await self._get_playlist_cache().set(url, content)
+                    logger.info(f"Cached M3U8 content for {url}")
+                return content
+            finally:
+                if received:
+                    playlist.close()
                 else:
-                    process = subprocess.Popen(
-                        cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                        text=True, errors='replace'
-                    )
+                    playlist.fail(f"Failed to fetch playlist: {url}")
 
-                _, stderr = process.communicate(timeout=self.timeout)
+        # The body keeps downloading in the download's task group
+        task = self.tasks.spawn(fetch())
+        await playlist.wait_ready()
 
-                if process.returncode != 0:
-                    logger.error(f"FFmpeg error: {stderr}")
-                    return False, f"Error merging segments: FFmpeg failed with code {process.returncode}"
+        if playlist.is_variant:
+            content = await task
+            return m3u8.loads(content) if content else None
+        if playlist.error:
+            return None
+        return playlist
 
-                return True, "Segments merged successfully"
+    def _resolved_playlist_key(self, url: str) -> str:
+        """
+        Build the identity a request's resolved playlist is cached under.
 
-            except subprocess.TimeoutExpired:
-                process.kill()
-                logger.error("FFmpeg process timed out")
-                return False, "FFmpeg process timed out"
+        Every setting that steers stream selection is part of it, so changing
+        one resolves the playlist afresh.
 
-        except Exception as e:
-            logger.error(f"Error merging segments: {str(e)}")
-            return False, f"Error merging segments: {str(e)}"
+        Args:
+            url: Requested playlist URL
+
+        Returns:
+            str: Request identity
+        """
+        request = DownloadRegistry.make_key(
+            url, self.audio_only, get_user_preference(self.user_id), get_user_language(self.user_id)
+        )
+        settings = [
+            ','.join(VARIANT_POLICIES), VARIANT_MAX_HEIGHT, self.max_size, AUDIO_LANGUAGE,
+            MIRRORS_ENABLED, AUDIO_TRACKS_ENABLED
+        ]
+        return '|'.join([request] + [str(setting) for setting in settings])
+
+    def _selection_state(self) -> Dict[str, Any]:
+        """
+        Capture the stream selection made for this download.
+
+        Returns:
+            Dict[str, Any]: JSON-serializable selection, restored by _restore_selection_state
+        """
+        entry = active_downloads.get(self.user_id, {})
+        rendition = self.audio_rendition
+        return {
+            'variant_url': self.variant_url,
+            'strip_video': self.strip_video,
+            'variants': [[c.url, c.bandwidth, c.width, c.height] for c in self.variant_candidates],
+            'current': (
+                self.variant_candidates.index(self.current_variant)
+                if self.current_variant in self.variant_candidates else None
+            ),
+            'mirrors': [self.variant_candidates.index(c) for c in self.mirror_candidates],
+            'audio': (
+                [rendition.url, rendition.group_id, rendition.language, rendition.name, rendition.default]
+                if rendition is not None else None
+            ),
+            'progress': {
+                name: copy.deepcopy(entry[name])
+                for name in ('variant', 'estimated_size', 'ladder', 'audio') if name in entry
+            }
+        }
+
+    def _restore_selection_state(self, state: Dict[str, Any]) -> None:
+        """
+        Restore a stream selection captured by _selection_state.
+
+        Args:
+            state: Captured selection
+        """
+        candidates = [
+            VariantCandidate(url, bandwidth=bandwidth, width=width, height=height)
+            for url, bandwidth, width, height in state['variants']
+        ]
+        self.variant_url = state['variant_url']
+        self.strip_video = state['strip_video']
+        self.variant_candidates = candidates
+        self.current_variant = candidates[state['current']] if state['current'] is not None else None
+        self.mirror_candidates = [candidates[i] for i in state['mirrors']]
+
+        audio = state['audio']
+        self.audio_rendition = None
+        if audio is not None:
+            url, group_id, language, name, default = audio
+            self.audio_rendition = AudioRendition(url, group_id, language=language, name=name, default=default)
+
+        if self.user_id in active_downloads:
+            active_downloads[self.user_id].update(state['progress'])
+
+    async def _load_resolved_playlist(self, url: str) -> Optional[Tuple[MediaPlaylist, str]]:
+        """
+        Load the resolved playlist of an earlier identical request and restore its stream selection.
+
+        Args:
+            url: Requested playlist URL
+
+        Returns:
+            Optional[Tuple[MediaPlaylist, str]]: (playlist with absolute URIs, digest of its segment list),
+            or None if there is none
+        """
+        if not (CACHE_ENABLED and RESOLVED_PLAYLIST_CACHE_ENABLED):
+            return None
 
-    def _get_best_playlist_url(self, playlist: m3u8.M3U8, base_url: str) -> Optional[str]:
+        data = await self._get_playlist_cache().get_parsed(self._resolved_playlist_key(url))
+        if data is None:
+            return None
+
+        try:
+            playlist, metadata = unpack_playlist(data)
+            self._restore_selection_state(metadata['selection'])
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable resolved playlist for {url}: {str(e)}")
+            return None
+
+        logger.info(f"Using cached resolved playlist for {url}: "
+                    f"{len(playlist.segments)} segments of {self.variant_url}")
+        return playlist, metadata['digest']
+
+    async def _store_resolved_playlist(self, url: str, playlist: MediaPlaylist, base_url: str,
+                                       selection: Dict[str, Any]) -> None:
+        """
+        Cache the resolved playlist of a finished download for identical requests.
+
+        The entry is tied to the text of the media playlist, so it is dropped
+        once that playlist is fetched with different content.
+
+        Args:
+            url: Requested playlist URL
+            playlist: Media playlist that was downloaded
+            base_url: Base URL its URIs are relative to
+            selection: Stream selection captured before the download started
+        """
+        if not (CACHE_ENABLED and RESOLVED_PLAYLIST_CACHE_ENABLED):
+            return
+
+        # Only a fully parsed playlist that will not grow stays valid until its text changes
+        if not isinstance(playlist, MediaPlaylist) or not playlist.complete or playlist.error or not playlist.is_endlist:
+            return
+
+        resolved = playlist.resolve(lambda uri: self._resolve_url(base_url, uri))
+        data = pack_playlist(resolved, {'selection': selection, 'digest': self.playlist_digest})
+        await self._get_playlist_cache().set_parsed(
+            self._resolved_playlist_key(url), data, selection['variant_url'], playlist.text_digest()
+        )
+
+    async def _select_audio_source(self, playlist: m3u8.M3U8, base_url: str) -> Tuple[Optional[str], Optional[str], str]:
         """
-        Get the URL of the highest quality playlist from a master playlist.
+        Choose what to download for an audio-only job.
+
+        An audio-only variant is preferred, then an EXT-X-MEDIA audio rendition
+        of the best variant's group. Failing both, the smallest variant is
+        downloaded and its audio track is extracted during the merge.
 
         Args:
             playlist: M3U8 master playlist
             base_url: Base URL for resolving relative URLs
 
         Returns:
-            Optional[str]: URL of the highest quality playlist or None
+            Tuple[Optional[str], Optional[str], str]: (media playlist URL, content if already fetched, error message)
         """
-        if not playlist.playlists:
-            return None
+        variants = sorted(
+            (p for p in playlist.playlists if p.stream_info),
+            key=lambda p: p.stream_info.bandwidth or 0, reverse=True
+        )
+
+        audio_variants = [p for p in variants if is_audio_only_variant(p.stream_info.codecs)]
+        if audio_variants:
+            source_url = self._resolve_url(base_url, audio_variants[0].uri)
+            description = {'url': source_url, 'bandwidth': audio_variants[0].stream_info.bandwidth or 0}
+        else:
+            groups = [p.stream_info.audio for p in variants if p.stream_info.audio]
+            renditions = find_audio_renditions(playlist, groups[0] if groups else None, base_url, self._resolve_url)
+            rendition = select_audio_rendition(renditions, get_user_language(self.user_id) or AUDIO_LANGUAGE or None)
+            if rendition is None:
+                logger.info("No audio-only stream in the master playlist, extracting audio from the smallest variant")
+                self.strip_video = True
+                return await self._select_variant(playlist, base_url, preference='smallest')
+            source_url = rendition.url
+            description = rendition.describe()
+
+        logger.info(f"Selected audio-only stream {source_url}")
+        if self.user_id in active_downloads:
+            active_downloads[self.user_id]['audio'] = description
+
+        return source_url, None, ""
+
+    async def _select_variant(self, playlist: m3u8.M3U8, base_url: str,
+                              preference: Optional[str] = None) -> Tuple[Optional[str], Optional[str], str]:
+        """
+        Choose a variant of a master playlist through the variant selection policies.
+
+        The media playlist of the highest variant is loaded to learn the total
+        duration, so every variant's size can be estimated as bandwidth x duration.
+
+        Args:
+            playlist: M3U8 master playlist
+            base_url: Base URL for resolving relative URLs
+            preference: Quality preference overriding the user's, if any
 
-        # Sort playlists by bandwidth (highest first)
-        sorted_playlists = sorted(
-            playlist.playlists,
-            key=lambda p: p.stream_info.bandwidth if p.stream_info else 0,
-            reverse=True
+        Returns:
+            Tuple[Optional[str], Optional[str], str]: (variant URL, media playlist content if already fetched,
+            error message)
+        """
+        candidates = []
+        audio_groups = {}
+        for p in playlist.playlists:
+            stream_info = p.stream_info
+            resolution = stream_info.resolution if stream_info and stream_info.resolution else (0, 0)
+            variant_url = self._resolve_url(base_url, p.uri)
+            audio_groups[variant_url] = stream_info.audio if stream_info else None
+            candidates.append(VariantCandidate(
+                variant_url,
+                bandwidth=(stream_info.bandwidth or 0) if stream_info else 0,
+                width=resolution[0],
+                height=resolution[1]
+            ))
+
+        if not candidates:
+            return None, None, "No valid streams found in the master playlist"
+
+        # Learn the duration from the highest variant; all variants share one timeline
+        candidates.sort(key=lambda c: c.bandwidth, reverse=True)
+        contents = {candidates[0].url: await self._fetch_playlist(candidates[0].url)}
+        duration = 0.0
+        if contents[candidates[0].url]:
+            media_playlist = parse_playlist(contents[candidates[0].url])
+            if media_playlist.is_endlist or not LIVE_CAPTURE_ENABLED:
+                duration = sum(segment.duration or 0 for segment in media_playlist.segments)
+            else:
+                duration = LIVE_MAX_DURATION
+
+        selector = create_variant_selector(
+            VARIANT_POLICIES, self.max_size, VARIANT_MAX_HEIGHT,
+            preference=preference or get_user_preference(self.user_id)
         )
+        chosen = selector.select(candidates, duration)
+        if chosen is None:
+            smallest = min(candidates, key=lambda c: c.bandwidth)
+            return None, None, (
+                f"Even the smallest stream (about {format_size(smallest.estimate_size(duration))}) "
+                f"exceeds the {format_size(self.max_size)} download limit"
+            )
 
-        # Return the URL of the highest bandwidth playlist
-        for p in sorted_playlists:
-            return self._resolve_url(base_url, p.uri)
+        estimated_size = chosen.estimate_size(duration) if duration else None
+        logger.info(f"Selected variant {chosen.url} ({chosen.bandwidth} bps, "
+                    f"estimated {format_size(estimated_size) if estimated_size else 'unknown'})")
+        if self.user_id in active_downloads:
+            active_downloads[self.user_id]['variant'] = chosen.describe()
+            active_downloads[self.user_id]['estimated_size'] = estimated_size
+            active_downloads[self.user_id]['ladder'] = [{'from_segment': 0, **chosen.describe()}]
+
+        # Keep the ladder around for adaptive switching
+        self.variant_candidates = candidates
+        self.current_variant = chosen
+
+        # Variants with the same bandwidth and resolution are redundant copies on other URLs
+        if MIRRORS_ENABLED:
+            self.mirror_candidates = [
+                c for c in candidates
+                if c.url != chosen.url and c.bandwidth == chosen.bandwidth and c.height == chosen.height
+            ]
+
+        # Variants with a separate audio group would otherwise come out silent
+        if AUDIO_TRACKS_ENABLED:
+            renditions = find_audio_renditions(playlist, audio_groups.get(chosen.url), base_url, self._resolve_url)
+            self.audio_rendition = select_audio_rendition(
+                renditions, get_user_language(self.user_id) or AUDIO_LANGUAGE or None
+            )
+            if self.audio_rendition is not None:
+                logger.info(f"Selected audio rendition {self.audio_rendition.url} "
+                            f"({self.audio_rendition.language or 'unknown language'})")
+                if self.user_id in active_downloads:
+                    active_downloads[self.user_id]['audio'] = self.audio_rendition.describe()
 
-        return None
+        # Any other variant is fetched, and parsed as it arrives, by the caller
+        return chosen.url, contents.get(chosen.url), ""
 
     def _get_base_url(self, url: str) -> str:
         """
@@ -450,10 +1857,39 @@ class M3U8Downloader:
             return uri
         return urljoin(base_url, uri)
 
-    def _cleanup(self) -> None:
+    def _use_resumable_temp_dir(self, url: str) -> None:
+        """
+        Switch to the stable temp directory of this user's job for a URL.
+
+        Args:
+            url: M3U8 URL identifying the job
+        """
+        resumable_dir = create_secure_temp_dir(self.user_id, job_key=url)
+        if resumable_dir == self.temp_dir:
+            return
+
+        # Drop the empty randomized directory created in __init__
+        release_temp_dir(self.temp_dir)
+        try:
+            os.rmdir(self.temp_dir)
+        except OSError:
+            pass
+        self.temp_dir = resumable_dir
+
+    def _cleanup(self, keep_resumable: bool = False) -> None:
         """
         Securely clean up temporary files.
+
+        Args:
+            keep_resumable: Keep the directory if it holds segments a later run can resume from
         """
+        # A directory kept for resume ages out like any other once its download has stopped
+        release_temp_dir(self.temp_dir)
+
+        if keep_resumable and self.journal is not None and self.journal.completed:
+            logger.info(f"Keeping {len(self.journal.completed)} stored segments in {self.temp_dir} for resume")
+            return
+
         try:
             # Ensure the temp directory exists and is within the expected path format
             if not self.temp_dir or not os.path.exists(self.temp_dir):
@@ -0,0 +1,152 @@
+import time
+import logging
+from typing import Any, Dict, List, Optional, Sequence
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class Mirror:
+    """
+    One copy of a rendition, usually served by a different CDN.
+    """
+
+    def __init__(self, playlist_url: str, segment_urls: List[str]):
+        """
+        Initialize the mirror.
+
+        Args:
+            playlist_url: Media playlist URL of this copy
+            segment_urls: Absolute segment URLs, aligned with the download plan
+        """
+        self.playlist_url = playlist_url
+        self.segment_urls = segment_urls
+        self.throughput = 0.0
+        self.in_flight = 0
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.down_until = 0.0
+
+    def healthy(self, now: float) -> bool:
+        """
+        Check whether the mirror is currently usable.
+
+        Args:
+            now: Current monotonic time
+
+        Returns:
+            bool: False while the mirror is benched after repeated failures
+        """
+        return now >= self.down_until
+
+    def record_success(self, size: int, elapsed: float, smoothing: float = 0.3) -> None:
+        """
+        Record a successful segment fetch.
+
+        Args:
+            size: Segment size in bytes
+            elapsed: Seconds the fetch took
+            smoothing: Weight of the new sample in the throughput average
+        """
+        self.successes += 1
+        self.consecutive_failures = 0
+        if elapsed > 0:
+            sample = size / elapsed
+            self.throughput = sample if not self.throughput else (
+                smoothing * sample + (1 - smoothing) * self.throughput
+            )
+
+    def record_failure(self, max_failures: int, cooldown: float) -> None:
+        """
+        Record a failed segment fetch, benching the mirror after repeated failures.
+
+        Args:
+            max_failures: Consecutive failures that bench the mirror
+            cooldown: Seconds a benched mirror is skipped
+        """
+        self.failures += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= max_failures:
+            if self.healthy(time.monotonic()):
+                logger.warning(f"Mirror {self.playlist_url} failed {self.consecutive_failures} times in a row, "
+                               f"skipping it for {cooldown} seconds")
+            self.down_until = time.monotonic() + cooldown
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get statistics about the mirror.
+
+        Returns:
+            Dict[str, Any]: Mirror statistics
+        """
+        return {
+            "url": self.playlist_url,
+            "throughput": int(self.throughput),
+            "successes": self.successes,
+            "failures": self.failures,
+            "healthy": self.healthy(time.monotonic())
+        }
+
+class MirrorSet:
+    """
+    Equivalent renditions that serve the same segments from different URLs.
+
+    Requests are spread across the healthy mirrors by observed throughput
+    divided by requests in flight, so faster copies take a larger share and
+    unmeasured copies are tried early. A segment that fails on one mirror is
+    retried on another.
+    """
+
+    def __init__(self, mirrors: Sequence[Mirror], max_failures: int = 3, cooldown: float = 30.0):
+        """
+        Initialize the mirror set.
+
+        Args:
+            mirrors: Mirrors, the originally selected one first
+            max_failures: Consecutive failures that bench a mirror
+            cooldown: Seconds a benched mirror is skipped
+        """
+        self.mirrors = list(mirrors)
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+
+    def choose(self, exclude: Sequence[Mirror] = ()) -> Optional[Mirror]:
+        """
+        Pick the mirror for the next request.
+
+        Args:
+            exclude: Mirrors that must not be used
+
+        Returns:
+            Optional[Mirror]: The chosen mirror, or None if every mirror is excluded
+        """
+        candidates = [m for m in self.mirrors if m not in exclude]
+        if not candidates:
+            return None
+
+        # If every mirror is benched, trying one beats failing outright
+        now = time.monotonic()
+        healthy = [m for m in candidates if m.healthy(now)] or candidates
+
+        # Unmeasured mirrors are assumed to be as fast as the best measured one
+        measured = [m.throughput for m in healthy if m.throughput]
+        default = max(measured) if measured else 1.0
+        return max(healthy, key=lambda m: (m.throughput or default) / (m.in_flight + 1))
+
+    def record_failure(self, mirror: Mirror) -> None:
+        """
+        Record a failed request on a mirror.
+
+        Args:
+            mirror: The mirror that failed
+        """
+        mirror.record_failure(self.max_failures, self.cooldown)
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        """
+        Get statistics about all mirrors.
+
+        Returns:
+            List[Dict[str, Any]]: Per-mirror statistics
+        """
+        return [mirror.get_stats() for mirror in self.mirrors]
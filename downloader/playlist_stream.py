@@ -0,0 +1,564 @@
+import re
+import sys
+import json
+import codecs
+import struct
+import asyncio
+import hashlib
+import logging
+from array import array
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Attribute lists hold NAME=value pairs; quoted values may contain commas
+ATTRIBUTE_PATTERN = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+# Tags that only appear in master playlists
+VARIANT_TAGS = (b'#EXT-X-STREAM-INF', b'#EXT-X-I-FRAME-STREAM-INF', b'#EXT-X-MEDIA:')
+
+# Packed playlists start with a magic number, a layout version and the length of their JSON header
+PACK_MAGIC = b'HLSP'
+PACK_VERSION = 1
+PACK_PREAMBLE = struct.Struct('<4sHI')
+
+def parse_attributes(text: str) -> Dict[str, str]:
+    """
+    Parse an HLS attribute list such as ``METHOD=AES-128,URI="key.bin"``.
+
+    Args:
+        text: Attribute list after the tag name and colon
+
+    Returns:
+        Dict[str, str]: Attribute values by name, with quotes removed
+    """
+    return {
+        name: value[1:-1] if len(value) >= 2 and value[0] == value[-1] == '"' else value.strip()
+        for name, value in ATTRIBUTE_PATTERN.findall(text)
+    }
+
+class KeyInfo:
+    """An EXT-X-KEY, read through the attribute names of m3u8.Key."""
+
+    __slots__ = ('method', 'uri', 'iv', 'base_uri')
+
+    def __init__(self, method: Optional[str], uri: Optional[str], iv: Optional[str]):
+        """
+        Initialize the key.
+
+        Args:
+            method: Encryption method
+            uri: Key URI, relative to the playlist
+            iv: Explicit IV as written in the playlist, if any
+        """
+        self.method = method
+        self.uri = uri
+        self.iv = iv
+        self.base_uri = None
+
+class InitSection:
+    """An EXT-X-MAP, read through the attribute names of m3u8.InitializationSection."""
+
+    __slots__ = ('uri', 'byterange', 'base_uri')
+
+    def __init__(self, uri: Optional[str], byterange: Optional[str]):
+        """
+        Initialize the init section.
+
+        Args:
+            uri: Init segment URI, relative to the playlist
+            byterange: Byte range of the init segment as written in the playlist, if any
+        """
+        self.uri = uri
+        self.byterange = byterange
+        self.base_uri = None
+
+class SegmentView:
+    """One row of a SegmentTable, read through the attribute names of m3u8.Segment."""
+
+    __slots__ = ('table', 'index')
+
+    def __init__(self, table: 'SegmentTable', index: int):
+        """
+        Initialize the view.
+
+        Args:
+            table: Table holding the segment
+            index: Segment position
+        """
+        self.table = table
+        self.index = index
+
+    @property
+    def uri(self) -> str:
+        """Segment URI."""
+        return self.table.uri(self.index)
+
+    @property
+    def duration(self) -> float:
+        """EXTINF duration in seconds."""
+        return self.table.durations[self.index]
+
+    @property
+    def byterange(self) -> Optional[str]:
+        """EXT-X-BYTERANGE as written, or None."""
+        return self.table.byterange(self.index)
+
+    @property
+    def key(self) -> Optional[KeyInfo]:
+        """EXT-X-KEY in effect for the segment, or None."""
+        position = self.table.key_indices[self.index]
+        return self.table.keys[position] if position >= 0 else None
+
+    @property
+    def init_section(self) -> Optional[InitSection]:
+        """EXT-X-MAP in effect for the segment, or None."""
+        position = self.table.map_indices[self.index]
+        return self.table.maps[position] if position >= 0 else None
+
+class SegmentTable:
+    """
+    The segments of a media playlist in parallel arrays.
+
+    All URIs share one byte buffer addressed by end offsets; durations, byte
+    ranges and the positions of each segment's key and init section are
+    typed arrays. Keys and init sections are stored once and referenced by
+    position, since a playlist usually has only a handful of them. Indexing
+    returns lightweight views, so the table works wherever a list of
+    m3u8 segments is read.
+    """
+
+    __slots__ = ('uri_data', 'uri_ends', 'durations', 'range_lengths', 'range_offsets',
+                 'key_indices', 'map_indices', 'keys', 'maps')
+
+    # Typed arrays in their packed order
+    ARRAYS = ('uri_ends', 'durations', 'range_lengths', 'range_offsets', 'key_indices', 'map_indices')
+
+    def __init__(self):
+        """Initialize an empty table."""
+        self.uri_data = bytearray()
+        self.uri_ends = array('Q')
+        self.durations = array('d')
+        # -1 for a whole resource, and for a sub-range continuing the previous one
+        self.range_lengths = array('q')
+        self.range_offsets = array('q')
+        # -1 for segments without a key or init section
+        self.key_indices = array('i')
+        self.map_indices = array('i')
+        self.keys: List[KeyInfo] = []
+        self.maps: List[InitSection] = []
+
+    def append(self, uri: bytes, duration: float, range_length: int = -1, range_offset: int = -1,
+               key_index: int = -1, map_index: int = -1) -> None:
+        """
+        Add a segment.
+
+        Args:
+            uri: Segment URI as it appears in the playlist
+            duration: EXTINF duration in seconds
+            range_length: EXT-X-BYTERANGE length, -1 if none
+            range_offset: EXT-X-BYTERANGE offset, -1 if none
+            key_index: Position of the segment's key in ``keys``, -1 if none
+            map_index: Position of the segment's init section in ``maps``, -1 if none
+        """
+        self.uri_data += uri
+        self.uri_ends.append(len(self.uri_data))
+        self.durations.append(duration)
+        self.range_lengths.append(range_length)
+        self.range_offsets.append(range_offset)
+        self.key_indices.append(key_index)
+        self.map_indices.append(map_index)
+
+    def uri(self, index: int) -> str:
+        """
+        Get the URI of a segment.
+
+        Args:
+            index: Segment position
+
+        Returns:
+            str: Segment URI
+        """
+        start = self.uri_ends[index - 1] if index > 0 else 0
+        return self.uri_data[start:self.uri_ends[index]].decode('utf-8', errors='replace')
+
+    def byterange(self, index: int) -> Optional[str]:
+        """
+        Get the EXT-X-BYTERANGE of a segment in its playlist form.
+
+        Args:
+            index: Segment position
+
+        Returns:
+            Optional[str]: ``length[@offset]``, or None for a whole resource
+        """
+        length = self.range_lengths[index]
+        if length < 0:
+            return None
+        offset = self.range_offsets[index]
+        return f"{length}@{offset}" if offset >= 0 else str(length)
+
+    def total_duration(self) -> float:
+        """
+        Get the summed duration of all segments.
+
+        Returns:
+            float: Seconds
+        """
+        return sum(self.durations)
+
+    def __len__(self) -> int:
+        """Get the number of segments."""
+        return len(self.durations)
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[SegmentView, List[SegmentView]]:
+        """Get a view of one segment, or a list of views for a slice."""
+        if isinstance(index, slice):
+            return [SegmentView(self, i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("segment index out of range")
+        return SegmentView(self, index)
+
+    def __iter__(self):
+        """Iterate over views of the segments."""
+        for i in range(len(self)):
+            yield SegmentView(self, i)
+
+class MediaPlaylist:
+    """
+    A media playlist parsed incrementally into a SegmentTable.
+
+    Bytes are fed in as they arrive from the network and every complete
+    line is parsed straight away, so the first segments can be fetched
+    while the rest of a long playlist is still downloading. Consumers wait
+    for more segments with ``wait_for``. A master playlist is only
+    recognized (``is_variant``); those are small and parsed with m3u8.
+    """
+
+    def __init__(self):
+        """Initialize an empty playlist."""
+        self.segments = SegmentTable()
+        self.media_sequence = 0
+        self.target_duration: Optional[int] = None
+        self.playlist_type: Optional[str] = None
+        self.endlist = False
+        self.is_variant = False
+        self.complete = False
+        self.error: Optional[str] = None
+
+        self._buffer = bytearray()
+        self._text_hash = hashlib.sha256()
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._changed: Optional[asyncio.Event] = None
+
+        # Tags that apply to the next segment line, and the current key and map
+        self._duration: Optional[float] = None
+        self._range_length = -1
+        self._range_offset = -1
+        self._key_index = -1
+        self._map_index = -1
+
+    @property
+    def is_endlist(self) -> bool:
+        """A VOD playlist is known to end before its EXT-X-ENDLIST arrives."""
+        return self.endlist or self.playlist_type == 'vod'
+
+    @property
+    def ready(self) -> bool:
+        """Whether enough is known to start downloading."""
+        return self.complete or self.is_variant or (self.playlist_type == 'vod' and len(self.segments) > 0)
+
+    def feed(self, data: bytes) -> None:
+        """
+        Parse a chunk of the playlist body.
+
+        Args:
+            data: Next bytes of the body
+
+        Raises:
+            ValueError: If a segment tag is malformed
+        """
+        if self.is_variant:
+            return
+
+        self._hash_text(data)
+        self._buffer += data
+        end = self._buffer.rfind(b'\n')
+        if end < 0:
+            return
+
+        count = len(self.segments)
+        lines = self._buffer[:end].split(b'\n')
+        del self._buffer[:end + 1]
+        for line in lines:
+            self._parse_line(line.strip())
+            if self.is_variant:
+                break
+
+        if len(self.segments) > count or self.is_variant:
+            self._notify()
+
+    def close(self) -> None:
+        """Parse the last line and mark the playlist complete."""
+        if not self.is_variant:
+            self._hash_text(b'', final=True)
+        if self._buffer and not self.is_variant:
+            self._parse_line(bytes(self._buffer).strip())
+        self._buffer = bytearray()
+        self.complete = True
+        self._notify()
+
+    def text_digest(self) -> str:
+        """
+        Hash the playlist text fed so far.
+
+        Invalid UTF-8 is hashed with replacement characters, as the playlist
+        cache stores and hashes the text, so both digests of one body agree.
+
+        Returns:
+            str: SHA-256 hex digest of the text encoded as UTF-8
+        """
+        return self._text_hash.hexdigest()
+
+    def _hash_text(self, data: bytes, final: bool = False) -> None:
+        """
+        Add a chunk of the body to the text hash.
+
+        Args:
+            data: Next bytes of the body
+            final: Whether this is the end of the body
+        """
+        self._text_hash.update(self._text_decoder.decode(data, final).encode('utf-8'))
+
+    def resolve(self, resolve_uri: Callable[[str], str]) -> 'MediaPlaylist':
+        """
+        Copy the playlist with every segment, key and init section URI made absolute.
+
+        Args:
+            resolve_uri: Function resolving a URI as written in the playlist
+
+        Returns:
+            MediaPlaylist: A complete playlist that no longer needs a base URL
+        """
+        resolved = MediaPlaylist()
+        resolved.media_sequence = self.media_sequence
+        resolved.target_duration = self.target_duration
+        resolved.playlist_type = self.playlist_type
+        resolved.endlist = self.endlist
+        resolved.complete = True
+
+        source, table = self.segments, resolved.segments
+        table.durations.extend(source.durations)
+        table.range_lengths.extend(source.range_lengths)
+        table.range_offsets.extend(source.range_offsets)
+        table.key_indices.extend(source.key_indices)
+        table.map_indices.extend(source.map_indices)
+        for i in range(len(source)):
+            table.uri_data += resolve_uri(source.uri(i)).encode('utf-8')
+            table.uri_ends.append(len(table.uri_data))
+
+        table.keys = [
+            KeyInfo(key.method, resolve_uri(key.uri) if key.uri else key.uri, key.iv) for key in source.keys
+        ]
+        table.maps = [
+            InitSection(resolve_uri(init.uri) if init.uri else init.uri, init.byterange) for init in source.maps
+        ]
+        return resolved
+
+    def fail(self, error: str) -> None:
+        """
+        Mark the playlist complete after its download failed.
+
+        Args:
+            error: Description of the failure
+        """
+        self.error = error
+        self.complete = True
+        self._notify()
+
+    def _notify(self) -> None:
+        """Wake up consumers waiting for segments."""
+        if self._changed is not None:
+            self._changed.set()
+            self._changed = None
+
+    async def _wait_change(self) -> None:
+        """Wait until segments are added or the playlist completes."""
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        await self._changed.wait()
+
+    async def wait_ready(self) -> None:
+        """Wait until enough is known to start downloading."""
+        while not self.ready:
+            await self._wait_change()
+
+    async def wait_for(self, count: int) -> bool:
+        """
+        Wait until at least ``count`` segments are parsed.
+
+        Args:
+            count: Number of segments
+
+        Returns:
+            bool: False if the playlist completed with fewer segments
+        """
+        while len(self.segments) < count and not self.complete:
+            await self._wait_change()
+        return len(self.segments) >= count
+
+    async def wait_complete(self) -> None:
+        """Wait until the whole playlist is parsed or its download failed."""
+        while not self.complete:
+            await self._wait_change()
+
+    def _parse_line(self, line: bytes) -> None:
+        """
+        Parse one line of the playlist.
+
+        Args:
+            line: Line without its line break
+        """
+        if not line:
+            return
+
+        if not line.startswith(b'#'):
+            # Only lines following EXTINF or EXT-X-BYTERANGE are segments
+            if self._duration is not None or self._range_length >= 0:
+                self.segments.append(
+                    line, self._duration or 0.0, self._range_length, self._range_offset,
+                    self._key_index, self._map_index
+                )
+                self._duration = None
+                self._range_length = self._range_offset = -1
+            return
+
+        if line.startswith(b'#EXTINF:'):
+            self._duration = float(line[8:].split(b',', 1)[0])
+        elif line.startswith(b'#EXT-X-BYTERANGE:'):
+            length, _, offset = line[17:].decode().strip().partition('@')
+            try:
+                self._range_length = int(length)
+                self._range_offset = int(offset) if offset else -1
+            except ValueError:
+                raise ValueError(f"Invalid byte range '{line[17:].decode()}' for segment {len(self.segments)}")
+        elif line.startswith(b'#EXT-X-KEY:'):
+            attributes = parse_attributes(line[11:].decode('utf-8', errors='replace'))
+            self.segments.keys.append(KeyInfo(attributes.get('METHOD'), attributes.get('URI'), attributes.get('IV')))
+            self._key_index = len(self.segments.keys) - 1
+        elif line.startswith(b'#EXT-X-MAP:'):
+            attributes = parse_attributes(line[11:].decode('utf-8', errors='replace'))
+            self.segments.maps.append(InitSection(attributes.get('URI'), attributes.get('BYTERANGE')))
+            self._map_index = len(self.segments.maps) - 1
+        elif line.startswith(b'#EXT-X-MEDIA-SEQUENCE:'):
+            self.media_sequence = int(line[22:])
+        elif line.startswith(b'#EXT-X-TARGETDURATION:'):
+            self.target_duration = int(float(line[22:]))
+        elif line.startswith(b'#EXT-X-PLAYLIST-TYPE:'):
+            self.playlist_type = line[21:].decode().strip().lower()
+        elif line.startswith(b'#EXT-X-ENDLIST'):
+            self.endlist = True
+        elif line.startswith(VARIANT_TAGS):
+            self.is_variant = True
+
+def parse_playlist(content: str) -> MediaPlaylist:
+    """
+    Parse a playlist that is already in memory.
+
+    Args:
+        content: Playlist text
+
+    Returns:
+        MediaPlaylist: The parsed playlist, with ``is_variant`` set for master playlists
+    """
+    playlist = MediaPlaylist()
+    playlist.feed(content.encode('utf-8', errors='replace'))
+    playlist.close()
+    return playlist
+
+def pack_playlist(playlist: MediaPlaylist, metadata: Dict[str, Any]) -> bytes:
+    """
+    Serialize a complete media playlist and caller metadata into a compact binary form.
+
+    The preamble and a small JSON header (playlist tags, keys, init sections
+    and the metadata) are followed by the segment table's typed arrays and
+    its URI buffer, copied as they are in memory.
+
+    Args:
+        playlist: Complete media playlist
+        metadata: JSON-serializable data stored alongside the playlist
+
+    Returns:
+        bytes: Packed playlist
+    """
+    table = playlist.segments
+    header = json.dumps({
+        'count': len(table),
+        'uri_bytes': len(table.uri_data),
+        'byteorder': sys.byteorder,
+        'media_sequence': playlist.media_sequence,
+        'target_duration': playlist.target_duration,
+        'playlist_type': playlist.playlist_type,
+        'endlist': playlist.endlist,
+        'keys': [[key.method, key.uri, key.iv] for key in table.keys],
+        'maps': [[init.uri, init.byterange] for init in table.maps],
+        'metadata': metadata
+    }, separators=(',', ':')).encode('utf-8')
+
+    parts = [PACK_PREAMBLE.pack(PACK_MAGIC, PACK_VERSION, len(header)), header]
+    parts.extend(getattr(table, name).tobytes() for name in SegmentTable.ARRAYS)
+    parts.append(bytes(table.uri_data))
+    return b''.join(parts)
+
+def unpack_playlist(data: bytes) -> Tuple[MediaPlaylist, Dict[str, Any]]:
+    """
+    Load a playlist packed by pack_playlist, without parsing any playlist text.
+
+    Args:
+        data: Packed playlist
+
+    Returns:
+        Tuple[MediaPlaylist, Dict[str, Any]]: (complete playlist, metadata stored with it)
+
+    Raises:
+        ValueError: If the data is not a packed playlist of this version or is truncated
+    """
+    view = memoryview(data)
+    if len(view) < PACK_PREAMBLE.size:
+        raise ValueError("Packed playlist is truncated")
+    magic, version, header_length = PACK_PREAMBLE.unpack_from(view)
+    if magic != PACK_MAGIC or version != PACK_VERSION:
+        raise ValueError("Not a packed playlist of a supported version")
+
+    offset = PACK_PREAMBLE.size
+    header = json.loads(bytes(view[offset:offset + header_length]))
+    offset += header_length
+
+    playlist = MediaPlaylist()
+    playlist.media_sequence = header['media_sequence']
+    playlist.target_duration = header['target_duration']
+    playlist.playlist_type = header['playlist_type']
+    playlist.endlist = header['endlist']
+    playlist.complete = True
+
+    table = playlist.segments
+    count = header['count']
+    for name in SegmentTable.ARRAYS:
+        values = getattr(table, name)
+        size = values.itemsize * count
+        if offset + size > len(view):
+            raise ValueError("Packed playlist is truncated")
+        values.frombytes(view[offset:offset + size])
+        if header['byteorder'] != sys.byteorder:
+            values.byteswap()
+        offset += size
+
+    if offset + header['uri_bytes'] != len(view):
+        raise ValueError("Packed playlist is truncated")
+    table.uri_data = bytearray(view[offset:])
+    table.keys = [KeyInfo(method, uri, iv) for method, uri, iv in header['keys']]
+    table.maps = [InitSection(uri, byterange) for uri, byterange in header['maps']]
+    return playlist, header['metadata']
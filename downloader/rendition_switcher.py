@@ -0,0 +1,138 @@
+import time
+import logging
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+
+from downloader.variant_selector import VariantCandidate
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class RenditionSwitcher:
+    """
+    Watches segment throughput and decides when to drop to a lower rendition.
+
+    Throughput is measured over the most recent segment completions across the
+    whole window. The remaining media is projected at the current rendition's
+    byte rate; when it would not finish before the deadline, the highest lower
+    rendition that would is chosen (or the lowest one if none fits).
+    """
+
+    def __init__(self, current: VariantCandidate, lower: List[VariantCandidate], deadline: float,
+                 safety: float = 0.8, sample_size: int = 12, min_samples: int = 4,
+                 cooldown: float = 10.0):
+        """
+        Initialize the switcher.
+
+        Args:
+            current: Rendition being downloaded
+            lower: Lower renditions, highest bandwidth first
+            deadline: Monotonic time by which the download must finish
+            safety: Fraction of the remaining time the projection may use
+            sample_size: Number of recent completions used for the throughput estimate
+            min_samples: Completions needed before a decision is made
+            cooldown: Seconds to wait after a switch before deciding again
+        """
+        self.current = current
+        self.lower = sorted(lower, key=lambda c: c.bandwidth, reverse=True)
+        self.deadline = deadline
+        self.safety = safety
+        self.min_samples = min_samples
+        self.cooldown = cooldown
+        self.samples: Deque[Tuple[float, int, float]] = deque(maxlen=sample_size)
+        self.last_switch = 0.0
+        self.switches = 0
+
+    def record(self, size: int, media_duration: float) -> None:
+        """
+        Record a completed segment.
+
+        Args:
+            size: Segment size in bytes
+            media_duration: Segment duration in seconds
+        """
+        self.samples.append((time.monotonic(), size, media_duration))
+
+    def throughput(self) -> float:
+        """
+        Get the recent download throughput.
+
+        Returns:
+            float: Bytes per second, 0 if there are not enough samples yet
+        """
+        if len(self.samples) < self.min_samples:
+            return 0.0
+
+        elapsed = self.samples[-1][0] - self.samples[0][0]
+        if elapsed <= 0:
+            return 0.0
+
+        # The first completion only marks the start of the measuring interval
+        return sum(size for _, size, _ in list(self.samples)[1:]) / elapsed
+
+    def check(self, remaining_duration: float) -> Optional[VariantCandidate]:
+        """
+        Decide whether to switch to a lower rendition.
+
+        Args:
+            remaining_duration: Seconds of media not yet issued for download
+
+        Returns:
+            Optional[VariantCandidate]: The rendition to switch to, or None to stay
+        """
+        now = time.monotonic()
+        if not self.lower or remaining_duration <= 0 or now - self.last_switch < self.cooldown:
+            return None
+
+        throughput = self.throughput()
+        media = sum(duration for _, _, duration in self.samples)
+        if throughput <= 0 or media <= 0:
+            return None
+
+        # Bytes per second of media measured on the current rendition
+        byte_rate = sum(size for _, size, _ in self.samples) / media
+        budget = (self.deadline - now) * self.safety
+
+        if remaining_duration * byte_rate / throughput <= budget:
+            return None
+
+        target = self.lower[-1]
+        for candidate in self.lower:
+            if self._projected_time(candidate, byte_rate, throughput, remaining_duration) <= budget:
+                target = candidate
+                break
+
+        logger.info(f"Throughput {throughput / 1024:.0f} KB/s cannot finish {remaining_duration:.0f}s of media "
+                    f"at {self.current.bandwidth} bps in time, switching to {target.bandwidth} bps")
+        return target
+
+    def switched(self, target: VariantCandidate) -> None:
+        """
+        Note that the download switched to a rendition.
+
+        Args:
+            target: The new current rendition
+        """
+        self.lower = [c for c in self.lower if c.bandwidth < target.bandwidth]
+        self.current = target
+        self.samples.clear()
+        self.last_switch = time.monotonic()
+        self.switches += 1
+
+    def _projected_time(self, candidate: VariantCandidate, byte_rate: float,
+                        throughput: float, remaining_duration: float) -> float:
+        """
+        Project the time to download the remaining media at a candidate rendition.
+
+        Args:
+            candidate: Candidate rendition
+            byte_rate: Measured bytes per second of media on the current rendition
+            throughput: Measured download throughput in bytes per second
+            remaining_duration: Seconds of media left
+
+        Returns:
+            float: Projected seconds
+        """
+        if self.current.bandwidth and candidate.bandwidth:
+            byte_rate = byte_rate * candidate.bandwidth / self.current.bandwidth
+        return remaining_duration * byte_rate / throughput
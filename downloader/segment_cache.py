@@ -0,0 +1,505 @@
+import os
+import json
+import time
+import uuid
+import heapq
+import sqlite3
+import asyncio
+import hashlib
+import logging
+import aiofiles
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from config.config import (
+    DOWNLOAD_PATH, SEGMENT_CACHE_MAX_SIZE, SEGMENT_CACHE_TTL, SEGMENT_CACHE_POLICY,
+    SEGMENT_CACHE_VERIFY
+)
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+def segment_cache_key(url: str, byte_range: Optional[Tuple[int, int]] = None) -> str:
+    """
+    Build the cache key of a segment request.
+
+    Args:
+        url: Segment URL
+        byte_range: Optional (start, end) sub-range of the resource, end exclusive
+
+    Returns:
+        str: Cache key
+    """
+    if byte_range:
+        return f"{url}#{byte_range[0]}-{byte_range[1]}"
+    return url
+
+class SegmentCache:
+    """
+    A disk-backed, content-addressed store of raw segment bytes shared by all downloads.
+
+    Requests are keyed by segment URL and byte range. Each key points at a
+    blob named after the SHA-256 of its content, so identical bytes served
+    under several URLs are stored once. Blobs are evicted by least recent
+    ('lru') or least frequent ('lfu') use once the store grows past its byte
+    limit, and every entry expires a while after it was stored, since some
+    servers reuse segment names for new content. Segments are cached as
+    fetched, before decryption.
+
+    Lookups use an in-memory index. It is persisted to an SQLite database
+    in WAL mode: ``save`` writes only the entries that changed since the
+    last save, in a worker thread.
+    """
+
+    def __init__(self, cache_dir: str, max_size: int = 1024 * 1024 * 1024, ttl: int = 86400,
+                 policy: str = 'lru', verify: bool = True):
+        """
+        Initialize the segment cache.
+
+        Args:
+            cache_dir: Directory holding the blobs and the index
+            max_size: Maximum total size of stored blobs in bytes
+            ttl: Seconds an entry stays valid after it was stored
+            policy: Eviction policy, 'lru' or 'lfu'
+            verify: Check the content hash of every blob that is read back
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.ttl = ttl
+        self.policy = policy if policy in ('lru', 'lfu') else 'lru'
+        self.verify = verify
+        self.index_path = os.path.join(cache_dir, 'index.db')
+
+        # key -> {'sha256', 'size', 'hits', 'stored', 'last_access'}, least recently used first
+        self.entries: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+        self.blob_refs: Dict[str, int] = {}
+        self.blob_sizes: Dict[str, int] = {}
+        self.size = 0
+
+        # (hits, last_access, key) min-heap for LFU eviction; rows of changed entries are left behind and skipped
+        self.frequency: List[Tuple[int, float, str]] = []
+
+        # Keys whose index rows are out of date, and keys whose rows must go
+        self.changed: Set[str] = set()
+        self.deleted: Set[str] = set()
+        self.db: Optional[sqlite3.Connection] = None
+        self.save_lock = asyncio.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.evictions = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        try:
+            os.chmod(self.cache_dir, 0o700)
+        except Exception as e:
+            logger.warning(f"Could not set secure permissions on segment cache directory: {str(e)}")
+
+        self._load()
+
+    def _blob_path(self, sha256: str) -> str:
+        """
+        Get the path of a blob.
+
+        Args:
+            sha256: Content hash of the blob
+
+        Returns:
+            str: Path to the blob file
+        """
+        return os.path.join(self.cache_dir, sha256[:2], sha256)
+
+    def _open_index(self) -> sqlite3.Connection:
+        """
+        Open the index database and create its schema.
+
+        Returns:
+            sqlite3.Connection: Connection to the index, used by one thread at a time
+        """
+        db = sqlite3.connect(self.index_path, check_same_thread=False)
+        try:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            with db:
+                db.execute(
+                    'CREATE TABLE IF NOT EXISTS entries ('
+                    'key TEXT PRIMARY KEY, sha256 TEXT NOT NULL, size INTEGER NOT NULL, hits INTEGER NOT NULL, '
+                    'stored REAL NOT NULL, last_access REAL NOT NULL)'
+                )
+        except sqlite3.DatabaseError:
+            db.close()
+            raise
+        return db
+
+    def _load(self) -> None:
+        """Load the index from disk and drop blobs it does not reference."""
+        try:
+            try:
+                self.db = self._open_index()
+            except sqlite3.DatabaseError as e:
+                logger.error(f"Segment cache index is unreadable, starting a new one: {str(e)}")
+                for suffix in ('', '-wal', '-shm'):
+                    if os.path.exists(self.index_path + suffix):
+                        os.remove(self.index_path + suffix)
+                self.db = self._open_index()
+            self._import_json_index()
+
+            now = time.time()
+            rows = self.db.execute(
+                'SELECT key, sha256, size, hits, stored, last_access FROM entries ORDER BY last_access'
+            )
+            for key, sha256, size, hits, stored, last_access in rows:
+                if now - stored <= self.ttl and os.path.exists(self._blob_path(sha256)):
+                    self._link(key, {'sha256': sha256, 'size': size, 'hits': hits,
+                                     'stored': stored, 'last_access': last_access})
+                else:
+                    self.deleted.add(key)
+            self.changed.clear()
+        except Exception as e:
+            logger.error(f"Error loading segment cache index: {str(e)}")
+            self.entries.clear()
+            self.blob_refs.clear()
+            self.blob_sizes.clear()
+            self.frequency.clear()
+            self.size = 0
+
+        # Blobs written after the last index save are unreachable
+        removed = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                if root != self.cache_dir and name not in self.blob_refs:
+                    try:
+                        os.remove(path)
+                        removed += 1
+                    except OSError:
+                        pass
+
+        if self.entries or removed:
+            logger.info(f"Loaded segment cache with {len(self.entries)} entries ({self.size} bytes), "
+                        f"removed {removed} unreferenced blobs")
+
+    def _import_json_index(self) -> None:
+        """Move the entries of a JSON index written by an older version into the database."""
+        json_path = os.path.join(self.cache_dir, 'index.json')
+        if not os.path.exists(json_path):
+            return
+
+        try:
+            with open(json_path, 'r') as f:
+                entries = json.load(f)
+            with self.db:
+                self.db.executemany(
+                    'INSERT OR IGNORE INTO entries (key, sha256, size, hits, stored, last_access) '
+                    'VALUES (?, ?, ?, ?, ?, ?)',
+                    [
+                        (key, e['sha256'], e['size'], e['hits'], e['stored'], e['last_access'])
+                        for key, e in entries.items()
+                    ]
+                )
+            logger.info(f"Imported {len(entries)} entries from the JSON segment cache index")
+        except Exception as e:
+            logger.error(f"Error importing JSON segment cache index: {str(e)}")
+        os.remove(json_path)
+
+    def _track(self, key: str, entry: Dict[str, Any]) -> None:
+        """
+        Record an entry's current use count for LFU eviction.
+
+        Args:
+            key: Cache key
+            entry: The key's entry
+        """
+        if self.policy != 'lfu':
+            return
+        heapq.heappush(self.frequency, (entry['hits'], entry['last_access'], key))
+
+        # Rebuild once outdated rows outnumber live ones
+        if len(self.frequency) > 2 * len(self.entries) + 64:
+            self.frequency = [(e['hits'], e['last_access'], k) for k, e in self.entries.items()]
+            heapq.heapify(self.frequency)
+
+    def _link(self, key: str, entry: Dict[str, Any]) -> None:
+        """
+        Add an index entry, counting its blob once.
+
+        Args:
+            key: Cache key
+            entry: Entry with 'sha256' and 'size'
+        """
+        sha256 = entry['sha256']
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        self.changed.add(key)
+        self.deleted.discard(key)
+        self._track(key, entry)
+        if sha256 not in self.blob_refs:
+            self.blob_refs[sha256] = 0
+            self.blob_sizes[sha256] = entry['size']
+            self.size += entry['size']
+        self.blob_refs[sha256] += 1
+
+    def _unlink(self, key: str) -> None:
+        """
+        Remove an index entry, deleting its blob once nothing references it.
+
+        Args:
+            key: Cache key
+        """
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.changed.discard(key)
+        self.deleted.add(key)
+
+        sha256 = entry['sha256']
+        self.blob_refs[sha256] -= 1
+        if self.blob_refs[sha256] > 0:
+            return
+
+        del self.blob_refs[sha256]
+        self.size -= self.blob_sizes.pop(sha256)
+        try:
+            os.remove(self._blob_path(sha256))
+        except OSError:
+            pass
+
+    @staticmethod
+    async def _hash(data: bytes) -> str:
+        """
+        Hash segment bytes in a worker thread.
+
+        Args:
+            data: Segment bytes
+
+        Returns:
+            str: SHA-256 hex digest
+        """
+        return await asyncio.to_thread(lambda: hashlib.sha256(data).hexdigest())
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """
+        Read a cached segment.
+
+        Args:
+            key: Cache key from segment_cache_key
+
+        Returns:
+            Optional[bytes]: Segment bytes, or None on a miss
+        """
+        entry = self.entries.get(key)
+        if entry is None or time.time() - entry['stored'] > self.ttl:
+            if entry is not None:
+                self._unlink(key)
+            self.misses += 1
+            return None
+
+        try:
+            async with aiofiles.open(self._blob_path(entry['sha256']), 'rb') as f:
+                data = await f.read()
+        except OSError as e:
+            logger.warning(f"Cached segment {key} is unreadable, dropping it: {str(e)}")
+            if self.entries.get(key) is entry:
+                self._unlink(key)
+            self.misses += 1
+            return None
+
+        # Hash off the event loop; hashlib releases the GIL for large buffers
+        if len(data) != entry['size'] or (self.verify and await self._hash(data) != entry['sha256']):
+            logger.warning(f"Cached segment {key} failed verification, dropping it")
+            if self.entries.get(key) is entry:
+                self._unlink(key)
+            self.misses += 1
+            return None
+
+        # The entry may have been evicted while the blob was read
+        if key in self.entries:
+            entry['hits'] += 1
+            entry['last_access'] = time.time()
+            self.entries.move_to_end(key)
+            self.changed.add(key)
+            self._track(key, entry)
+
+        self.hits += 1
+        self.bytes_saved += len(data)
+        return data
+
+    async def put(self, key: str, data: bytes) -> None:
+        """
+        Store a segment, evicting others if the store grows past its limit.
+
+        Args:
+            key: Cache key from segment_cache_key
+            data: Segment bytes
+        """
+        if not data or len(data) > self.max_size:
+            return
+
+        sha256 = await self._hash(data)
+        now = time.time()
+        existing = self.entries.get(key)
+        if existing is not None and existing['sha256'] == sha256:
+            existing['stored'] = now
+            self.changed.add(key)
+            return
+
+        if sha256 not in self.blob_refs:
+            path = self._blob_path(sha256)
+            # Concurrent writers of the same file each need their own temp file
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                async with aiofiles.open(tmp_path, 'wb') as f:
+                    await f.write(data)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                logger.warning(f"Could not store segment {key} in the cache: {str(e)}")
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                return
+
+        self._unlink(key)
+        self._link(key, {'sha256': sha256, 'size': len(data), 'hits': 0, 'stored': now, 'last_access': now})
+        self._evict()
+
+    def _evict(self) -> None:
+        """Drop entries until the stored blobs fit in the byte limit."""
+        while self.size > self.max_size and self.entries:
+            victim = self._least_frequent() if self.policy == 'lfu' else next(iter(self.entries))
+            self._unlink(victim)
+            self.evictions += 1
+
+    def _least_frequent(self) -> str:
+        """
+        Find the least frequently used entry, the least recently used among ties.
+
+        Returns:
+            str: Cache key
+        """
+        while self.frequency:
+            hits, last_access, key = heapq.heappop(self.frequency)
+            entry = self.entries.get(key)
+            if entry is not None and entry['hits'] == hits and entry['last_access'] == last_access:
+                return key
+        # Not reached while every entry is tracked; fall back to the least recently used
+        return next(iter(self.entries))
+
+    def _take_changes(self) -> Tuple[List[Tuple[Any, ...]], List[str]]:
+        """
+        Collect the index rows to write and delete, and mark them saved.
+
+        Returns:
+            Tuple[List[Tuple[Any, ...]], List[str]]: (rows to upsert, keys to delete)
+        """
+        rows = [
+            (key, e['sha256'], e['size'], e['hits'], e['stored'], e['last_access'])
+            for key, e in ((key, self.entries.get(key)) for key in self.changed) if e is not None
+        ]
+        deleted = list(self.deleted)
+        self.changed.clear()
+        self.deleted.clear()
+        return rows, deleted
+
+    def _write_index(self, rows: List[Tuple[Any, ...]], deleted: List[str]) -> None:
+        """
+        Apply changes to the index database in one transaction.
+
+        Args:
+            rows: Rows to insert or replace
+            deleted: Keys to delete
+        """
+        with self.db:
+            self.db.executemany('DELETE FROM entries WHERE key = ?', [(key,) for key in deleted])
+            self.db.executemany(
+                'INSERT OR REPLACE INTO entries (key, sha256, size, hits, stored, last_access) '
+                'VALUES (?, ?, ?, ?, ?, ?)', rows
+            )
+
+    async def save(self) -> None:
+        """Write the entries changed since the last save to the index, off the event loop."""
+        if self.db is None or not (self.changed or self.deleted):
+            return
+
+        async with self.save_lock:
+            rows, deleted = self._take_changes()
+            try:
+                await asyncio.to_thread(self._write_index, rows, deleted)
+            except Exception as e:
+                logger.error(f"Error saving segment cache index: {str(e)}")
+                # Write them with the next save
+                for row in rows:
+                    if row[0] in self.entries:
+                        self.changed.add(row[0])
+                self.deleted.update(key for key in deleted if key not in self.entries)
+
+    def close(self) -> None:
+        """Write outstanding index changes and close the index."""
+        if self.db is None:
+            return
+        try:
+            self._write_index(*self._take_changes())
+        except Exception as e:
+            logger.error(f"Error saving segment cache index: {str(e)}")
+        self.db.close()
+        self.db = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get statistics about the segment cache.
+
+        Returns:
+            Dict[str, Any]: Size, entry, hit, byte-savings and eviction counters
+        """
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "blobs": len(self.blob_refs),
+            "size": self.size,
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "policy": self.policy,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "bytes_saved": self.bytes_saved,
+            "evictions": self.evictions
+        }
+
+# Global segment cache
+segment_cache = None
+
+def get_segment_cache(cache_dir: str = os.path.join(DOWNLOAD_PATH, 'cache', 'segments'),
+                      max_size: int = SEGMENT_CACHE_MAX_SIZE,
+                      ttl: int = SEGMENT_CACHE_TTL,
+                      policy: str = SEGMENT_CACHE_POLICY,
+                      verify: bool = SEGMENT_CACHE_VERIFY) -> SegmentCache:
+    """
+    Get or create the global segment cache.
+
+    Args:
+        cache_dir: Directory holding the blobs and the index
+        max_size: Maximum total size of stored blobs in bytes
+        ttl: Seconds an entry stays valid after it was stored
+        policy: Eviction policy, 'lru' or 'lfu'
+        verify: Check the content hash of every blob that is read back
+
+    Returns:
+        SegmentCache: The global segment cache
+    """
+    global segment_cache
+
+    if segment_cache is None:
+        segment_cache = SegmentCache(cache_dir, max_size=max_size, ttl=ttl, policy=policy, verify=verify)
+
+    return segment_cache
+
+def close_segment_cache() -> None:
+    """Save the index of the global segment cache and release it."""
+    global segment_cache
+
+    if segment_cache is not None:
+        segment_cache.close()
+        segment_cache = None
@@ -0,0 +1,210 @@
+import os
+import logging
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    CRYPTOGRAPHY_AVAILABLE = True
+except ImportError:
+    CRYPTOGRAPHY_AVAILABLE = False
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Encryption methods from EXT-X-KEY
+METHOD_NONE = 'NONE'
+METHOD_AES_128 = 'AES-128'
+
+class KeyCache:
+    """
+    A small cache of HLS decryption keys shared across segments and downloads.
+
+    Each key URI is fetched at most once: concurrent segments that need the
+    same key wait on the single in-flight fetch instead of issuing their own.
+    """
+
+    def __init__(self, max_entries: int = 64):
+        """
+        Initialize the key cache.
+
+        Args:
+            max_entries: Maximum number of keys to keep
+        """
+        self.max_entries = max(1, max_entries)
+        self.keys: "OrderedDict[str, bytes]" = OrderedDict()
+        self.inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.fetches = 0
+
+    async def get(self, uri: str, fetch: Callable[[str], Awaitable[bytes]]) -> bytes:
+        """
+        Get the key for a URI, fetching it once if it is not cached.
+
+        Args:
+            uri: Absolute key URI
+            fetch: Coroutine function that downloads the key
+
+        Returns:
+            bytes: The 16-byte key
+        """
+        while True:
+            if uri in self.keys:
+                self.keys.move_to_end(uri)
+                self.hits += 1
+                return self.keys[uri]
+
+            if uri not in self.inflight:
+                break
+
+            # Join an in-flight fetch for the same key; None means its owner was cancelled
+            key = await asyncio.shield(self.inflight[uri])
+            if key is not None:
+                self.hits += 1
+                return key
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[uri] = future
+        try:
+            self.fetches += 1
+            key = await fetch(uri)
+            if len(key) != 16:
+                raise ValueError(f"Invalid AES-128 key length {len(key)} from {uri}")
+
+            self.keys[uri] = key
+            while len(self.keys) > self.max_entries:
+                self.keys.popitem(last=False)
+
+            future.set_result(key)
+            return key
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody may be waiting; mark the exception as retrieved
+            future.exception()
+            raise
+        except BaseException:
+            # Only the owner was cancelled; waiters retry, and one of them fetches the key instead
+            future.set_result(None)
+            raise
+        finally:
+            del self.inflight[uri]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get statistics about the key cache.
+
+        Returns:
+            Dict[str, Any]: Key cache statistics
+        """
+        return {
+            "keys": len(self.keys),
+            "hits": self.hits,
+            "fetches": self.fetches
+        }
+
+def segment_iv(explicit_iv: Optional[str], media_sequence: int) -> bytes:
+    """
+    Get the initialization vector for a segment.
+
+    Args:
+        explicit_iv: IV attribute of the EXT-X-KEY tag (hex string), if any
+        media_sequence: Media sequence number of the segment
+
+    Returns:
+        bytes: 16-byte IV
+    """
+    if explicit_iv:
+        value = explicit_iv[2:] if explicit_iv.lower().startswith('0x') else explicit_iv
+        return bytes.fromhex(value.rjust(32, '0'))
+
+    # Without an explicit IV, the media sequence number is the IV (big-endian)
+    return media_sequence.to_bytes(16, 'big')
+
+def _decrypt_aes128_cbc(data: bytes, key: bytes, iv: bytes) -> bytes:
+    """
+    Decrypt an AES-128-CBC segment and strip its PKCS#7 padding.
+
+    Args:
+        data: Encrypted segment data
+        key: 16-byte key
+        iv: 16-byte IV
+
+    Returns:
+        bytes: Decrypted segment data
+    """
+    decryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).decryptor()
+    plain = decryptor.update(data) + decryptor.finalize()
+
+    padding = plain[-1] if plain else 0
+    if 0 < padding <= 16 and plain.endswith(bytes([padding]) * padding):
+        plain = plain[:-padding]
+    return plain
+
+async def decrypt_segment(data: bytes, key: bytes, iv: bytes) -> bytes:
+    """
+    Decrypt a segment in the decryption pool, off the event loop.
+
+    Args:
+        data: Encrypted segment data
+        key: 16-byte key
+        iv: 16-byte IV
+
+    Returns:
+        bytes: Decrypted segment data
+    """
+    if not CRYPTOGRAPHY_AVAILABLE:
+        raise RuntimeError("Encrypted stream requires the 'cryptography' package")
+
+    if len(data) % 16:
+        raise ValueError(f"Encrypted segment size {len(data)} is not a multiple of the AES block size")
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_decrypt_executor(), _decrypt_aes128_cbc, data, key, iv)
+
+# Global key cache and decryption pool instances
+key_cache = None
+decrypt_executor = None
+
+def get_key_cache(max_entries: int = 64) -> KeyCache:
+    """
+    Get or create the global key cache instance.
+
+    Args:
+        max_entries: Maximum number of keys to keep
+
+    Returns:
+        KeyCache: The global key cache instance
+    """
+    global key_cache
+
+    if key_cache is None:
+        key_cache = KeyCache(max_entries=max_entries)
+
+    return key_cache
+
+def get_decrypt_executor() -> ThreadPoolExecutor:
+    """
+    Get or create the global decryption pool, sized to the number of cores.
+
+    Returns:
+        ThreadPoolExecutor: The global decryption pool
+    """
+    global decrypt_executor
+
+    if decrypt_executor is None:
+        decrypt_executor = ThreadPoolExecutor(
+            max_workers=os.cpu_count() or 1,
+            thread_name_prefix='hls-decrypt'
+        )
+
+    return decrypt_executor
+
+def close_decrypt_executor() -> None:
+    """Shut down the global decryption pool."""
+    global decrypt_executor
+
+    if decrypt_executor is not None:
+        decrypt_executor.shutdown(wait=False)
+        decrypt_executor = None
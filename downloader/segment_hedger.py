@@ -0,0 +1,230 @@
+import time
+import logging
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+from downloader.task_group import TaskGroup, cancel_tasks
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class HedgeStats:
+    """
+    Hedging counters aggregated over all downloads.
+    """
+
+    def __init__(self):
+        """Initialize the counters."""
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get hedging statistics.
+
+        Returns:
+            Dict[str, Any]: Request, hedge and win counts with the hedge rate
+        """
+        return {
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "hedge_rate": round(self.hedged / self.requests, 4) if self.requests else 0.0
+        }
+
+class SegmentHedger:
+    """
+    Issues a duplicate request for segments that run longer than their siblings.
+
+    Latencies of completed fetches in one download are kept in a sliding
+    window. Once a fetch has run past the configured percentile of that window,
+    a second copy is started; the first one to return data wins and the other
+    is cancelled. With a global limiter, a hedge holds a slot like any other
+    fetch and is held back while every slot is busy.
+    """
+
+    def __init__(self, percentile: float = 0.95, min_samples: int = 10, min_delay: float = 1.0,
+                 sample_size: int = 64, stats: Optional[HedgeStats] = None,
+                 task_group: Optional[TaskGroup] = None,
+                 limiter: Optional[asyncio.Semaphore] = None):
+        """
+        Initialize the hedger.
+
+        Args:
+            percentile: Latency percentile after which a hedge is issued
+            min_samples: Completed fetches needed before hedging starts
+            min_delay: Shortest hedge delay in seconds
+            sample_size: Number of recent latencies kept
+            stats: Optional aggregate counters to update as well
+            task_group: Task group of the download the requests belong to
+            limiter: Optional semaphore shared by all segment fetches
+        """
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.latencies: Deque[float] = deque(maxlen=sample_size)
+        self.stats = stats
+        self.task_group = task_group if task_group is not None else TaskGroup()
+        self.limiter = limiter
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def record(self, latency: float) -> None:
+        """
+        Record the latency of a completed fetch.
+
+        Args:
+            latency: Seconds the fetch took
+        """
+        self.latencies.append(latency)
+
+    def hedge_delay(self) -> Optional[float]:
+        """
+        Get how long a fetch may run before it is hedged.
+
+        Returns:
+            Optional[float]: Delay in seconds, or None while there are too few samples
+        """
+        if len(self.latencies) < self.min_samples:
+            return None
+
+        ordered = sorted(self.latencies)
+        position = min(len(ordered) - 1, int(len(ordered) * self.percentile))
+        return max(self.min_delay, ordered[position])
+
+    async def fetch(self, primary: Callable[[], Awaitable[Optional[bytes]]],
+                    hedge: Callable[[], Awaitable[Optional[bytes]]],
+                    discard: Optional[Callable[[bytes], None]] = None) -> Optional[bytes]:
+        """
+        Run a fetch, hedging it if it becomes a straggler.
+
+        Args:
+            primary: Starts the original request
+            hedge: Starts the duplicate request
+            discard: Called with the data of a copy that finished but lost the race
+
+        Returns:
+            Optional[bytes]: Data of the first copy that succeeded, None if all failed
+        """
+        self._count('requests')
+        start = time.monotonic()
+        primary_task = self.task_group.spawn(primary())
+
+        try:
+            # A fetch that started before enough samples existed is hedged once the delay is known
+            while True:
+                delay = self.hedge_delay()
+                elapsed = time.monotonic() - start
+                if delay is None:
+                    timeout = self.min_delay
+                elif elapsed < delay:
+                    timeout = delay - elapsed
+                elif self.limiter is None or not self.limiter.locked():
+                    done = set()
+                    break
+                else:
+                    # A duplicate would take a slot from a first request elsewhere; retry later
+                    timeout = self.min_delay
+                done, _ = await asyncio.wait({primary_task}, timeout=timeout)
+                if done:
+                    break
+        except BaseException:
+            await cancel_tasks([primary_task], self.task_group.grace)
+            raise
+
+        if done:
+            data = primary_task.result()
+            if data is not None:
+                self.record(time.monotonic() - start)
+            return data
+
+        self._count('hedged')
+        hedge_start = time.monotonic()
+        hedge_task = self.task_group.spawn(self._run_hedge(hedge))
+        started = {primary_task: start, hedge_task: hedge_start}
+        pending = {primary_task, hedge_task}
+        winner = None
+        data = None
+
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if result is None:
+                        continue
+                    if winner is None:
+                        winner, data = task, result
+                    elif discard is not None:
+                        # Both copies landed in the same tick
+                        discard(result)
+        finally:
+            await cancel_tasks(pending, self.task_group.grace)
+
+        if winner is not None:
+            self.record(time.monotonic() - started[winner])
+            if winner is hedge_task:
+                self._count('hedge_wins')
+        return data
+
+    async def _run_hedge(self, hedge: Callable[[], Awaitable[Optional[bytes]]]) -> Optional[bytes]:
+        """
+        Run the duplicate request, holding a global slot if a limiter is configured.
+
+        Args:
+            hedge: Starts the duplicate request
+
+        Returns:
+            Optional[bytes]: Data of the duplicate, None if it failed
+        """
+        if self.limiter is not None:
+            async with self.limiter:
+                return await hedge()
+        return await hedge()
+
+    def _count(self, counter: str) -> None:
+        """
+        Increment a counter here and in the aggregate statistics.
+
+        Args:
+            counter: Counter name ('requests', 'hedged' or 'hedge_wins')
+        """
+        setattr(self, counter, getattr(self, counter) + 1)
+        if self.stats is not None:
+            setattr(self.stats, counter, getattr(self.stats, counter) + 1)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get hedging statistics of this download.
+
+        Returns:
+            Dict[str, Any]: Request, hedge and win counts with the current hedge delay
+        """
+        delay = self.hedge_delay()
+        return {
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "hedge_rate": round(self.hedged / self.requests, 4) if self.requests else 0.0,
+            "hedge_delay": round(delay, 3) if delay is not None else None
+        }
+
+# Global hedging statistics
+hedge_stats = None
+
+def get_hedge_stats() -> HedgeStats:
+    """
+    Get or create the global hedging statistics.
+
+    Returns:
+        HedgeStats: The global statistics
+    """
+    global hedge_stats
+
+    if hedge_stats is None:
+        hedge_stats = HedgeStats()
+
+    return hedge_stats
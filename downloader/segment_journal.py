@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import logging
+import hashlib
+import asyncio
+from typing import Any, Dict, Iterable, List
+import aiofiles
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class SegmentJournal:
+    """
+    A crash-safe, append-only journal of completed segments for one download.
+
+    The first line is a header describing the job (playlist URL, resolved
+    variant, a fingerprint of the media playlist and the segment count). Every
+    following line records one segment that has been written to the temp
+    directory, with its size and SHA-256 hash. Neither the journal nor the
+    segment data is fsynced, so a resumed run re-hashes each stored segment and
+    fetches it again on a mismatch. A torn last line after a crash is simply
+    ignored on load, so the journal never needs to be rewritten while a
+    download runs.
+    """
+
+    def __init__(self, path: str):
+        """
+        Initialize the journal.
+
+        Args:
+            path: Path to the journal file
+        """
+        self.path = path
+        self.header: Dict[str, Any] = {}
+        self.completed: Dict[int, Dict[str, Any]] = {}
+        self.file = None
+        self.lock = asyncio.Lock()
+
+    def load(self) -> bool:
+        """
+        Load an existing journal from disk.
+
+        Returns:
+            bool: True if a valid header was found, False otherwise
+        """
+        self.header = {}
+        self.completed = {}
+
+        if not os.path.exists(self.path):
+            return False
+
+        try:
+            with open(self.path, 'r') as f:
+                for line_number, line in enumerate(f):
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn write from a crash; everything before it is still valid
+                        logger.warning(f"Ignoring corrupt journal line {line_number + 1} in {self.path}")
+                        break
+
+                    if line_number == 0:
+                        self.header = record
+                    else:
+                        self.completed[int(record['index'])] = {
+                            'size': int(record['size']),
+                            'sha256': record['sha256']
+                        }
+        except Exception as e:
+            logger.error(f"Error loading segment journal {self.path}: {str(e)}")
+            self.header = {}
+            self.completed = {}
+
+        return bool(self.header)
+
+    def matches(self, playlist_url: str, variant_url: str, fingerprint: str, total_segments: int) -> bool:
+        """
+        Check whether the loaded journal describes the given job.
+
+        Args:
+            playlist_url: URL the user requested
+            variant_url: Resolved media playlist URL
+            fingerprint: Fingerprint of the media playlist's segment list
+            total_segments: Number of segments in the media playlist
+
+        Returns:
+            bool: True if the journal can be used to resume this job
+        """
+        return (
+            self.header.get('playlist_url') == playlist_url and
+            self.header.get('variant_url') == variant_url and
+            self.header.get('fingerprint') == fingerprint and
+            self.header.get('total_segments') == total_segments
+        )
+
+    async def begin(self, playlist_url: str, variant_url: str, fingerprint: str,
+                    total_segments: int, keep: Iterable[int] = ()) -> None:
+        """
+        Start (or restart) the journal for a job and open it for appending.
+
+        The file is rewritten atomically with a fresh header and only the
+        entries listed in ``keep``, which also compacts it after a resume.
+
+        Args:
+            playlist_url: URL the user requested
+            variant_url: Resolved media playlist URL
+            fingerprint: Fingerprint of the media playlist's segment list
+            total_segments: Number of segments in the media playlist
+            keep: Indices of previously completed segments that are still valid
+        """
+        kept = {index: self.completed[index] for index in keep if index in self.completed}
+        self.header = {
+            'playlist_url': playlist_url,
+            'variant_url': variant_url,
+            'fingerprint': fingerprint,
+            'total_segments': total_segments,
+            'created': time.time()
+        }
+        self.completed = kept
+
+        lines = [json.dumps(self.header)]
+        for index in sorted(kept):
+            lines.append(json.dumps({'index': index, **kept[index]}))
+
+        tmp_path = f"{self.path}.tmp"
+        async with aiofiles.open(tmp_path, 'w') as f:
+            await f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self.path)
+
+        self.file = await aiofiles.open(self.path, 'a')
+
+    async def restate(self, fingerprint: str, total_segments: int) -> None:
+        """
+        Replace the header of an open journal, keeping every recorded segment.
+
+        Used when the segment list only became known in full after the
+        download started.
+
+        Args:
+            fingerprint: Fingerprint of the media playlist's segment list
+            total_segments: Number of segments in the media playlist
+        """
+        async with self.lock:
+            if self.file is not None:
+                await self.file.close()
+                self.file = None
+            await self.begin(
+                self.header.get('playlist_url'), self.header.get('variant_url'),
+                fingerprint, total_segments, keep=list(self.completed)
+            )
+
+    async def record(self, index: int, data: bytes) -> None:
+        """
+        Record a stored segment.
+
+        Args:
+            index: Segment index
+            data: Segment data
+        """
+        # Hash off the event loop; hashlib releases the GIL for large buffers
+        digest = await asyncio.to_thread(lambda: hashlib.sha256(data).hexdigest())
+        entry = {'size': len(data), 'sha256': digest}
+        self.completed[index] = entry
+
+        async with self.lock:
+            if self.file is not None:
+                await self.file.write(json.dumps({'index': index, **entry}) + '\n')
+                await self.file.flush()
+
+    async def close(self) -> None:
+        """Close the journal file."""
+        async with self.lock:
+            if self.file is not None:
+                await self.file.close()
+                self.file = None
+
+    @staticmethod
+    def fingerprint(segment_uris: List[str]) -> str:
+        """
+        Compute a fingerprint of a media playlist's segment list.
+
+        Args:
+            segment_uris: Segment URIs in playlist order
+
+        Returns:
+            str: Hex digest identifying the segment list
+        """
+        hash_obj = hashlib.sha256()
+        for uri in segment_uris:
+            hash_obj.update(uri.encode('utf-8', errors='replace'))
+            hash_obj.update(b'\n')
+        return hash_obj.hexdigest()
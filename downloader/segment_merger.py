@@ -0,0 +1,652 @@
+import os
+import shutil
+import hashlib
+import logging
+import asyncio
+import platform
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+import aiofiles
+
+from utils.ffmpeg_runner import create_ffmpeg_process, kill_process, read_stderr_tail, run_ffmpeg
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class ReorderBuffer:
+    """
+    A bounded reorder buffer that turns out-of-order segments into an in-order stream.
+
+    Segments that arrive ahead of the next expected index are held in memory.
+    As soon as the next expected segment arrives, the contiguous prefix is
+    handed to the writer. A segment more than ``max_pending`` positions ahead of
+    the next expected index waits until the gap closes, which bounds memory use
+    without ever blocking the segment the stream is waiting for.
+    """
+
+    def __init__(self, writer: Callable[[bytes], Awaitable[None]], max_pending: int = 32, start_index: int = 0):
+        """
+        Initialize the reorder buffer.
+
+        Args:
+            writer: Coroutine function that appends data to the output stream
+            max_pending: Maximum distance ahead of the next expected index that may be buffered
+            start_index: Index of the first segment expected by the stream
+        """
+        self.writer = writer
+        self.max_pending = max(1, max_pending)
+        self.next_index = start_index
+        self.pending: Dict[int, bytes] = {}
+        self.pending_bytes = 0
+        self.peak_pending_bytes = 0
+        self.written_bytes = 0
+        self.condition = asyncio.Condition()
+
+    async def put(self, index: int, data: bytes) -> None:
+        """
+        Add a segment and flush the contiguous prefix to the writer.
+
+        Args:
+            index: Segment index
+            data: Segment data
+        """
+        async with self.condition:
+            await self.condition.wait_for(lambda: index < self.next_index + self.max_pending)
+
+            if index < self.next_index or index in self.pending:
+                logger.debug(f"Ignoring duplicate segment {index}")
+                return
+
+            self.pending[index] = data
+            self.pending_bytes += len(data)
+            self.peak_pending_bytes = max(self.peak_pending_bytes, self.pending_bytes)
+
+            # Flush everything that is now contiguous
+            while self.next_index in self.pending:
+                chunk = self.pending.pop(self.next_index)
+                self.pending_bytes -= len(chunk)
+                await self.writer(chunk)
+                self.written_bytes += len(chunk)
+                self.next_index += 1
+
+            self.condition.notify_all()
+
+class TrackStream:
+    """
+    A separate track, such as an EXT-X-MEDIA audio rendition, written to its own stream file.
+
+    Segments pass through a bounded reorder buffer like the main stream, and
+    the finished file becomes an extra ffmpeg input of the final merge.
+    """
+
+    def __init__(self, path: str, max_pending: int = 32):
+        """
+        Initialize the track stream.
+
+        Args:
+            path: Path of the stream file
+            max_pending: Reorder buffer bound
+        """
+        self.path = path
+        self.header = b''
+        self.stream_file = None
+        self.buffer = ReorderBuffer(self._write, max_pending=max_pending)
+
+    async def start(self) -> None:
+        """Open the stream file and write the init segment, if any."""
+        self.stream_file = await aiofiles.open(self.path, 'wb')
+        if self.header:
+            await self.stream_file.write(self.header)
+
+    async def _write(self, data: bytes) -> None:
+        """Append in-order data to the stream file."""
+        await self.stream_file.write(data)
+
+    async def add(self, index: int, data: bytes) -> None:
+        """
+        Add a downloaded segment of the track.
+
+        Args:
+            index: Segment index within the track
+            data: Segment data
+        """
+        await self.buffer.put(index, data)
+
+    async def close(self) -> None:
+        """Close the stream file if it is open."""
+        if self.stream_file is not None:
+            await self.stream_file.close()
+            self.stream_file = None
+
+class SegmentMerger:
+    """
+    Base class for merge backends that receive segments as they are downloaded.
+    """
+
+    # Whether the backend needs ffmpeg to produce the output file
+    requires_ffmpeg = True
+
+    # Whether stored segments survive a restart and can be resumed
+    supports_resume = False
+
+    # Whether segments of a different rendition can follow mid-download
+    supports_switching = False
+
+    # Whether separate tracks can be muxed in by the final step
+    supports_tracks = True
+
+    def __init__(self, temp_dir: str, timeout: int = 3600, duration: float = 0,
+                 progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                 store_callback: Optional[Callable[[int, bytes], Awaitable[None]]] = None):
+        """
+        Initialize the merger.
+
+        Args:
+            temp_dir: Temporary directory of the download
+            timeout: Timeout for the final ffmpeg step in seconds
+            duration: Total media duration in seconds, used for merge progress
+            progress_callback: Optional function receiving ffmpeg progress blocks
+            store_callback: Optional coroutine function called once a segment is written to disk
+        """
+        self.temp_dir = temp_dir
+        self.timeout = timeout
+        self.duration = duration
+        self.progress_callback = progress_callback
+        self.store_callback = store_callback
+
+        # Set after a rendition switch to produce one resolution throughout
+        self.output_size: Optional[Tuple[int, int]] = None
+
+        # Stream files of separate tracks muxed into the output
+        self.track_paths: List[str] = []
+
+        # Set for audio-only jobs whose segments may carry video
+        self.audio_only = False
+
+    def extract_audio(self) -> None:
+        """
+        Keep only the audio of the stream in the output.
+
+        The final step stream-copies the audio track and drops the video.
+        """
+        self.audio_only = True
+        self.requires_ffmpeg = True
+
+    def add_track(self, path: str) -> None:
+        """
+        Mux a separate track file into the output.
+
+        The video is taken from the main stream and the audio from the track,
+        in the same ffmpeg pass that produces the output file.
+
+        Args:
+            path: Stream file of the track
+        """
+        self.track_paths.append(path)
+        self.requires_ffmpeg = True
+
+    async def resume(self, completed: Dict[int, Dict[str, Any]]) -> Set[int]:
+        """
+        Adopt segments stored by a previous run of the same job.
+
+        Args:
+            completed: Journal entries of previously stored segments (index -> size/hash)
+
+        Returns:
+            Set[int]: Indices that are present and do not need to be fetched again
+        """
+        return set()
+
+    async def start(self, output_path: str) -> None:
+        """
+        Prepare the merger before the first segment arrives.
+
+        Args:
+            output_path: Path the merged file will be written to
+        """
+
+    async def add(self, index: int, data: bytes) -> None:
+        """
+        Add a downloaded segment.
+
+        Args:
+            index: Segment index
+            data: Segment data
+        """
+        raise NotImplementedError
+
+    async def finish(self, output_path: str) -> Tuple[bool, str]:
+        """
+        Produce the final output file.
+
+        Args:
+            output_path: Path to save the merged file
+
+        Returns:
+            Tuple[bool, str]: (success, message)
+        """
+        raise NotImplementedError
+
+    async def abort(self) -> None:
+        """Release any resources held by the merger after a failure."""
+
+    def _track_args(self) -> List[str]:
+        """
+        Get the ffmpeg input and mapping arguments for separate tracks.
+
+        Returns:
+            List[str]: Extra inputs and stream maps, empty without separate tracks
+        """
+        if not self.track_paths:
+            return []
+
+        args = []
+        for path in self.track_paths:
+            args += ['-i', os.path.normpath(path)]
+        args += ['-map', '0:v']
+        for number in range(1, len(self.track_paths) + 1):
+            args += ['-map', f'{number}:a']
+        return args
+
+    def _codec_args(self) -> List[str]:
+        """
+        Get the ffmpeg codec arguments for the output.
+
+        Returns:
+            List[str]: A stream copy, an audio-only copy, or a scaled re-encode after a rendition switch
+        """
+        if self.audio_only:
+            return ['-vn', '-c:a', 'copy']
+
+        if not self.output_size:
+            return ['-c', 'copy']
+
+        width, height = self.output_size
+        return [
+            '-vf', f'scale={width}:{height}:force_original_aspect_ratio=decrease,'
+                   f'pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,setsar=1',
+            '-c:v', 'libx264', '-preset', 'veryfast', '-c:a', 'copy'
+        ]
+
+    async def _remux(self, cmd: List[str]) -> Tuple[bool, str]:
+        """
+        Run an ffmpeg merge command without blocking the event loop.
+
+        Args:
+            cmd: Command line to run
+
+        Returns:
+            Tuple[bool, str]: (success, message)
+        """
+        try:
+            returncode, stderr = await run_ffmpeg(
+                cmd,
+                timeout=self.timeout,
+                duration=self.duration,
+                progress_callback=self.progress_callback
+            )
+        except asyncio.TimeoutError:
+            logger.error("FFmpeg process timed out")
+            return False, "FFmpeg process timed out"
+
+        if returncode != 0:
+            logger.error(f"FFmpeg error: {stderr}")
+            return False, f"Error merging segments: FFmpeg failed with code {returncode}"
+
+        return True, "Segments merged successfully"
+
+class ConcatMerger(SegmentMerger):
+    """
+    Merge backend that writes every segment to its own file and runs the ffmpeg concat demuxer.
+    """
+
+    supports_resume = True
+    supports_switching = True
+
+    def __init__(self, temp_dir: str, timeout: int = 3600, **kwargs):
+        """Initialize the concat merger."""
+        super().__init__(temp_dir, timeout, **kwargs)
+        self.segment_files: Dict[int, str] = {}
+
+    async def resume(self, completed: Dict[int, Dict[str, Any]]) -> Set[int]:
+        """Adopt segment files whose size and SHA-256 hash match the journal."""
+        # Read and hash the files off the event loop
+        resumed = await asyncio.to_thread(self._verify_segment_files, completed)
+        for index in resumed:
+            self.segment_files[index] = self._segment_path(index)
+        return resumed
+
+    def _verify_segment_files(self, completed: Dict[int, Dict[str, Any]]) -> Set[int]:
+        """Get the indices of segment files that match their journal entry."""
+        resumed = set()
+        for index, entry in completed.items():
+            try:
+                with open(self._segment_path(index), 'rb') as f:
+                    data = f.read()
+            except OSError:
+                continue
+            if len(data) == entry['size'] and hashlib.sha256(data).hexdigest() == entry['sha256']:
+                resumed.add(index)
+        return resumed
+
+    async def add(self, index: int, data: bytes) -> None:
+        """Write the segment to its own file in the temporary directory."""
+        segment_path = self._segment_path(index)
+        async with aiofiles.open(segment_path, 'wb') as f:
+            await f.write(data)
+        self.segment_files[index] = segment_path
+
+        if self.store_callback:
+            await self.store_callback(index, data)
+
+    def _segment_path(self, index: int) -> str:
+        """Get the file path for a segment index."""
+        return os.path.join(self.temp_dir, f"segment_{index:05d}.ts")
+
+    async def finish(self, output_path: str) -> Tuple[bool, str]:
+        """Concatenate the segment files with the ffmpeg concat demuxer."""
+        # Create a file list for ffmpeg
+        file_list_path = os.path.join(self.temp_dir, "filelist.txt")
+
+        # Use platform-safe path handling
+        file_list_path = os.path.normpath(file_list_path)
+
+        async with aiofiles.open(file_list_path, 'w') as f:
+            for index in sorted(self.segment_files):
+                segment_file = self.segment_files[index]
+                if os.path.exists(segment_file):
+                    # Normalize path for the current platform
+                    normalized_path = os.path.normpath(segment_file)
+                    # Escape backslashes in Windows paths for the filelist.txt
+                    if platform.system().lower() == 'windows':
+                        normalized_path = normalized_path.replace('\\', '\\\\')
+                    await f.write(f"file '{normalized_path}'\n")
+
+        # Use ffmpeg to concatenate the segments
+        cmd = [
+            'ffmpeg', '-y', '-f', 'concat', '-safe', '0',
+            '-i', file_list_path, *self._track_args(), *self._codec_args(), output_path
+        ]
+        return await self._remux(cmd)
+
+class StreamMerger(SegmentMerger):
+    """
+    Merge backend that appends segments to a single stream file in playlist order.
+
+    Segments pass through a bounded reorder buffer, so no per-segment files are
+    written and the stream is complete as soon as the last segment lands. The
+    final step is a single-input stream copy into the output container.
+    """
+
+    supports_resume = True
+    supports_switching = True
+
+    def __init__(self, temp_dir: str, timeout: int = 3600, max_pending: int = 32, **kwargs):
+        """Initialize the stream merger."""
+        super().__init__(temp_dir, timeout, **kwargs)
+        self.stream_path = os.path.join(self.temp_dir, "stream.ts")
+        self.stream_file = None
+        self.resume_offset = 0
+        self.header = b''
+        self.buffer = ReorderBuffer(self._write, max_pending=max_pending)
+
+    async def resume(self, completed: Dict[int, Dict[str, Any]]) -> Set[int]:
+        """Keep the contiguous prefix of the stream file that the journal vouches for."""
+        # Read and hash the prefix off the event loop
+        index, offset = await asyncio.to_thread(self._verify_prefix, completed)
+
+        # Without any resumed segment the file is rewritten from scratch
+        self.resume_offset = offset if index else 0
+        self.buffer.next_index = index
+        return set(range(index))
+
+    def _verify_prefix(self, completed: Dict[int, Dict[str, Any]]) -> Tuple[int, int]:
+        """
+        Find the prefix of the stream file whose segments match their journal entries.
+
+        Args:
+            completed: Journal entries of previously stored segments
+
+        Returns:
+            Tuple[int, int]: (number of segments in the prefix, byte offset where it ends)
+        """
+        index = 0
+        offset = len(self.header)
+        try:
+            with open(self.stream_path, 'rb') as f:
+                if f.read(offset) != self.header:
+                    return 0, 0
+                while index in completed:
+                    entry = completed[index]
+                    data = f.read(entry['size'])
+                    if len(data) != entry['size'] or hashlib.sha256(data).hexdigest() != entry['sha256']:
+                        break
+                    offset += len(data)
+                    index += 1
+        except OSError:
+            return 0, 0
+        return index, offset
+
+    async def start(self, output_path: str) -> None:
+        """Open the stream file, truncating it to the resumed prefix."""
+        if self.resume_offset:
+            self.stream_file = await aiofiles.open(self.stream_path, 'r+b')
+            await self.stream_file.truncate(self.resume_offset)
+            await self.stream_file.seek(self.resume_offset)
+        else:
+            self.stream_file = await aiofiles.open(self.stream_path, 'wb')
+            if self.header:
+                await self.stream_file.write(self.header)
+
+    async def _write(self, data: bytes) -> None:
+        """Append in-order data to the stream file."""
+        index = self.buffer.next_index
+        await self.stream_file.write(data)
+
+        if self.store_callback:
+            await self.stream_file.flush()
+            await self.store_callback(index, data)
+
+    async def add(self, index: int, data: bytes) -> None:
+        """Pass the segment through the reorder buffer."""
+        await self.buffer.put(index, data)
+
+    async def finish(self, output_path: str) -> Tuple[bool, str]:
+        """Close the stream and copy it into the output container."""
+        await self._close()
+
+        if self.buffer.pending:
+            return False, f"Error merging segments: stream is missing segment {self.buffer.next_index}"
+
+        cmd = [
+            'ffmpeg', '-y', '-i', os.path.normpath(self.stream_path),
+            *self._track_args(), *self._codec_args(), output_path
+        ]
+        return await self._remux(cmd)
+
+    async def abort(self) -> None:
+        """Close the stream file."""
+        await self._close()
+
+    async def _close(self) -> None:
+        """Close the stream file if it is open."""
+        if self.stream_file is not None:
+            await self.stream_file.close()
+            self.stream_file = None
+
+class FragmentedMP4Merger(StreamMerger):
+    """
+    Merge backend for fMP4/CMAF playlists that needs no ffmpeg at all.
+
+    The EXT-X-MAP init segment is written once at the start of the stream
+    file and the fragments are appended byte-for-byte in playlist order,
+    which already is a playable MP4. The final step is a plain file move.
+    """
+
+    requires_ffmpeg = False
+    supports_switching = False
+
+    def __init__(self, temp_dir: str, timeout: int = 3600, max_pending: int = 32, **kwargs):
+        """Initialize the fMP4 merger."""
+        super().__init__(temp_dir, timeout, max_pending=max_pending, **kwargs)
+        self.stream_path = os.path.join(self.temp_dir, "stream.mp4")
+
+    def set_init_segment(self, data: bytes) -> None:
+        """
+        Set the init segment written before the first fragment.
+
+        Must be called before ``resume`` and ``start``.
+
+        Args:
+            data: EXT-X-MAP init segment data
+        """
+        self.header = data
+
+    async def finish(self, output_path: str) -> Tuple[bool, str]:
+        """Close the stream and move it into place as the output file."""
+        await self._close()
+
+        if self.buffer.pending:
+            return False, f"Error merging segments: stream is missing segment {self.buffer.next_index}"
+
+        # Separate tracks and audio extraction still need one ffmpeg pass
+        if self.track_paths or self.audio_only:
+            cmd = [
+                'ffmpeg', '-y', '-i', os.path.normpath(self.stream_path),
+                *self._track_args(), *self._codec_args(), output_path
+            ]
+            return await self._remux(cmd)
+
+        # The temp and download directories may be on different filesystems
+        await asyncio.to_thread(shutil.move, self.stream_path, output_path)
+        if self.progress_callback:
+            self.progress_callback({'progress': 'end', 'percent': 100})
+
+        return True, "Segments merged successfully"
+
+class PipeMerger(SegmentMerger):
+    """
+    Merge backend that feeds segments into a running ffmpeg remux over stdin.
+
+    ffmpeg is started once before the first segment is fetched and reads
+    MPEG-TS from ``pipe:0``. Segments are written in playlist order through a
+    bounded reorder buffer; every write waits for the pipe to drain, so a slow
+    ffmpeg holds up the reorder buffer and, through it, the segment fetchers
+    instead of buffering without limit. Nothing is kept in the temporary
+    directory and the output file is complete shortly after the last segment.
+    """
+
+    # ffmpeg is already running before a separate track is complete
+    supports_tracks = False
+
+    def __init__(self, temp_dir: str, timeout: int = 3600, max_pending: int = 32, **kwargs):
+        """Initialize the pipe merger."""
+        super().__init__(temp_dir, timeout, **kwargs)
+        self.output_path: Optional[str] = None
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.stderr_task: Optional[asyncio.Task] = None
+        self.stderr_tail: Deque[str] = deque(maxlen=20)
+        self.buffer = ReorderBuffer(self._write, max_pending=max_pending)
+
+    async def start(self, output_path: str) -> None:
+        """Start the ffmpeg remux process reading from stdin."""
+        self.output_path = output_path
+        cmd = [
+            'ffmpeg', '-y', '-f', 'mpegts', '-i', 'pipe:0',
+            *self._codec_args(), output_path
+        ]
+
+        self.process = await create_ffmpeg_process(cmd, stdin=True)
+
+        # Keep draining stderr so ffmpeg never blocks on a full pipe
+        self.stderr_task = asyncio.create_task(read_stderr_tail(self.process, self.stderr_tail))
+
+    async def _write(self, data: bytes) -> None:
+        """Write in-order data to ffmpeg and wait for the pipe to drain."""
+        self.process.stdin.write(data)
+        await self.process.stdin.drain()
+
+    async def add(self, index: int, data: bytes) -> None:
+        """Pass the segment through the reorder buffer."""
+        await self.buffer.put(index, data)
+
+    async def finish(self, output_path: str) -> Tuple[bool, str]:
+        """Close ffmpeg's stdin and wait for the remux to complete."""
+        if self.process is None:
+            return False, "Error merging segments: FFmpeg was not started"
+
+        if self.buffer.pending:
+            await self.abort()
+            return False, f"Error merging segments: stream is missing segment {self.buffer.next_index}"
+
+        try:
+            self.process.stdin.close()
+            await self.process.stdin.wait_closed()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+        try:
+            await asyncio.wait_for(asyncio.shield(self.process.wait()), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            await self.abort()
+            logger.error("FFmpeg process timed out")
+            return False, "FFmpeg process timed out"
+        except asyncio.CancelledError:
+            await self.abort()
+            raise
+
+        if self.stderr_task is not None:
+            await self.stderr_task
+
+        if self.process.returncode != 0:
+            logger.error(f"FFmpeg error: {chr(10).join(self.stderr_tail)}")
+            return False, f"Error merging segments: FFmpeg failed with code {self.process.returncode}"
+
+        return True, "Segments merged successfully"
+
+    async def abort(self) -> None:
+        """Kill the ffmpeg process if it is still running and drop the partial output."""
+        await kill_process(self.process)
+
+        if self.stderr_task is not None and not self.stderr_task.done():
+            self.stderr_task.cancel()
+
+        if self.output_path and os.path.exists(self.output_path):
+            try:
+                os.remove(self.output_path)
+            except OSError as e:
+                logger.warning(f"Could not remove partial output {self.output_path}: {str(e)}")
+
+def create_merger(mode: str, temp_dir: str, timeout: int = 3600, max_pending: int = 32,
+                  duration: float = 0,
+                  progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                  store_callback: Optional[Callable[[int, bytes], Awaitable[None]]] = None) -> SegmentMerger:
+    """
+    Create a merge backend for the configured merge mode.
+
+    Args:
+        mode: Merge mode ('stream', 'pipe', 'concat' or 'fmp4')
+        temp_dir: Temporary directory of the download
+        timeout: Timeout for the final ffmpeg step in seconds
+        max_pending: Reorder buffer bound for streaming backends
+        duration: Total media duration in seconds, used for merge progress
+        progress_callback: Optional function receiving ffmpeg progress blocks
+        store_callback: Optional coroutine function called once a segment is written to disk
+
+    Returns:
+        SegmentMerger: Merge backend instance
+    """
+    kwargs = {
+        'duration': duration,
+        'progress_callback': progress_callback,
+        'store_callback': store_callback
+    }
+    if mode == 'concat':
+        return ConcatMerger(temp_dir, timeout, **kwargs)
+    if mode == 'fmp4':
+        return FragmentedMP4Merger(temp_dir, timeout, max_pending=max_pending, **kwargs)
+    if mode == 'pipe':
+        return PipeMerger(temp_dir, timeout, max_pending=max_pending, **kwargs)
+    if mode != 'stream':
+        logger.warning(f"Unknown merge mode '{mode}', falling back to 'stream'")
+    return StreamMerger(temp_dir, timeout, max_pending=max_pending, **kwargs)
@@ -0,0 +1,131 @@
+import logging
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# A byte range as (start, end), end exclusive
+ByteRange = Tuple[int, int]
+
+def parse_byterange(byterange: str, previous_end: Optional[int] = None) -> ByteRange:
+    """
+    Parse an HLS byte range of the form ``length[@offset]``.
+
+    Args:
+        byterange: Byte range attribute value
+        previous_end: End of the previous sub-range of the same resource, used when no offset is given
+
+    Returns:
+        ByteRange: (start, end), end exclusive
+
+    Raises:
+        ValueError: If the byte range is malformed or has no offset to continue from
+    """
+    length_text, _, offset_text = str(byterange).partition('@')
+    length = int(length_text)
+    if offset_text:
+        start = int(offset_text)
+    elif previous_end is not None:
+        start = previous_end
+    else:
+        raise ValueError("no offset and no previous sub-range of the same resource")
+
+    if length <= 0 or start < 0:
+        raise ValueError("length must be positive and offset non-negative")
+
+    return start, start + length
+
+def parse_byteranges(segments: Iterable, urls: List[str],
+                     previous: Optional[Tuple[str, int]] = None) -> List[Optional[ByteRange]]:
+    """
+    Resolve the EXT-X-BYTERANGE of every segment in a media playlist.
+
+    A byte range without an offset continues right after the previous
+    sub-range of the same resource.
+
+    Args:
+        segments: Playlist segments in order
+        urls: Resolved segment URLs, one per segment
+        previous: (URL, end) of the sub-range right before the first segment, when resolving a continuation
+
+    Returns:
+        List[Optional[ByteRange]]: Byte range per segment, None if the segment is a whole resource
+
+    Raises:
+        ValueError: If a byte range is malformed or has no offset to continue from
+    """
+    ranges: List[Optional[ByteRange]] = []
+    previous_url, previous_end = previous if previous else (None, None)
+
+    for i, (segment, url) in enumerate(zip(segments, urls)):
+        byterange = getattr(segment, 'byterange', None)
+        if not byterange:
+            ranges.append(None)
+            previous_url = previous_end = None
+            continue
+
+        try:
+            byte_range = parse_byterange(byterange, previous_end if url == previous_url else None)
+        except ValueError as e:
+            raise ValueError(f"Invalid byte range '{byterange}' for segment {i}: {str(e)}")
+
+        ranges.append(byte_range)
+        previous_url, previous_end = url, byte_range[1]
+
+    return ranges
+
+def coalesce_ranges(entries: Iterable[Tuple[int, str, Optional[ByteRange]]],
+                    max_bytes: int) -> Iterator[Tuple[str, Optional[ByteRange], List[Tuple[int, Optional[ByteRange]]]]]:
+    """
+    Group adjacent byte-range segments of the same resource into larger requests.
+
+    Entries must be given in playlist order. Consecutive entries are merged
+    while they address the same URL, each range starts where the previous one
+    ended, and the combined request stays within ``max_bytes``. A segment
+    larger than the cap still gets a request of its own.
+
+    Args:
+        entries: (segment index, URL, byte range or None) in playlist order
+        max_bytes: Maximum size of one coalesced request
+
+    Yields:
+        Tuple: (URL, byte range to request or None, [(segment index, byte range), ...])
+    """
+    group_url: Optional[str] = None
+    group_range: Optional[ByteRange] = None
+    members: List[Tuple[int, Optional[ByteRange]]] = []
+
+    for index, url, byte_range in entries:
+        if (
+            members and byte_range is not None and group_range is not None and
+            url == group_url and byte_range[0] == group_range[1] and
+            byte_range[1] - group_range[0] <= max_bytes
+        ):
+            group_range = (group_range[0], byte_range[1])
+            members.append((index, byte_range))
+            continue
+
+        if members:
+            yield group_url, group_range, members
+
+        group_url, group_range, members = url, byte_range, [(index, byte_range)]
+
+    if members:
+        yield group_url, group_range, members
+
+def split_range(data: bytes, group_range: ByteRange,
+                members: List[Tuple[int, Optional[ByteRange]]]) -> Iterator[Tuple[int, bytes]]:
+    """
+    Split the body of a coalesced request back into its segments.
+
+    Args:
+        data: Body covering ``group_range``
+        group_range: Byte range that was requested
+        members: (segment index, byte range) of the segments in the request
+
+    Yields:
+        Tuple[int, bytes]: (segment index, segment data)
+    """
+    view = memoryview(data)
+    for index, (start, end) in members:
+        yield index, bytes(view[start - group_range[0]:end - group_range[0]])
@@ -0,0 +1,170 @@
+import logging
+import asyncio
+from typing import Any, AsyncIterable, Awaitable, Callable, Dict, Iterable, Optional, Set, Union
+
+from downloader.task_group import TaskGroup, cancel_tasks
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class SegmentScheduler:
+    """
+    A sliding-window scheduler for segment downloads.
+
+    Jobs are issued in playlist order and at most ``window_size`` of them are
+    in flight at once. Whenever one completes, the next job is started, so the
+    number of coroutines, pending requests and open buffers stays flat no matter
+    how long the playlist is. An optional global limiter caps the number of
+    segment fetches across all concurrent downloads. Jobs are spawned in the
+    download's task group, and whenever the run ends early the jobs still in
+    flight are cancelled and given a bounded time to unwind.
+    """
+
+    def __init__(self, window_size: int = 16, global_limiter: Optional[asyncio.Semaphore] = None,
+                 task_group: Optional[TaskGroup] = None):
+        """
+        Initialize the scheduler.
+
+        Args:
+            window_size: Maximum number of in-flight jobs for this download
+            global_limiter: Optional semaphore shared by all downloads
+            task_group: Task group of the download the jobs belong to
+        """
+        self.window_size = max(1, window_size)
+        self.global_limiter = global_limiter
+        self.task_group = task_group if task_group is not None else TaskGroup()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.issued = 0
+        self.completed = 0
+
+    async def run(self, jobs: Union[Iterable[Any], AsyncIterable[Any]],
+                  worker: Callable[[Any], Awaitable[bool]]) -> bool:
+        """
+        Run a worker over all jobs with a bounded in-flight window.
+
+        Args:
+            jobs: Jobs in the order they should be issued (sync or async iterable)
+            worker: Coroutine function called for each job, returning True on success
+
+        Returns:
+            bool: True if every job succeeded, False as soon as one fails
+        """
+        pending: Set[asyncio.Task] = set()
+
+        try:
+            async for job in self._iterate(jobs):
+                # Wait for a free slot before issuing the next job
+                while len(pending) >= self.window_size:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    if not self._all_succeeded(done):
+                        return False
+
+                pending.add(self.task_group.spawn(self._run_job(worker, job)))
+                self.issued += 1
+
+            # Drain the remaining window
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                if not self._all_succeeded(done):
+                    return False
+
+            return True
+        finally:
+            # Never leave orphaned fetches behind on failure, timeout or cancellation
+            await cancel_tasks(pending, self.task_group.grace)
+
+    async def _run_job(self, worker: Callable[[Any], Awaitable[bool]], job: Any) -> bool:
+        """
+        Run a single job, holding a global slot if a limiter is configured.
+
+        Args:
+            worker: Coroutine function to call
+            job: Job to pass to the worker
+
+        Returns:
+            bool: Worker result
+        """
+        if self.global_limiter is not None:
+            async with self.global_limiter:
+                return await self._call_worker(worker, job)
+        return await self._call_worker(worker, job)
+
+    async def _call_worker(self, worker: Callable[[Any], Awaitable[bool]], job: Any) -> bool:
+        """Call the worker while tracking the in-flight count."""
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            return await worker(job)
+        finally:
+            self.in_flight -= 1
+
+    def _all_succeeded(self, done: Set[asyncio.Task]) -> bool:
+        """
+        Check the results of finished jobs.
+
+        Args:
+            done: Finished tasks
+
+        Returns:
+            bool: True if all finished jobs succeeded
+        """
+        success = True
+        for task in done:
+            if task.cancelled():
+                success = False
+                continue
+            error = task.exception()
+            if error is not None:
+                logger.error(f"Segment job failed with exception: {str(error)}")
+                success = False
+            elif not task.result():
+                success = False
+            else:
+                self.completed += 1
+        return success
+
+    @staticmethod
+    async def _iterate(jobs: Union[Iterable[Any], AsyncIterable[Any]]):
+        """Iterate over a sync or async iterable of jobs."""
+        if hasattr(jobs, '__aiter__'):
+            async for job in jobs:
+                yield job
+        else:
+            for job in jobs:
+                yield job
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get statistics about the scheduler.
+
+        Returns:
+            Dict[str, Any]: Scheduler statistics
+        """
+        return {
+            "window_size": self.window_size,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "issued": self.issued,
+            "completed": self.completed
+        }
+
+# Global segment limiter shared by all downloads
+global_segment_limiter = None
+
+def get_global_segment_limiter(limit: int = 64) -> asyncio.Semaphore:
+    """
+    Get or create the global segment limiter.
+
+    Args:
+        limit: Maximum number of segment fetches in flight across all downloads
+
+    Returns:
+        asyncio.Semaphore: The global segment limiter
+    """
+    global global_segment_limiter
+
+    if global_segment_limiter is None:
+        global_segment_limiter = asyncio.Semaphore(max(1, limit))
+
+    return global_segment_limiter
@@ -0,0 +1,105 @@
+import logging
+import asyncio
+from typing import Any, Awaitable, Iterable, Set
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+async def cancel_tasks(tasks: Iterable[asyncio.Future], grace: float = 10.0) -> Set[asyncio.Future]:
+    """
+    Cancel tasks and wait a bounded time for them to unwind.
+
+    Waiting lets each task run its cleanup (closing responses so pooled
+    connections are released, closing files, killing child processes)
+    before the caller tears down what they were using.
+
+    Args:
+        tasks: Tasks to cancel
+        grace: Seconds to wait for them to finish
+
+    Returns:
+        Set[asyncio.Future]: Tasks still running when the grace period ran out
+    """
+    tasks = {task for task in tasks if not task.done()}
+    if not tasks:
+        return set()
+
+    for task in tasks:
+        task.cancel()
+
+    # A second cancellation of the caller must not abandon the wait halfway
+    done, pending = await asyncio.shield(asyncio.wait(tasks, timeout=grace))
+    for task in done:
+        # Retrieve errors raised while unwinding so they are not reported as unhandled
+        if not task.cancelled():
+            task.exception()
+
+    if pending:
+        logger.warning(f"{len(pending)} task(s) did not stop within {grace} seconds of being cancelled")
+    return pending
+
+class TaskGroup:
+    """
+    The child tasks of one download.
+
+    Everything a download starts in the background (segment jobs, hedged
+    duplicates) is spawned here, so cancelling or timing out the download
+    stops all of it. Closing the group cancels the children that are still
+    running and waits up to ``grace`` seconds for them to unwind; the group
+    accepts no new tasks afterwards.
+    """
+
+    def __init__(self, grace: float = 10.0):
+        """
+        Initialize the task group.
+
+        Args:
+            grace: Seconds cancelled children get to finish their cleanup
+        """
+        self.grace = grace
+        self.tasks: Set[asyncio.Task] = set()
+        self.closed = False
+        self.stragglers = 0
+
+    def spawn(self, coro: Awaitable[Any]) -> asyncio.Task:
+        """
+        Start a child task.
+
+        Args:
+            coro: Coroutine to run
+
+        Returns:
+            asyncio.Task: The child task
+
+        Raises:
+            RuntimeError: If the group was already closed
+        """
+        if self.closed:
+            # Don't leave a never-awaited coroutine behind
+            if asyncio.iscoroutine(coro):
+                coro.close()
+            raise RuntimeError("Task group is closed")
+
+        task = asyncio.ensure_future(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    async def cancel(self) -> None:
+        """Cancel the running children and wait for them to unwind."""
+        pending = await cancel_tasks(list(self.tasks), self.grace)
+        self.stragglers += len(pending)
+
+    async def close(self) -> None:
+        """Refuse new children, then cancel the running ones."""
+        self.closed = True
+        await self.cancel()
+
+    async def __aenter__(self) -> 'TaskGroup':
+        """Enter the group."""
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb) -> bool:
+        """Close the group however the block was left."""
+        await self.close()
+        return False
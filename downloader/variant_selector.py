@@ -0,0 +1,254 @@
+import logging
+from typing import Any, Dict, List, Optional, Sequence
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class VariantCandidate:
+    """
+    A variant stream of a master playlist, as seen by the selection policies.
+    """
+
+    def __init__(self, url: str, bandwidth: int = 0, width: int = 0, height: int = 0):
+        """
+        Initialize the candidate.
+
+        Args:
+            url: Absolute media playlist URL
+            bandwidth: BANDWIDTH attribute in bits per second
+            width: Horizontal resolution, 0 if unknown
+            height: Vertical resolution, 0 if unknown
+        """
+        self.url = url
+        self.bandwidth = bandwidth
+        self.width = width
+        self.height = height
+
+    def estimate_size(self, duration: float) -> int:
+        """
+        Estimate the download size of this variant.
+
+        Args:
+            duration: Total media duration in seconds
+
+        Returns:
+            int: Estimated size in bytes
+        """
+        return int(self.bandwidth / 8 * duration)
+
+    def describe(self) -> Dict[str, Any]:
+        """
+        Describe the variant for the active downloads registry.
+
+        Returns:
+            Dict[str, Any]: Variant details
+        """
+        return {
+            'url': self.url,
+            'bandwidth': self.bandwidth,
+            'resolution': f"{self.width}x{self.height}" if self.height else None
+        }
+
+class VariantPolicy:
+    """
+    Base class for variant selection policies.
+
+    A policy narrows down the candidates; the selector applies its policies in
+    order and picks the highest-bandwidth variant that is left.
+    """
+
+    # Registry name of the policy
+    name = ''
+
+    def apply(self, candidates: List[VariantCandidate], duration: float) -> List[VariantCandidate]:
+        """
+        Narrow down the candidates.
+
+        Args:
+            candidates: Candidates sorted by bandwidth, highest first
+            duration: Total media duration in seconds, 0 if unknown
+
+        Returns:
+            List[VariantCandidate]: Remaining candidates, highest bandwidth first
+        """
+        return candidates
+
+class HighestBandwidthPolicy(VariantPolicy):
+    """Keep every variant, so the highest bandwidth wins."""
+
+    name = 'highest'
+
+class LowestBandwidthPolicy(VariantPolicy):
+    """Keep only the variant with the lowest bandwidth."""
+
+    name = 'lowest'
+
+    def apply(self, candidates: List[VariantCandidate], duration: float) -> List[VariantCandidate]:
+        """Keep the smallest variant."""
+        return candidates[-1:]
+
+class ResolutionCapPolicy(VariantPolicy):
+    """
+    Keep variants up to a maximum height.
+
+    If every variant is taller than the cap, the lowest resolution is kept
+    rather than failing the download.
+    """
+
+    name = 'max_height'
+
+    def __init__(self, max_height: int = 0):
+        """
+        Initialize the policy.
+
+        Args:
+            max_height: Maximum vertical resolution, 0 for no cap
+        """
+        self.max_height = max_height
+
+    def apply(self, candidates: List[VariantCandidate], duration: float) -> List[VariantCandidate]:
+        """Drop variants taller than the cap."""
+        if self.max_height <= 0:
+            return candidates
+
+        allowed = [c for c in candidates if not c.height or c.height <= self.max_height]
+        if allowed:
+            return allowed
+
+        smallest = min(candidates, key=lambda c: (c.height, c.bandwidth))
+        return [smallest]
+
+class SizeBudgetPolicy(VariantPolicy):
+    """
+    Keep variants whose estimated size (bandwidth x duration) fits a byte budget.
+
+    An empty result means even the smallest variant would not fit, so the
+    download can fail before a single segment is fetched.
+    """
+
+    name = 'size_budget'
+
+    def __init__(self, budget: int):
+        """
+        Initialize the policy.
+
+        Args:
+            budget: Maximum download size in bytes
+        """
+        self.budget = budget
+
+    def apply(self, candidates: List[VariantCandidate], duration: float) -> List[VariantCandidate]:
+        """Drop variants that would exceed the budget."""
+        if duration <= 0 or self.budget <= 0:
+            return candidates
+
+        return [
+            c for c in candidates
+            if not c.bandwidth or c.estimate_size(duration) <= self.budget
+        ]
+
+class VariantSelector:
+    """
+    Picks a variant from a master playlist by applying a chain of policies.
+    """
+
+    def __init__(self, policies: Sequence[VariantPolicy]):
+        """
+        Initialize the selector.
+
+        Args:
+            policies: Policies applied in order
+        """
+        self.policies = list(policies)
+
+    def select(self, candidates: List[VariantCandidate], duration: float) -> Optional[VariantCandidate]:
+        """
+        Select a variant.
+
+        Args:
+            candidates: All variants of the master playlist
+            duration: Total media duration in seconds, 0 if unknown
+
+        Returns:
+            Optional[VariantCandidate]: The chosen variant, or None if no variant satisfies the policies
+        """
+        remaining = sorted(candidates, key=lambda c: c.bandwidth, reverse=True)
+        for policy in self.policies:
+            remaining = policy.apply(remaining, duration)
+            if not remaining:
+                logger.info(f"Variant policy '{policy.name}' rejected every variant")
+                return None
+
+        return remaining[0]
+
+# Per-user quality preferences ('best', 'smallest' or a maximum height such as '720')
+user_preferences: Dict[int, str] = {}
+
+def set_user_preference(user_id: int, preference: Optional[str]) -> None:
+    """
+    Set or clear a user's quality preference.
+
+    Args:
+        user_id: Telegram user ID
+        preference: 'best', 'smallest', a maximum height, or None to use the defaults
+    """
+    if preference:
+        user_preferences[user_id] = preference
+    else:
+        user_preferences.pop(user_id, None)
+
+def get_user_preference(user_id: int) -> Optional[str]:
+    """
+    Get a user's quality preference.
+
+    Args:
+        user_id: Telegram user ID
+
+    Returns:
+        Optional[str]: The preference, or None if the user has not set one
+    """
+    return user_preferences.get(user_id)
+
+def create_variant_selector(policy_names: Sequence[str], budget: int, max_height: int = 0,
+                            preference: Optional[str] = None) -> VariantSelector:
+    """
+    Build a selector from configured policy names and a user preference.
+
+    The size budget always applies. A user preference replaces the configured
+    resolution cap ('720' etc.) or picks the smallest variant ('smallest').
+
+    Args:
+        policy_names: Configured policy names ('highest', 'lowest', 'max_height', 'size_budget')
+        budget: Maximum download size in bytes
+        max_height: Configured maximum vertical resolution, 0 for no cap
+        preference: Optional per-user preference
+
+    Returns:
+        VariantSelector: The selector
+    """
+    if preference == 'best':
+        max_height = 0
+    elif preference and preference.isdigit():
+        max_height = int(preference)
+
+    policies: List[VariantPolicy] = []
+    for name in policy_names:
+        if name == 'highest':
+            policies.append(HighestBandwidthPolicy())
+        elif name == 'lowest':
+            policies.append(LowestBandwidthPolicy())
+        elif name == 'max_height':
+            policies.append(ResolutionCapPolicy(max_height))
+        elif name == 'size_budget':
+            policies.append(SizeBudgetPolicy(budget))
+        else:
+            logger.warning(f"Unknown variant policy '{name}', ignoring it")
+
+    if preference and preference.isdigit() and not any(isinstance(p, ResolutionCapPolicy) for p in policies):
+        policies.insert(0, ResolutionCapPolicy(max_height))
+    if not any(isinstance(p, SizeBudgetPolicy) for p in policies):
+        policies.append(SizeBudgetPolicy(budget))
+    if preference == 'smallest':
+        policies.append(LowestBandwidthPolicy())
+
+    return VariantSelector(policies)
@@ -10,7 +10,7 @@ from config.config import (
     CONNECTION_POOL_MAX_CONNECTIONS, CONNECTION_POOL_MAX_KEEPALIVE,
     CONNECTION_POOL_TTL_DNS_CACHE, CONNECTION_POOL_TIMEOUT,
     CONNECTION_POOL_CONNECT_TIMEOUT,
-    CACHE_ENABLED, CACHE_TTL, CACHE_MAX_SIZE,
+    CACHE_ENABLED, CACHE_TTL, CACHE_MAX_SIZE, SEGMENT_CACHE_ENABLED,
     RESOURCE_MONITOR_ENABLED, RESOURCE_CPU_THRESHOLD, RESOURCE_MEMORY_THRESHOLD,
     RESOURCE_CHECK_INTERVAL, MAX_CONCURRENT_DOWNLOADS
 )
@@ -18,6 +18,8 @@ from utils.system_checks import check_ffmpeg, get_platform_info
 from utils.connection_pool import get_connection_pool, close_connection_pool
 from utils.cache_manager import get_cache_manager, close_cache_manager
 from utils.resource_manager import get_resource_manager, close_resource_manager
+from downloader.segment_decryptor import close_decrypt_executor
+from downloader.segment_cache import close_segment_cache
 from web.server import WebServer
 
 # Configure logging
@@ -150,12 +152,21 @@ async def main():
             await close_cache_manager()
             logger.info("Cache manager closed")
 
+        # Save the segment cache index if enabled
+        if SEGMENT_CACHE_ENABLED:
+            logger.info("Closing segment cache...")
+            close_segment_cache()
+            logger.info("Segment cache closed")
+
         # Close the resource manager if enabled
         if RESOURCE_MONITOR_ENABLED:
             logger.info("Closing resource manager...")
             await close_resource_manager()
             logger.info("Resource manager closed")
 
+        # Shut down the segment decryption pool
+        close_decrypt_executor()
+
 
 
 if __name__ == "__main__":
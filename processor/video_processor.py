@@ -5,9 +5,10 @@ import asyncio
 import subprocess
 import platform
 import json
-from typing import Dict, Any, Tuple, Optional
+from typing import Dict, Any, Tuple, Optional, Callable
 
 from utils.system_checks import check_ffmpeg
+from utils.ffmpeg_runner import run_ffmpeg
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -124,7 +125,8 @@ class VideoProcessor:
 
     @staticmethod
     async def convert_video(input_path: str, output_path: str, target_format: str = 'mp4',
-                           max_size: Optional[int] = None) -> Tuple[bool, str]:
+                           max_size: Optional[int] = None,
+                           progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None) -> Tuple[bool, str]:
         """
         Convert a video file to a different format or resize it.
 
@@ -133,6 +135,7 @@ class VideoProcessor:
             output_path: Path to save the output video file
             target_format: Target video format (default: mp4)
             max_size: Maximum file size in bytes (optional)
+            progress_callback: Optional function receiving ffmpeg progress blocks
 
         Returns:
             Tuple[bool, str]: (success, message)
@@ -156,12 +159,12 @@ class VideoProcessor:
             # Base command for conversion
             cmd = ['ffmpeg', '-y', '-i', input_path, '-c:v', 'libx264', '-c:a', 'aac']
 
+            # Get video info for bitrate targeting and progress reporting
+            info = await VideoProcessor.get_video_info(input_path)
+            duration = info.get('duration', 0)
+
             # If max_size is specified, adjust bitrate accordingly
             if max_size:
-                # Get video info
-                info = await VideoProcessor.get_video_info(input_path)
-                duration = info.get('duration', 0)
-
                 if duration > 0:
                     # Calculate target bitrate (80% of max_size for video, 20% for audio)
                     # Convert to kilobits
@@ -174,27 +177,14 @@ class VideoProcessor:
             # Add output path
             cmd.append(output_path)
 
-            # Run the command with platform-specific settings
-            if platform.system().lower() == 'windows':
-                process = await asyncio.create_subprocess_exec(
-                    *cmd,
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE,
-                    creationflags=subprocess.CREATE_NO_WINDOW if hasattr(subprocess, 'CREATE_NO_WINDOW') else 0
-                )
-            else:
-                process = await asyncio.create_subprocess_exec(
-                    *cmd,
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE
-                )
-
-            stdout, stderr = await process.communicate()
+            # Run the command without blocking the event loop
+            returncode, error_msg = await run_ffmpeg(
+                cmd, duration=duration, progress_callback=progress_callback
+            )
 
-            if process.returncode != 0:
-                error_msg = stderr.decode('utf-8', errors='replace')
+            if returncode != 0:
                 logger.error(f"FFmpeg error: {error_msg}")
-                return False, f"Error converting video: FFmpeg failed with code {process.returncode}"
+                return False, f"Error converting video: FFmpeg failed with code {returncode}"
 
             # Verify the output file exists
             if not os.path.exists(output_path):
@@ -250,27 +240,12 @@ class VideoProcessor:
                 '-vframes', '1', '-q:v', '2', thumbnail_path
             ]
 
-            # Run the command with platform-specific settings
-            if platform.system().lower() == 'windows':
-                process = await asyncio.create_subprocess_exec(
-                    *cmd,
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE,
-                    creationflags=subprocess.CREATE_NO_WINDOW if hasattr(subprocess, 'CREATE_NO_WINDOW') else 0
-                )
-            else:
-                process = await asyncio.create_subprocess_exec(
-                    *cmd,
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE
-                )
-
-            stdout, stderr = await process.communicate()
+            # Run the command without blocking the event loop
+            returncode, error_msg = await run_ffmpeg(cmd)
 
-            if process.returncode != 0:
-                error_msg = stderr.decode('utf-8', errors='replace')
+            if returncode != 0:
                 logger.error(f"FFmpeg error: {error_msg}")
-                return False, f"Error creating thumbnail: FFmpeg failed with code {process.returncode}"
+                return False, f"Error creating thumbnail: FFmpeg failed with code {returncode}"
 
             # Verify the output file exists
             if not os.path.exists(thumbnail_path):
@@ -0,0 +1,40 @@
+from utils.bandwidth_governor import BandwidthGovernor, TokenBucket, parse_rate
+
+def test_parse_rate():
+    assert parse_rate('0') == 0
+    assert parse_rate('500K') == 500 * 1024
+    assert parse_rate('1.5m/s') == int(1.5 * 1024 ** 2)
+
+def test_bucket_is_full():
+    bucket = TokenBucket(1024 * 1024)
+    assert bucket.is_full()
+    bucket.tokens = 0
+    assert not bucket.is_full()
+
+def test_idle_user_bucket_is_kept_until_refilled():
+    governor = BandwidthGovernor(user_rate=10 * 1024 * 1024)
+    meter = governor.register(7)
+    bucket = governor.user_bucket(7)
+
+    # Leave the bucket in debt, as a download that just finished would
+    bucket.tokens = -bucket.burst
+    governor.unregister(meter)
+    assert governor.user_buckets.get(7) is bucket
+
+    # The next download of the same user inherits the debt
+    meter = governor.register(7)
+    assert governor.user_bucket(7) is bucket
+    governor.unregister(meter)
+    assert governor.user_buckets.get(7) is bucket
+
+    # Repaying the debt and refilling takes 2 * burst / rate seconds
+    bucket.updated -= 2 * bucket.burst / bucket.rate + 0.1
+    governor.unregister(governor.register(8))
+    assert 7 not in governor.user_buckets
+
+def test_unlimited_user_buckets_are_dropped_right_away():
+    governor = BandwidthGovernor()
+    meter = governor.register(7)
+    governor.user_bucket(7)
+    governor.unregister(meter)
+    assert governor.user_buckets == {}
@@ -0,0 +1,47 @@
+import os
+import asyncio
+import hashlib
+
+from utils.cache_manager import CacheManager
+
+def _cache_manager(cache_dir):
+    # A fresh instance per test instead of the process-wide singleton
+    CacheManager._instance = None
+    return CacheManager(cache_dir=cache_dir)
+
+def test_set_get_and_invalidate(tmp_path):
+    async def scenario():
+        cache = _cache_manager(str(tmp_path))
+        try:
+            assert await cache.get('http://s/a.m3u8') is None
+            assert await cache.set('http://s/a.m3u8', '#EXTM3U\r\n#EXTINF:1,\na.ts\n')
+            assert await cache.get('http://s/a.m3u8') == '#EXTM3U\r\n#EXTINF:1,\na.ts\n'
+            assert cache.get_stats()['items_count'] == 1
+
+            assert await cache.invalidate('http://s/a.m3u8')
+            assert await cache.get('http://s/a.m3u8') is None
+        finally:
+            await cache.stop()
+            CacheManager._instance = None
+
+    asyncio.run(scenario())
+
+def test_concurrent_sets_of_one_url(tmp_path):
+    async def scenario():
+        cache = _cache_manager(str(tmp_path))
+        try:
+            bodies = [f'#EXTM3U\n# writer {i}\n' + 'x' * 200000 for i in range(4)]
+            results = await asyncio.gather(*(cache.set('http://s/a.m3u8', body) for body in bodies))
+            assert all(results)
+
+            # The file that won the race is the one its index row describes
+            content = await cache.get('http://s/a.m3u8')
+            assert content in bodies
+            row = cache.db.execute('SELECT sha256, size FROM entries').fetchone()
+            assert row == (hashlib.sha256(content.encode()).hexdigest(), len(content))
+            assert not [name for name in os.listdir(str(tmp_path)) if name.endswith('.tmp')]
+        finally:
+            await cache.stop()
+            CacheManager._instance = None
+
+    asyncio.run(scenario())
@@ -0,0 +1,74 @@
+import asyncio
+
+from downloader.download_registry import DownloadRegistry, canonicalize_url
+
+def test_canonicalize_url_sorts_query_and_drops_default_port():
+    assert canonicalize_url('HTTPS://Example.com:443/a.m3u8?b=2&a=1#x') == 'https://example.com/a.m3u8?a=1&b=2'
+
+def test_join_shares_a_running_job():
+    async def scenario():
+        registry = DownloadRegistry()
+        release = asyncio.Event()
+
+        async def run(_):
+            await release.wait()
+            return True, "done", None
+
+        first = registry.join('key', 1, object, run)
+        second = registry.join('key', 2, object, run)
+        assert first is second
+        assert first.subscribers == [1, 2]
+        release.set()
+        assert await registry.wait(second, 2) == (True, "done", None)
+
+    asyncio.run(scenario())
+
+def test_join_after_last_subscriber_left_starts_a_fresh_job():
+    async def scenario():
+        registry = DownloadRegistry()
+        started = []
+
+        async def run(_):
+            started.append(True)
+            try:
+                await asyncio.sleep(3600)
+            except asyncio.CancelledError:
+                # A slow teardown keeps the cancelled job alive for a while
+                await asyncio.sleep(0.05)
+                raise
+            return True, "done", None
+
+        dying = registry.join('key', 1, object, run)
+        await asyncio.sleep(0)
+        registry.leave(dying, 1)
+
+        fresh = registry.join('key', 2, object, run)
+        assert fresh is not dying
+        assert fresh.subscribers == [2]
+        assert registry.jobs['key'] is fresh
+
+        # The dying job finishing must not unregister its replacement
+        await asyncio.wait({dying.task})
+        assert registry.jobs['key'] is fresh
+        fresh.task.cancel()
+        await asyncio.wait({fresh.task})
+
+    asyncio.run(scenario())
+
+def test_release_reports_the_last_subscriber():
+    async def scenario():
+        registry = DownloadRegistry()
+
+        async def run(_):
+            return True, "done", "/tmp/out.mp4"
+
+        job = registry.join('key', 1, object, run)
+        registry.join('key', 2, object, run)
+        await registry.wait(job, 1)
+        await registry.wait(job, 2)
+
+        # Only once every subscriber has sent the result may the file go
+        assert registry.release(job, 1) is False
+        assert registry.release(job, 2) is True
+
+    asyncio.run(scenario())
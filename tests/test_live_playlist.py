@@ -0,0 +1,50 @@
+from downloader.live_playlist import LivePlaylistMonitor
+from downloader.playlist_stream import parse_playlist
+
+def _window(first_sequence, uris):
+    lines = ['#EXTM3U', '#EXT-X-TARGETDURATION:2', f'#EXT-X-MEDIA-SEQUENCE:{first_sequence}']
+    for uri in uris:
+        lines += ['#EXTINF:2,', uri]
+    return parse_playlist('\n'.join(lines) + '\n')
+
+def _monitor():
+    return LivePlaylistMonitor('http://s/live.m3u8', max_duration=3600)
+
+def test_overlapping_reloads_yield_only_new_segments():
+    monitor = _monitor()
+    assert monitor._new_positions(_window(100, ['a100', 'a101', 'a102'])) == [0, 1, 2]
+    assert monitor._new_positions(_window(101, ['a101', 'a102', 'a103'])) == [2]
+    assert monitor._new_positions(_window(101, ['a101', 'a102', 'a103'])) == []
+    assert monitor.next_sequence == 104 and monitor.restarts == 0
+
+def test_gap_is_counted_as_skipped():
+    monitor = _monitor()
+    monitor._new_positions(_window(100, ['a100', 'a101']))
+    assert monitor._new_positions(_window(105, ['a105', 'a106'])) == [0, 1]
+    assert monitor.skipped_segments == 3
+
+def test_stale_reload_is_not_a_restart():
+    monitor = _monitor()
+    monitor._new_positions(_window(100, ['a100', 'a101', 'a102']))
+    monitor._new_positions(_window(101, ['a101', 'a102', 'a103']))
+
+    # A lagging edge server still serves the older window
+    assert monitor._new_positions(_window(99, ['a99', 'a100', 'a101'])) == []
+    assert monitor.restarts == 0 and monitor.next_sequence == 104
+
+def test_sequence_reset_is_followed():
+    monitor = _monitor()
+    monitor._new_positions(_window(5000, ['a5000', 'a5001', 'a5002']))
+
+    assert monitor._new_positions(_window(0, ['b0', 'b1', 'b2'])) == [0, 1, 2]
+    assert monitor.restarts == 1 and monitor.next_sequence == 3
+    assert monitor._new_positions(_window(1, ['b1', 'b2', 'b3'])) == [2]
+    assert monitor.get_stats()['restarts'] == 1
+
+def test_small_step_back_with_new_uris_is_a_restart():
+    monitor = _monitor()
+    monitor._new_positions(_window(10, ['a10', 'a11', 'a12']))
+
+    # The encoder came back numbering from just below where it stopped
+    assert monitor._new_positions(_window(11, ['b11', 'b12'])) == [0, 1]
+    assert monitor.restarts == 1 and monitor.next_sequence == 13
@@ -0,0 +1,164 @@
+import sys
+import json
+import asyncio
+import hashlib
+
+import pytest
+
+from downloader.playlist_stream import (
+    MediaPlaylist, PACK_PREAMBLE, parse_playlist, pack_playlist, unpack_playlist
+)
+
+PLAYLIST = """#EXTM3U
+#EXT-X-VERSION:7
+#EXT-X-TARGETDURATION:6
+#EXT-X-MEDIA-SEQUENCE:40
+#EXT-X-PLAYLIST-TYPE:VOD
+#EXT-X-MAP:URI="init.mp4",BYTERANGE="720@0"
+#EXTINF:6.0,
+#EXT-X-BYTERANGE:1000@720
+media.mp4
+#EXTINF:5.5,
+#EXT-X-BYTERANGE:800
+media.mp4
+#EXT-X-KEY:METHOD=AES-128,URI="keys/k1.bin",IV=0x000102030405060708090a0b0c0d0e0f
+#EXTINF:4.25,
+seg2.ts
+#EXT-X-KEY:METHOD=NONE
+#EXT-X-MAP:URI="init2.mp4"
+#EXTINF:6,
+https://cdn.example.com/seg3.ts
+#EXT-X-ENDLIST
+"""
+
+def _rows(playlist):
+    return [
+        (
+            segment.uri, segment.duration, segment.byterange,
+            (segment.key.method, segment.key.uri, segment.key.iv) if segment.key else None,
+            (segment.init_section.uri, segment.init_section.byterange) if segment.init_section else None
+        )
+        for segment in playlist.segments
+    ]
+
+def _tags(playlist):
+    return (playlist.media_sequence, playlist.target_duration, playlist.playlist_type,
+            playlist.endlist, playlist.is_endlist)
+
+def test_parse_tags_byteranges_keys_and_maps():
+    playlist = parse_playlist(PLAYLIST)
+
+    assert not playlist.is_variant and playlist.complete
+    assert _tags(playlist) == (40, 6, 'vod', True, True)
+    assert _rows(playlist) == [
+        ('media.mp4', 6.0, '1000@720', None, ('init.mp4', '720@0')),
+        ('media.mp4', 5.5, '800', None, ('init.mp4', '720@0')),
+        ('seg2.ts', 4.25, None, ('AES-128', 'keys/k1.bin', '0x000102030405060708090a0b0c0d0e0f'),
+         ('init.mp4', '720@0')),
+        ('https://cdn.example.com/seg3.ts', 6.0, None, ('NONE', None, None), ('init2.mp4', None)),
+    ]
+    assert playlist.segments.total_duration() == pytest.approx(21.75)
+
+def test_chunked_feed_matches_whole_parse():
+    body = PLAYLIST.encode()
+    playlist = MediaPlaylist()
+    for start in range(0, len(body), 7):
+        playlist.feed(body[start:start + 7])
+    playlist.close()
+
+    whole = parse_playlist(PLAYLIST)
+    assert _rows(playlist) == _rows(whole)
+    assert playlist.text_digest() == whole.text_digest()
+
+def test_master_playlist_is_only_recognized():
+    playlist = parse_playlist('#EXTM3U\n#EXT-X-STREAM-INF:BANDWIDTH=1000\nlow.m3u8\n')
+    assert playlist.is_variant and len(playlist.segments) == 0
+
+def test_pack_unpack_round_trip():
+    playlist = parse_playlist(PLAYLIST)
+    metadata = {'variant_url': 'https://example.com/v/index.m3u8', 'digest': 'abc'}
+
+    unpacked, unpacked_metadata = unpack_playlist(pack_playlist(playlist, metadata))
+
+    assert unpacked_metadata == metadata
+    assert unpacked.complete
+    assert _tags(unpacked) == _tags(playlist)
+    assert _rows(unpacked) == _rows(playlist)
+
+def test_resolved_playlist_round_trip():
+    resolved = parse_playlist(PLAYLIST).resolve(
+        lambda uri: uri if '://' in uri else 'https://example.com/v/' + uri
+    )
+    unpacked, _ = unpack_playlist(pack_playlist(resolved, {}))
+
+    rows = _rows(unpacked)
+    assert [row[0] for row in rows] == [
+        'https://example.com/v/media.mp4', 'https://example.com/v/media.mp4',
+        'https://example.com/v/seg2.ts', 'https://cdn.example.com/seg3.ts'
+    ]
+    assert rows[2][3][1] == 'https://example.com/v/keys/k1.bin'
+    assert rows[3][3] == ('NONE', None, None)
+    assert rows[0][4] == ('https://example.com/v/init.mp4', '720@0')
+    assert [row[2] for row in rows] == ['1000@720', '800', None, None]
+
+def test_unpack_swaps_foreign_byte_order():
+    playlist = parse_playlist(PLAYLIST)
+    packed = pack_playlist(playlist, {})
+
+    # Rewrite the packed data as the other byte order would have written it
+    _, version, header_length = PACK_PREAMBLE.unpack_from(packed)
+    header = json.loads(packed[PACK_PREAMBLE.size:PACK_PREAMBLE.size + header_length])
+    header['byteorder'] = 'big' if sys.byteorder == 'little' else 'little'
+    table = playlist.segments
+    arrays = []
+    for name in table.ARRAYS:
+        values = getattr(table, name)[:]
+        values.byteswap()
+        arrays.append(values.tobytes())
+    new_header = json.dumps(header).encode()
+    foreign = b''.join(
+        [PACK_PREAMBLE.pack(b'HLSP', version, len(new_header)), new_header] + arrays + [bytes(table.uri_data)]
+    )
+
+    unpacked, _ = unpack_playlist(foreign)
+    assert _rows(unpacked) == _rows(playlist)
+
+def test_unpack_rejects_bad_data():
+    packed = pack_playlist(parse_playlist(PLAYLIST), {})
+    for bad in (b'', b'XXXX' + packed[4:], packed[:-1], packed[:PACK_PREAMBLE.size + 40], packed + b'x'):
+        with pytest.raises(ValueError):
+            unpack_playlist(bad)
+
+def test_streaming_consumers_wait_for_segments():
+    async def scenario():
+        playlist = MediaPlaylist()
+        waiter = asyncio.ensure_future(playlist.wait_for(2))
+        playlist.feed(b'#EXTM3U\n#EXT-X-PLAYLIST-TYPE:VOD\n#EXTINF:1,\na.ts\n')
+        await asyncio.sleep(0)
+        assert playlist.ready and not waiter.done()
+
+        playlist.feed(b'#EXTINF:1,\nb.ts')
+        await asyncio.sleep(0)
+        assert not waiter.done()
+
+        # The last line has no line break and is parsed on close
+        playlist.close()
+        assert await waiter is True
+        assert await playlist.wait_for(3) is False
+
+    asyncio.run(scenario())
+
+def test_text_digest_matches_the_cached_text():
+    body = PLAYLIST.encode().replace(b'seg2.ts', b'seg\xff2.ts').replace(b'media.mp4', 'média.mp4'.encode())
+    playlist = MediaPlaylist()
+
+    # Split inside the multi-byte character as well as next to the invalid byte
+    split = body.index('é'.encode()) + 1
+    for chunk in (body[:split], body[split:body.index(b'\xff')], body[body.index(b'\xff'):]):
+        playlist.feed(chunk)
+    playlist.close()
+
+    # The playlist cache stores and hashes the decoded text
+    cached = body.decode('utf-8', errors='replace')
+    assert playlist.text_digest() == hashlib.sha256(cached.encode('utf-8', errors='replace')).hexdigest()
+    assert playlist.text_digest() == parse_playlist(cached).text_digest()
@@ -0,0 +1,55 @@
+import asyncio
+
+from downloader.segment_merger import ReorderBuffer
+
+def _collecting_buffer(max_pending=32, start_index=0):
+    written = []
+
+    async def writer(data):
+        written.append(data)
+
+    return ReorderBuffer(writer, max_pending=max_pending, start_index=start_index), written
+
+def test_out_of_order_segments_are_written_in_order():
+    async def scenario():
+        buffer, written = _collecting_buffer()
+        for index in (2, 0, 3, 1, 5, 4):
+            await buffer.put(index, bytes([index]))
+
+        assert written == [bytes([i]) for i in range(6)]
+        assert buffer.next_index == 6
+        assert buffer.pending == {} and buffer.pending_bytes == 0
+        assert buffer.written_bytes == 6
+
+    asyncio.run(scenario())
+
+def test_duplicates_are_ignored():
+    async def scenario():
+        buffer, written = _collecting_buffer(start_index=10)
+        await buffer.put(11, b'b')
+        await buffer.put(11, b'x')
+        await buffer.put(10, b'a')
+        await buffer.put(10, b'y')
+
+        assert written == [b'a', b'b']
+
+    asyncio.run(scenario())
+
+def test_segments_too_far_ahead_wait_for_the_gap():
+    async def scenario():
+        buffer, written = _collecting_buffer(max_pending=2)
+        await buffer.put(1, b'1')
+
+        # Index 2 is max_pending ahead of the expected index 0 and must wait
+        ahead = asyncio.ensure_future(buffer.put(2, b'2'))
+        await asyncio.sleep(0.01)
+        assert not ahead.done()
+        assert written == [] and buffer.pending_bytes == 1
+
+        # The expected segment is never held back, and closing the gap releases the waiter
+        await asyncio.wait_for(buffer.put(0, b'0'), 1)
+        await asyncio.wait_for(ahead, 1)
+        assert written == [b'0', b'1', b'2']
+        assert buffer.peak_pending_bytes == 2
+
+    asyncio.run(scenario())
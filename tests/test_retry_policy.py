@@ -0,0 +1,105 @@
+import time
+from email.utils import formatdate
+
+from utils.retry_policy import (
+    CircuitBreaker, CircuitBreakerRegistry, RetryBudget, RetryPolicy, parse_retry_after
+)
+
+def test_parse_retry_after():
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('') is None
+    assert parse_retry_after(' 7 ') == 7.0
+    assert parse_retry_after('soon') is None
+    assert 0 < parse_retry_after(formatdate(time.time() + 60, usegmt=True)) <= 60
+    assert parse_retry_after(formatdate(time.time() - 60, usegmt=True)) == 0.0
+
+def test_retryable_statuses():
+    for status in (408, 429, 500, 503):
+        assert RetryPolicy.is_retryable_status(status)
+    for status in (400, 403, 404, 410):
+        assert not RetryPolicy.is_retryable_status(status)
+
+def test_backoff_is_jittered_within_a_capped_exponential_ceiling():
+    policy = RetryPolicy(base_delay=0.5, max_delay=4.0, max_retry_after=10.0)
+    for attempt, ceiling in ((0, 0.5), (1, 1.0), (2, 2.0), (3, 4.0), (10, 4.0)):
+        delays = [policy.backoff(attempt) for _ in range(200)]
+        assert all(0 <= delay <= ceiling for delay in delays)
+
+    # Retry-After raises the delay, up to the configured bound
+    assert policy.backoff(0, retry_after=3.0) >= 3.0
+    assert policy.backoff(0, retry_after=300.0) == 10.0
+    assert RetryPolicy(max_attempts=0).max_attempts == 1
+
+def test_retry_budget():
+    budget = RetryBudget(2)
+    assert budget.try_spend() and budget.try_spend()
+    assert not budget.try_spend()
+    assert budget.spent == 2 and budget.remaining == 0
+    assert not RetryBudget(-1).try_spend()
+
+def _breaker(**kwargs):
+    options = dict(failure_rate=0.5, min_requests=4, window=10, open_seconds=30.0)
+    options.update(kwargs)
+    return CircuitBreaker('cdn.example.com', **options)
+
+def test_breaker_opens_on_error_rate_after_min_requests():
+    breaker = _breaker()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.get_stats()['rejected'] == 1
+    assert breaker.times_opened == 1
+
+def test_breaker_stays_closed_below_the_error_rate():
+    breaker = _breaker()
+    for _ in range(5):
+        breaker.record_success()
+        breaker.record_failure()
+        breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+
+def test_half_open_lets_one_probe_through():
+    breaker = _breaker(min_requests=1)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # After the cool-down a single probe is allowed
+    breaker.opened_at -= 31
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+
+def test_failed_probe_reopens_the_circuit():
+    breaker = _breaker(min_requests=1)
+    breaker.record_failure()
+    breaker.opened_at -= 31
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and not breaker.allow()
+    assert breaker.times_opened == 2
+
+def test_abandoned_probe_is_replaced_after_its_timeout():
+    breaker = _breaker(min_requests=1, probe_timeout=5.0)
+    breaker.record_failure()
+    breaker.opened_at -= 31
+    assert breaker.allow()
+
+    breaker.probe_started -= 6
+    assert breaker.allow()
+
+def test_registry_keeps_one_breaker_per_host():
+    registry = CircuitBreakerRegistry(min_requests=7)
+    first = registry.get('https://CDN.example.com/a.ts')
+    assert registry.get('https://cdn.example.com/b.ts') is first
+    assert registry.get('https://other.example.com/a.ts') is not first
+    assert first.min_requests == 7
+    assert set(registry.get_stats()) == {'cdn.example.com', 'other.example.com'}
@@ -0,0 +1,84 @@
+import os
+import json
+import asyncio
+import hashlib
+
+from downloader.segment_cache import SegmentCache, segment_cache_key
+
+def test_segment_cache_key():
+    assert segment_cache_key('http://s/a.ts') == 'http://s/a.ts'
+    assert segment_cache_key('http://s/a.ts', (0, 100)) == 'http://s/a.ts#0-100'
+
+def test_lfu_evicts_least_used_and_oldest_among_ties(tmp_path):
+    async def scenario():
+        cache = SegmentCache(str(tmp_path), max_size=3000, policy='lfu')
+        for key in ('a', 'b', 'c'):
+            await cache.put(key, key.encode() * 1000)
+        await cache.get('a')
+        await cache.get('a')
+        await cache.get('c')
+
+        # b has no hits; of a (2) and c (1), c goes next
+        await cache.put('d', b'd' * 1000)
+        assert list(cache.entries) == ['a', 'c', 'd']
+        await cache.put('e', b'e' * 1000)
+        assert sorted(cache.entries) == ['a', 'c', 'e']
+        assert cache.evictions == 2
+
+    asyncio.run(scenario())
+
+def test_identical_bytes_share_a_blob(tmp_path):
+    async def scenario():
+        cache = SegmentCache(str(tmp_path))
+        await cache.put('a', b'x' * 100)
+        await cache.put('b', b'x' * 100)
+        assert cache.get_stats()['blobs'] == 1
+        assert cache.size == 100
+        assert await cache.get('b') == b'x' * 100
+
+    asyncio.run(scenario())
+
+def test_index_survives_reopen(tmp_path):
+    async def scenario():
+        cache = SegmentCache(str(tmp_path))
+        await cache.put('a', b'1' * 10)
+        await cache.put('b', b'2' * 10)
+        await cache.get('a')
+        await cache.save()
+        cache._unlink('b')
+        cache.close()
+
+        reopened = SegmentCache(str(tmp_path))
+        assert list(reopened.entries) == ['a']
+        assert reopened.entries['a']['hits'] == 1
+        assert await reopened.get('a') == b'1' * 10
+        reopened.close()
+
+    asyncio.run(scenario())
+
+def test_json_index_is_imported(tmp_path):
+    data = b'segment'
+    sha256 = hashlib.sha256(data).hexdigest()
+    (tmp_path / sha256[:2]).mkdir()
+    (tmp_path / sha256[:2] / sha256).write_bytes(data)
+    entry = {'sha256': sha256, 'size': len(data), 'hits': 3, 'stored': 1e12, 'last_access': 1e12}
+    (tmp_path / 'index.json').write_text(json.dumps({'k': entry}))
+
+    cache = SegmentCache(str(tmp_path), ttl=10 ** 13)
+    assert cache.entries['k']['hits'] == 3
+    assert not (tmp_path / 'index.json').exists()
+    cache.close()
+
+def test_concurrent_puts_of_one_blob(tmp_path):
+    async def scenario():
+        cache = SegmentCache(str(tmp_path))
+        data = b'z' * (1024 * 1024)
+        await asyncio.gather(*(cache.put(key, data) for key in ('a', 'b', 'c', 'd')))
+
+        for key in ('a', 'b', 'c', 'd'):
+            assert await cache.get(key) == data
+        leftovers = [name for _, _, names in os.walk(str(tmp_path)) for name in names if name.endswith('.tmp')]
+        assert leftovers == []
+        cache.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,69 @@
+import pytest
+
+from downloader.segment_ranges import parse_byteranges, coalesce_ranges, split_range
+
+class Segment:
+    def __init__(self, byterange=None):
+        self.byterange = byterange
+
+def test_parse_byteranges_continues_only_on_the_same_resource():
+    segments = [Segment('10@0'), Segment('10'), Segment('5@0'), Segment(), Segment('4@2')]
+    urls = ['a', 'a', 'b', 'c', 'c']
+    assert parse_byteranges(segments, urls) == [(0, 10), (10, 20), (0, 5), None, (2, 6)]
+
+    # A continuation picks up after the last sub-range of the previous batch
+    assert parse_byteranges([Segment('10')], ['a'], previous=('a', 20)) == [(20, 30)]
+    with pytest.raises(ValueError):
+        parse_byteranges([Segment('10')], ['b'], previous=('a', 20))
+
+def test_coalesce_empty():
+    assert list(coalesce_ranges([], 100)) == []
+
+def test_coalesce_contiguous_ranges_of_one_resource():
+    entries = [(0, 'a', (0, 10)), (1, 'a', (10, 25)), (2, 'a', (25, 30))]
+    assert list(coalesce_ranges(entries, 100)) == [
+        ('a', (0, 30), [(0, (0, 10)), (1, (10, 25)), (2, (25, 30))])
+    ]
+
+def test_coalesce_breaks_on_gap_overlap_url_and_whole_resources():
+    entries = [
+        (0, 'a', (0, 10)),
+        (1, 'a', (20, 30)),   # gap
+        (2, 'a', (25, 35)),   # overlap
+        (3, 'b', (35, 40)),   # other resource
+        (4, 'b', None),       # whole resource
+        (5, 'b', None),
+        (6, 'b', (40, 50)),   # a range right after a whole resource
+    ]
+    groups = list(coalesce_ranges(entries, 1000))
+    assert [members for _, _, members in groups] == [
+        [(0, (0, 10))], [(1, (20, 30))], [(2, (25, 35))], [(3, (35, 40))],
+        [(4, None)], [(5, None)], [(6, (40, 50))]
+    ]
+    assert [(url, byte_range) for url, byte_range, _ in groups][3:5] == [('b', (35, 40)), ('b', None)]
+
+def test_coalesce_respects_the_size_cap():
+    entries = [(0, 'a', (0, 40)), (1, 'a', (40, 60)), (2, 'a', (60, 61)), (3, 'a', (61, 200))]
+    groups = list(coalesce_ranges(entries, 60))
+
+    # Exactly max_bytes still fits; an oversized segment gets a request of its own
+    assert [(byte_range, [i for i, _ in members]) for _, byte_range, members in groups] == [
+        ((0, 60), [0, 1]), ((60, 61), [2]), ((61, 200), [3])
+    ]
+
+def test_split_range_returns_each_member():
+    data = bytes(range(30))
+    members = [(4, (100, 110)), (5, (110, 125)), (6, (125, 130))]
+    assert list(split_range(data, (100, 130), members)) == [
+        (4, data[0:10]), (5, data[10:25]), (6, data[25:30])
+    ]
+
+def test_split_range_round_trips_coalesced_groups():
+    resource = bytes(range(256)) * 4
+    entries = [(i, 'a', (i * 64, (i + 1) * 64)) for i in range(16)]
+    pieces = {}
+    for _, group_range, members in coalesce_ranges(entries, 200):
+        body = resource[group_range[0]:group_range[1]]
+        pieces.update(split_range(body, group_range, members))
+
+    assert pieces == {i: resource[i * 64:(i + 1) * 64] for i in range(16)}
@@ -0,0 +1,68 @@
+import asyncio
+
+import pytest
+
+from downloader.segment_decryptor import KeyCache, segment_iv
+
+KEY = bytes(range(16))
+
+def test_concurrent_requests_share_one_fetch():
+    async def scenario():
+        cache = KeyCache()
+        calls = []
+
+        async def fetch(uri):
+            calls.append(uri)
+            await asyncio.sleep(0.01)
+            return KEY
+
+        keys = await asyncio.gather(*(cache.get('http://k/1', fetch) for _ in range(5)))
+        assert keys == [KEY] * 5
+        assert calls == ['http://k/1']
+        assert await cache.get('http://k/1', fetch) == KEY
+        assert len(calls) == 1
+
+    asyncio.run(scenario())
+
+def test_cancelled_fetcher_does_not_cancel_waiters():
+    async def scenario():
+        cache = KeyCache()
+        calls = []
+
+        async def fetch(uri):
+            calls.append(uri)
+            await asyncio.sleep(0.05)
+            return KEY
+
+        owner = asyncio.ensure_future(cache.get('http://k/1', fetch))
+        await asyncio.sleep(0)
+        waiters = [asyncio.ensure_future(cache.get('http://k/1', fetch)) for _ in range(3)]
+        await asyncio.sleep(0)
+
+        owner.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await owner
+
+        # One waiter takes over the fetch and the others share it
+        assert await asyncio.gather(*waiters) == [KEY] * 3
+        assert len(calls) == 2
+
+    asyncio.run(scenario())
+
+def test_failed_fetch_reaches_waiters():
+    async def scenario():
+        cache = KeyCache()
+
+        async def fetch(uri):
+            await asyncio.sleep(0.01)
+            return b'short'
+
+        results = await asyncio.gather(*(cache.get('http://k/1', fetch) for _ in range(2)), return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        assert 'http://k/1' not in cache.inflight
+
+    asyncio.run(scenario())
+
+def test_segment_iv():
+    assert segment_iv(None, 5) == (5).to_bytes(16, 'big')
+    assert segment_iv('0x0102', 5) == bytes(14) + b'\x01\x02'
@@ -0,0 +1,66 @@
+import asyncio
+
+from downloader.segment_hedger import SegmentHedger
+
+def _warm_hedger(limiter=None):
+    hedger = SegmentHedger(min_samples=1, min_delay=0.05, limiter=limiter)
+    hedger.record(0.01)
+    return hedger
+
+def test_hedge_wins_over_straggler():
+    async def scenario():
+        hedger = _warm_hedger()
+
+        async def primary():
+            await asyncio.sleep(10)
+            return b'slow'
+
+        async def hedge():
+            return b'fast'
+
+        assert await hedger.fetch(primary, hedge) == b'fast'
+        assert hedger.hedged == 1 and hedger.hedge_wins == 1
+
+    asyncio.run(scenario())
+
+def test_no_hedge_while_every_global_slot_is_busy():
+    async def scenario():
+        limiter = asyncio.Semaphore(1)
+        hedger = _warm_hedger(limiter)
+        hedges = []
+
+        async def primary():
+            await asyncio.sleep(0.3)
+            return b'primary'
+
+        async def hedge():
+            hedges.append(1)
+            return b'hedge'
+
+        # The only slot is held, as the primary's scheduler job would hold it
+        async with limiter:
+            assert await hedger.fetch(primary, hedge) == b'primary'
+        assert hedger.hedged == 0 and not hedges
+
+    asyncio.run(scenario())
+
+def test_hedge_holds_a_global_slot():
+    async def scenario():
+        limiter = asyncio.Semaphore(2)
+        hedger = _warm_hedger(limiter)
+        free_slots = []
+
+        async def primary():
+            await asyncio.sleep(10)
+            return b'slow'
+
+        async def hedge():
+            free_slots.append(limiter._value)
+            return b'fast'
+
+        async with limiter:
+            assert await hedger.fetch(primary, hedge) == b'fast'
+            assert free_slots == [0]
+            assert limiter._value == 1
+
+    asyncio.run(scenario())
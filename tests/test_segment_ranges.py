@@ -0,0 +1,10 @@
+import pytest
+
+from downloader.segment_ranges import parse_byterange
+
+def test_parse_byterange():
+    assert parse_byterange('100@20') == (20, 120)
+    assert parse_byterange('100', previous_end=120) == (120, 220)
+    for bad in ('100', '0@5', '10@-1'):
+        with pytest.raises(ValueError):
+            parse_byterange(bad)
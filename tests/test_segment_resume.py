@@ -0,0 +1,62 @@
+import os
+import asyncio
+
+from downloader.segment_journal import SegmentJournal
+from downloader.segment_merger import ConcatMerger, StreamMerger
+
+SEGMENTS = [bytes([i]) * (100 + i) for i in range(4)]
+
+def _journal(temp_dir):
+    async def scenario():
+        journal = SegmentJournal(os.path.join(temp_dir, 'journal.jsonl'))
+        await journal.begin('u', 'v', 'f', len(SEGMENTS))
+        for index, data in enumerate(SEGMENTS):
+            await journal.record(index, data)
+        await journal.close()
+
+        loaded = SegmentJournal(journal.path)
+        assert loaded.load() and loaded.matches('u', 'v', 'f', len(SEGMENTS))
+        return loaded.completed
+
+    return asyncio.run(scenario())
+
+def test_concat_resume_skips_corrupt_segment_files(tmp_path):
+    completed = _journal(str(tmp_path))
+    merger = ConcatMerger(str(tmp_path))
+    for index, data in enumerate(SEGMENTS):
+        with open(merger._segment_path(index), 'wb') as f:
+            f.write(data)
+
+    # Same size, different content: only the hash can tell
+    with open(merger._segment_path(1), 'wb') as f:
+        f.write(b'x' * len(SEGMENTS[1]))
+    os.remove(merger._segment_path(3))
+
+    assert asyncio.run(merger.resume(completed)) == {0, 2}
+    assert sorted(merger.segment_files) == [0, 2]
+
+def test_stream_resume_stops_at_first_corrupt_segment(tmp_path):
+    completed = _journal(str(tmp_path))
+    merger = StreamMerger(str(tmp_path))
+    stream = bytearray(b''.join(SEGMENTS))
+    stream[len(SEGMENTS[0]) + len(SEGMENTS[1]) + 5] ^= 0xff
+    with open(merger.stream_path, 'wb') as f:
+        f.write(stream)
+
+    assert asyncio.run(merger.resume(completed)) == {0, 1}
+    assert merger.resume_offset == len(SEGMENTS[0]) + len(SEGMENTS[1])
+    assert merger.buffer.next_index == 2
+
+def test_stream_resume_rejects_a_different_header(tmp_path):
+    completed = _journal(str(tmp_path))
+    merger = StreamMerger(str(tmp_path))
+    merger.header = b'init'
+    with open(merger.stream_path, 'wb') as f:
+        f.write(b'INIT' + b''.join(SEGMENTS))
+
+    assert asyncio.run(merger.resume(completed)) == set()
+    assert merger.resume_offset == 0
+
+def test_stream_resume_without_a_stream_file(tmp_path):
+    completed = _journal(str(tmp_path))
+    assert asyncio.run(StreamMerger(str(tmp_path)).resume(completed)) == set()
@@ -0,0 +1,24 @@
+import os
+
+from utils import helpers
+
+def test_stale_sweep_skips_running_downloads(tmp_path, monkeypatch):
+    monkeypatch.setattr(helpers, 'get_temp_root', lambda: str(tmp_path))
+    running = helpers.create_secure_temp_dir(1, job_key='http://s/a.m3u8')
+    finished = helpers.create_secure_temp_dir(1, job_key='http://s/b.m3u8')
+    helpers.release_temp_dir(finished)
+
+    # Both look long untouched, as a running job without a journal would
+    for path in (running, finished):
+        os.utime(path, (0, 0))
+
+    try:
+        assert helpers.cleanup_stale_temp_dirs(60) == 1
+        assert os.path.isdir(running)
+        assert not os.path.exists(finished)
+
+        helpers.release_temp_dir(running)
+        assert helpers.cleanup_stale_temp_dirs(60) == 1
+        assert not os.path.exists(running)
+    finally:
+        helpers.release_temp_dir(running)
@@ -0,0 +1,387 @@
+import re
+import time
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Set
+
+from config.config import BANDWIDTH_GLOBAL_LIMIT, BANDWIDTH_USER_LIMIT, BANDWIDTH_FAIR_SHARE
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Seconds between recomputing fair shares
+REBALANCE_INTERVAL = 1.0
+
+# Smallest bucket depth, so one chunk never waits on an empty bucket for long
+MIN_BURST = 64 * 1024
+
+RATE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+
+def parse_rate(value: str) -> int:
+    """
+    Parse a rate such as '500K', '10M' or '1.5G' into bytes per second.
+
+    Args:
+        value: Number of bytes per second with an optional K, M or G suffix
+
+    Returns:
+        int: Bytes per second, 0 for unlimited
+
+    Raises:
+        ValueError: If the value is not a valid rate
+    """
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([kmg]?)(?:i?b)?(?:/s)?\s*', value.lower())
+    if not match:
+        raise ValueError(f"Invalid rate: {value}")
+    return int(float(match.group(1)) * RATE_UNITS[match.group(2)])
+
+class TokenBucket:
+    """
+    A token bucket metering bytes.
+
+    Tokens refill at ``rate`` bytes per second up to ``burst``. Consuming
+    more than is available leaves the bucket in debt and sleeps until the
+    debt is repaid, so concurrent consumers queue up behind each other
+    without a separate waiter list.
+    """
+
+    def __init__(self, rate: float = 0, burst: Optional[float] = None):
+        """
+        Initialize the bucket full.
+
+        Args:
+            rate: Bytes per second, 0 for unlimited
+            burst: Bucket depth in bytes, half a second of traffic by default
+        """
+        self.rate = 0.0
+        self.burst = 0.0
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.set_rate(rate, burst)
+        self.tokens = self.burst
+
+    def set_rate(self, rate: float, burst: Optional[float] = None) -> None:
+        """
+        Change the refill rate, keeping tokens earned at the old rate.
+
+        Args:
+            rate: Bytes per second, 0 for unlimited
+            burst: Bucket depth in bytes, half a second of traffic by default
+        """
+        self._refill()
+        self.rate = max(0.0, float(rate))
+        self.burst = burst if burst is not None else max(self.rate / 2, MIN_BURST)
+        self.tokens = min(self.tokens, self.burst)
+
+    def _refill(self) -> None:
+        """Add the tokens earned since the last update."""
+        now = time.monotonic()
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_full(self) -> bool:
+        """
+        Check whether the bucket has refilled to its full depth.
+
+        Returns:
+            bool: True if the bucket is full or unlimited
+        """
+        self._refill()
+        return self.rate <= 0 or self.tokens >= self.burst
+
+    async def consume(self, amount: int) -> float:
+        """
+        Take tokens for bytes that were transferred, waiting if the bucket runs dry.
+
+        Args:
+            amount: Number of bytes
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        if self.rate <= 0:
+            return 0.0
+
+        self._refill()
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0.0
+
+        delay = -self.tokens / self.rate
+        await asyncio.sleep(delay)
+        return delay
+
+class JobMeter:
+    """
+    The bandwidth share and measured rate of one download.
+    """
+
+    def __init__(self, governor: 'BandwidthGovernor', user_id: int):
+        """
+        Initialize the meter.
+
+        Args:
+            governor: Governor the job is registered with
+            user_id: User whose bucket the job draws from
+        """
+        self.governor = governor
+        self.user_id = user_id
+        self.bucket = TokenBucket()
+
+        # A job counts as wanting a full share until it has been measured
+        self.throttled = False
+        self.measured = False
+        self.rate = 0.0
+        self.peak_rate = 0.0
+        self.window_started = time.monotonic()
+        self.window_bytes = 0
+        self.total_bytes = 0
+        self.last_wait = 0.0
+
+    async def consume(self, amount: int, user_id: Optional[int] = None) -> float:
+        """
+        Meter bytes received by the job against its share, its user and the global limit.
+
+        Args:
+            amount: Number of bytes
+            user_id: Current owner of the job, if it was handed over since registering
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        if user_id is not None:
+            self.user_id = user_id
+        self._measure(amount)
+
+        governor = self.governor
+        governor.maybe_rebalance()
+
+        # Waiting on the job's share or on the global limit means the job wants more;
+        # waiting on the user's own limit does not, since a bigger share would go unused
+        shared_wait = await self.bucket.consume(amount)
+        user_wait = await governor.user_bucket(self.user_id).consume(amount)
+        shared_wait += await governor.global_bucket.consume(amount)
+        if shared_wait:
+            self.throttled = True
+        if shared_wait or user_wait:
+            self.last_wait = time.monotonic()
+        return shared_wait + user_wait
+
+    def is_throttled(self) -> bool:
+        """
+        Check whether the job was recently held back by a bandwidth limit.
+
+        Returns:
+            bool: True if the job waited on a bucket within the last rebalance interval
+        """
+        return time.monotonic() - self.last_wait < REBALANCE_INTERVAL
+
+    def _measure(self, amount: int) -> None:
+        """
+        Count bytes towards the current rate.
+
+        Args:
+            amount: Number of bytes
+        """
+        self.window_bytes += amount
+        self.total_bytes += amount
+        elapsed = time.monotonic() - self.window_started
+        if elapsed >= REBALANCE_INTERVAL:
+            self.rate = self.window_bytes / elapsed
+            self.peak_rate = max(self.peak_rate, self.rate)
+            self.window_started += elapsed
+            self.window_bytes = 0
+            self.measured = True
+
+    def current_rate(self) -> float:
+        """
+        Get the job's rate, decaying towards zero while no bytes arrive.
+
+        Returns:
+            float: Bytes per second
+        """
+        elapsed = time.monotonic() - self.window_started
+        if elapsed >= 2 * REBALANCE_INTERVAL:
+            return self.window_bytes / elapsed
+        return self.rate
+
+class BandwidthGovernor:
+    """
+    Bandwidth shaping for segment downloads.
+
+    Every received chunk is metered against a global token bucket and the
+    bucket of the user the download belongs to. In fair-share mode each job
+    also gets its own bucket, refilled at a max-min fair share of the global
+    rate: jobs using less than an even split keep what they use, and the
+    spare capacity is split evenly among the jobs that want more. A job
+    that hits its share is treated as wanting more at the next rebalance.
+    Limits of 0 mean unlimited and can be changed while downloads run.
+    """
+
+    def __init__(self, global_rate: int = 0, user_rate: int = 0, fair_share: bool = True):
+        """
+        Initialize the governor.
+
+        Args:
+            global_rate: Bytes per second across all downloads, 0 for unlimited
+            user_rate: Bytes per second per user, 0 for unlimited
+            fair_share: Split the global rate among active jobs
+        """
+        self.global_rate = global_rate
+        self.user_rate = user_rate
+        self.fair_share = fair_share
+        self.global_bucket = TokenBucket(global_rate)
+        self.user_buckets: Dict[int, TokenBucket] = {}
+        self.jobs: Set[JobMeter] = set()
+        self.last_rebalance = 0.0
+
+    def register(self, user_id: int) -> JobMeter:
+        """
+        Start metering a download.
+
+        Args:
+            user_id: Telegram user ID the download belongs to
+
+        Returns:
+            JobMeter: The job's meter
+        """
+        meter = JobMeter(self, user_id)
+        self.jobs.add(meter)
+        self._drop_idle_user_buckets()
+        self.rebalance()
+        return meter
+
+    def unregister(self, meter: JobMeter) -> None:
+        """
+        Stop metering a download and give its share to the others.
+
+        Args:
+            meter: Meter returned by register
+        """
+        self.jobs.discard(meter)
+        self._drop_idle_user_buckets()
+        self.rebalance()
+
+    def _drop_idle_user_buckets(self) -> None:
+        """
+        Forget the buckets of users without jobs once they have refilled.
+
+        A bucket still in debt is kept, so a user cannot skip the debt of a
+        finished download by starting the next one right away.
+        """
+        active_users = {job.user_id for job in self.jobs}
+        for user_id, bucket in list(self.user_buckets.items()):
+            if user_id not in active_users and bucket.is_full():
+                del self.user_buckets[user_id]
+
+    def user_bucket(self, user_id: int) -> TokenBucket:
+        """
+        Get a user's bucket.
+
+        Args:
+            user_id: Telegram user ID
+
+        Returns:
+            TokenBucket: The user's bucket
+        """
+        bucket = self.user_buckets.get(user_id)
+        if bucket is None:
+            bucket = self.user_buckets[user_id] = TokenBucket(self.user_rate)
+        return bucket
+
+    def set_limits(self, global_rate: Optional[int] = None, user_rate: Optional[int] = None,
+                   fair_share: Optional[bool] = None) -> None:
+        """
+        Change limits while downloads are running.
+
+        Args:
+            global_rate: Bytes per second across all downloads, 0 for unlimited
+            user_rate: Bytes per second per user, 0 for unlimited
+            fair_share: Split the global rate among active jobs
+        """
+        if global_rate is not None:
+            self.global_rate = global_rate
+            self.global_bucket.set_rate(global_rate)
+        if user_rate is not None:
+            self.user_rate = user_rate
+            for bucket in self.user_buckets.values():
+                bucket.set_rate(user_rate)
+        if fair_share is not None:
+            self.fair_share = fair_share
+
+        logger.info(f"Bandwidth limits set to {self.global_rate} B/s global, {self.user_rate} B/s per user, "
+                    f"fair share {'on' if self.fair_share else 'off'}")
+        self.rebalance()
+
+    def maybe_rebalance(self) -> None:
+        """Recompute fair shares if the last computation is stale."""
+        if time.monotonic() - self.last_rebalance >= REBALANCE_INTERVAL:
+            self._drop_idle_user_buckets()
+            self.rebalance()
+
+    def rebalance(self) -> None:
+        """Refill each job's bucket at its max-min fair share of the global rate."""
+        self.last_rebalance = time.monotonic()
+        if not self.fair_share or self.global_rate <= 0:
+            for job in self.jobs:
+                job.bucket.set_rate(0)
+            return
+
+        def demand(job: JobMeter) -> float:
+            wanted = float('inf')
+            if job.measured and not job.throttled:
+                # Leave headroom so a job that speeds up hits its share and asks for more
+                wanted = job.current_rate() * 1.25 + MIN_BURST
+            if self.user_rate > 0:
+                wanted = min(wanted, self.user_rate)
+            return wanted
+
+        jobs = sorted(self.jobs, key=demand)
+        remaining = float(self.global_rate)
+        for position, job in enumerate(jobs):
+            share = remaining / (len(jobs) - position)
+            allocation = min(demand(job), share)
+            job.bucket.set_rate(allocation)
+            job.throttled = False
+            remaining -= allocation
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get statistics about bandwidth shaping.
+
+        Returns:
+            Dict[str, Any]: Limits, active jobs and their rates
+        """
+        return {
+            "global_limit": self.global_rate,
+            "user_limit": self.user_rate,
+            "fair_share": self.fair_share,
+            "jobs": len(self.jobs),
+            "rate": int(sum(job.current_rate() for job in self.jobs)),
+            "shares": sorted(int(job.bucket.rate) for job in self.jobs)
+        }
+
+# Global bandwidth governor
+bandwidth_governor = None
+
+def get_bandwidth_governor(global_rate: int = BANDWIDTH_GLOBAL_LIMIT,
+                           user_rate: int = BANDWIDTH_USER_LIMIT,
+                           fair_share: bool = BANDWIDTH_FAIR_SHARE) -> BandwidthGovernor:
+    """
+    Get or create the global bandwidth governor.
+
+    Args:
+        global_rate: Bytes per second across all downloads, 0 for unlimited
+        user_rate: Bytes per second per user, 0 for unlimited
+        fair_share: Split the global rate among active jobs
+
+    Returns:
+        BandwidthGovernor: The global governor
+    """
+    global bandwidth_governor
+
+    if bandwidth_governor is None:
+        bandwidth_governor = BandwidthGovernor(global_rate=global_rate, user_rate=user_rate, fair_share=fair_share)
+
+    return bandwidth_governor
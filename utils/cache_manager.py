@@ -1,12 +1,13 @@
 import os
 import time
+import uuid
 import logging
 import hashlib
 import json
+import sqlite3
 import asyncio
 import aiofiles
 from typing import Dict, Any, Optional, Tuple, List
-import m3u8
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -17,6 +18,18 @@ class CacheManager:
     
     This class provides caching functionality for M3U8 playlists with TTL (Time-To-Live)
     and cache invalidation mechanisms.
+
+    Besides raw playlist text it keeps a tier of resolved playlists: the
+    packed segment table a request ended up downloading, together with the
+    selection made on the way. Each resolved entry records the URL and hash
+    of the media playlist text it was parsed from, and is dropped as soon as
+    that playlist is cached with different text or invalidated.
+
+    The index lives in an SQLite database in WAL mode, so storing or
+    dropping an entry writes one indexed row, lookups never load the whole
+    index, and a crash leaves the last committed state. Content files are
+    written under a temporary name and renamed into place before their row
+    is committed, so a row never points at a partial file.
     """
     _instance = None
     
@@ -48,8 +61,10 @@ class CacheManager:
         self.ttl = ttl
         self.max_size = max_size
         self.cleanup_interval = cleanup_interval
-        self.cache_index: Dict[str, Dict[str, Any]] = {}
+        self.index_path = os.path.join(self.cache_dir, 'cache_index.db')
         self.lock = asyncio.Lock()
+        self.parsed_hits = 0
+        self.parsed_misses = 0
         
         # Create cache directory if it doesn't exist
         os.makedirs(self.cache_dir, exist_ok=True)
@@ -60,8 +75,9 @@ class CacheManager:
         except Exception as e:
             logger.warning(f"Could not set secure permissions on cache directory: {str(e)}")
         
-        # Load cache index if it exists
-        self._load_cache_index()
+        # Open the cache index, importing a JSON index left by an older version
+        self.db = self._open_cache_index()
+        self._import_json_index()
         
         # Start background cleanup task
         self.cleanup_task = asyncio.create_task(self._cleanup_task())
@@ -69,27 +85,75 @@ class CacheManager:
         self._initialized = True
         logger.info(f"Cache manager initialized with ttl={ttl}s, max_size={max_size} bytes")
     
-    def _load_cache_index(self):
-        """Load the cache index from disk."""
-        index_path = os.path.join(self.cache_dir, 'cache_index.json')
+    def _open_cache_index(self) -> sqlite3.Connection:
+        """
+        Open the cache index database, starting a new one if it is unreadable.
+        
+        Returns:
+            sqlite3.Connection: Connection to the index
+        """
         try:
-            if os.path.exists(index_path):
-                with open(index_path, 'r') as f:
-                    self.cache_index = json.load(f)
-                logger.info(f"Loaded cache index with {len(self.cache_index)} entries")
-        except Exception as e:
-            logger.error(f"Error loading cache index: {str(e)}")
-            self.cache_index = {}
+            return self._connect_cache_index()
+        except sqlite3.DatabaseError as e:
+            # Content files of the lost entries are removed by the cleanup as orphans
+            logger.error(f"Cache index is unreadable, starting a new one: {str(e)}")
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(self.index_path + suffix):
+                    os.remove(self.index_path + suffix)
+            return self._connect_cache_index()
+    
+    def _connect_cache_index(self) -> sqlite3.Connection:
+        """
+        Connect to the cache index database and create its schema.
+        
+        Returns:
+            sqlite3.Connection: Connection to the index
+        """
+        db = sqlite3.connect(self.index_path)
+        try:
+            # WAL commits append to a log instead of rewriting pages, and survive a crash of the process
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            with db:
+                db.execute(
+                    'CREATE TABLE IF NOT EXISTS entries ('
+                    'key TEXT PRIMARY KEY, url TEXT NOT NULL, timestamp REAL NOT NULL, size INTEGER NOT NULL, '
+                    'path TEXT NOT NULL, sha256 TEXT, source_url TEXT, source_hash TEXT)'
+                )
+                db.execute('CREATE INDEX IF NOT EXISTS entries_timestamp ON entries (timestamp)')
+                db.execute('CREATE INDEX IF NOT EXISTS entries_source_url ON entries (source_url)')
+            count = db.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        except sqlite3.DatabaseError:
+            db.close()
+            raise
+        logger.info(f"Opened cache index with {count} entries")
+        return db
     
-    async def _save_cache_index(self):
-        """Save the cache index to disk."""
-        index_path = os.path.join(self.cache_dir, 'cache_index.json')
+    def _import_json_index(self):
+        """Move the entries of a JSON cache index into the database and remove the JSON file."""
+        json_path = os.path.join(self.cache_dir, 'cache_index.json')
+        if not os.path.exists(json_path):
+            return
+        
         try:
-            async with self.lock:
-                async with aiofiles.open(index_path, 'w') as f:
-                    await f.write(json.dumps(self.cache_index, indent=2))
+            with open(json_path, 'r') as f:
+                entries = json.load(f)
+            with self.db:
+                self.db.executemany(
+                    'INSERT OR IGNORE INTO entries (key, url, timestamp, size, path) VALUES (?, ?, ?, ?, ?)',
+                    [
+                        (key, info['url'], info['timestamp'], info.get('size', 0), info['path'])
+                        for key, info in entries.items()
+                    ]
+                )
+            logger.info(f"Imported {len(entries)} entries from the JSON cache index")
         except Exception as e:
-            logger.error(f"Error saving cache index: {str(e)}")
+            logger.error(f"Error importing JSON cache index: {str(e)}")
+        
+        try:
+            os.remove(json_path)
+        except OSError as e:
+            logger.warning(f"Could not remove JSON cache index: {str(e)}")
     
     def _get_cache_key(self, url: str) -> str:
         """
@@ -116,6 +180,71 @@ class CacheManager:
             str: Path to the cached file
         """
         return os.path.join(self.cache_dir, f"{key}.m3u8")
+
+    def _get_parsed_path(self, key: str) -> str:
+        """
+        Get the file path for a resolved playlist.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            str: Path to the packed playlist file
+        """
+        return os.path.join(self.cache_dir, f"{key}.plc")
+    
+    async def _write_temp(self, path: str, data, mode: str) -> str:
+        """
+        Write the content of a cache file under a unique temporary name.
+        
+        The caller renames it into place under the lock together with its
+        index row, so concurrent writers of one file never share a temp file
+        and the file that wins always matches the row that wins.
+        
+        Args:
+            path: Final path of the file
+            data: Content to write
+            mode: File mode, 'w' for text or 'wb' for bytes
+            
+        Returns:
+            str: Path of the temporary file
+        """
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            async with aiofiles.open(tmp_path, mode) as f:
+                await f.write(data)
+        except Exception:
+            self._remove_files([tmp_path])
+            raise
+        return tmp_path
+    
+    def _remove_files(self, paths: List[str]):
+        """
+        Remove cache files that no index row points at.
+        
+        Args:
+            paths: Paths to remove
+        """
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"Could not remove cache file {path}: {str(e)}")
+    
+    def _delete_entries(self, rows: List[Tuple[str, str]]):
+        """
+        Remove index rows, then their files. The caller holds the lock.
+        
+        Args:
+            rows: (key, path) of each entry
+        """
+        if not rows:
+            return
+        with self.db:
+            self.db.executemany('DELETE FROM entries WHERE key = ?', [(key,) for key, _ in rows])
+        self._remove_files([path for _, path in rows])
     
     async def get(self, url: str) -> Optional[str]:
         """
@@ -131,23 +260,24 @@ class CacheManager:
         
         async with self.lock:
             # Check if the key exists in the cache index
-            if key not in self.cache_index:
+            row = self.db.execute('SELECT timestamp, path FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
                 return None
             
             # Check if the cached item has expired
-            cache_info = self.cache_index[key]
-            if time.time() - cache_info['timestamp'] > self.ttl:
+            timestamp, cache_path = row
+            if time.time() - timestamp > self.ttl:
                 logger.debug(f"Cache expired for {url}")
                 return None
             
             # Get the cached content
             try:
-                cache_path = self._get_cache_path(key)
                 if not os.path.exists(cache_path):
                     logger.warning(f"Cache file missing for {url}")
                     return None
                 
-                async with aiofiles.open(cache_path, 'r') as f:
+                # Keep line endings as stored so the text hashes the same as when it was cached
+                async with aiofiles.open(cache_path, 'r', newline='') as f:
                     content = await f.read()
                 
                 logger.debug(f"Cache hit for {url}")
@@ -171,21 +301,23 @@ class CacheManager:
         cache_path = self._get_cache_path(key)
         
         try:
-            # Write the content to the cache file
-            async with aiofiles.open(cache_path, 'w') as f:
-                await f.write(content)
-            
-            # Update the cache index
-            async with self.lock:
-                self.cache_index[key] = {
-                    'url': url,
-                    'timestamp': time.time(),
-                    'size': len(content),
-                    'path': cache_path
-                }
+            # Write the content to a temporary file
+            tmp_path = await self._write_temp(cache_path, content, 'w')
             
-            # Save the cache index
-            await self._save_cache_index()
+            # Move it into place and update the cache index, dropping playlists resolved from different text
+            content_hash = hashlib.sha256(content.encode('utf-8', errors='replace')).hexdigest()
+            try:
+                async with self.lock:
+                    os.replace(tmp_path, cache_path)
+                    with self.db:
+                        self.db.execute(
+                            'INSERT OR REPLACE INTO entries (key, url, timestamp, size, path, sha256) '
+                            'VALUES (?, ?, ?, ?, ?, ?)',
+                            (key, url, time.time(), len(content), cache_path, content_hash)
+                        )
+                    self._drop_resolved_from(url, keep_hash=content_hash)
+            finally:
+                self._remove_files([tmp_path])
             
             logger.debug(f"Cached content for {url}")
             return True
@@ -205,28 +337,125 @@ class CacheManager:
         """
         key = self._get_cache_key(url)
         
-        async with self.lock:
-            if key not in self.cache_index:
-                return False
+        try:
+            async with self.lock:
+                row = self.db.execute('SELECT path FROM entries WHERE key = ?', (key,)).fetchone()
+                if row is None:
+                    return False
+                
+                # Remove the entry and its file, with playlists resolved from it
+                self._delete_entries([(key, row[0])])
+                self._drop_resolved_from(url)
             
+            logger.debug(f"Invalidated cache for {url}")
+            return True
+        except Exception as e:
+            logger.error(f"Error invalidating cache for {url}: {str(e)}")
+            return False
+    
+    async def get_parsed(self, identity: str) -> Optional[bytes]:
+        """
+        Get the resolved playlist stored for a request.
+
+        Args:
+            identity: Request identity the playlist was stored under
+
+        Returns:
+            Optional[bytes]: Packed playlist or None if not found or expired
+        """
+        key = self._get_cache_key(f"parsed:{identity}")
+
+        async with self.lock:
+            row = self.db.execute('SELECT timestamp, path FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None or time.time() - row[0] > self.ttl:
+                self.parsed_misses += 1
+                return None
+
             try:
-                # Remove the cache file
-                cache_path = self._get_cache_path(key)
-                if os.path.exists(cache_path):
-                    os.remove(cache_path)
-                
-                # Remove the entry from the cache index
-                del self.cache_index[key]
-                
-                # Save the cache index
-                await self._save_cache_index()
-                
-                logger.debug(f"Invalidated cache for {url}")
-                return True
+                async with aiofiles.open(row[1], 'rb') as f:
+                    data = await f.read()
             except Exception as e:
-                logger.error(f"Error invalidating cache for {url}: {str(e)}")
-                return False
-    
+                logger.warning(f"Error reading resolved playlist for {identity}: {str(e)}")
+                self.parsed_misses += 1
+                return None
+
+        self.parsed_hits += 1
+        logger.debug(f"Resolved playlist cache hit for {identity}")
+        return data
+
+    async def set_parsed(self, identity: str, data: bytes, source_url: str, source_hash: str) -> bool:
+        """
+        Store the resolved playlist of a request.
+
+        Args:
+            identity: Request identity to store the playlist under
+            data: Packed playlist
+            source_url: URL of the media playlist it was parsed from
+            source_hash: SHA-256 of that playlist's text
+
+        Returns:
+            bool: True if successful, False otherwise
+        """
+        key = self._get_cache_key(f"parsed:{identity}")
+        cache_path = self._get_parsed_path(key)
+
+        try:
+            tmp_path = await self._write_temp(cache_path, data, 'wb')
+
+            try:
+                async with self.lock:
+                    os.replace(tmp_path, cache_path)
+                    with self.db:
+                        self.db.execute(
+                            'INSERT OR REPLACE INTO entries (key, url, timestamp, size, path, source_url, source_hash) '
+                            'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            (key, identity, time.time(), len(data), cache_path, source_url, source_hash)
+                        )
+            finally:
+                self._remove_files([tmp_path])
+
+            logger.debug(f"Cached resolved playlist for {identity}")
+            return True
+        except Exception as e:
+            logger.error(f"Error caching resolved playlist for {identity}: {str(e)}")
+            return False
+
+    def _drop_resolved_from(self, url: str, keep_hash: Optional[str] = None) -> None:
+        """
+        Remove resolved playlists parsed from a media playlist. The caller holds the lock.
+
+        Args:
+            url: Media playlist URL
+            keep_hash: Text hash whose resolved playlists are still valid, if any
+        """
+        stale = self.db.execute(
+            'SELECT key, path FROM entries WHERE source_url = ? AND source_hash IS NOT ?', (url, keep_hash)
+        ).fetchall()
+        self._delete_entries(stale)
+        if stale:
+            logger.debug(f"Dropped {len(stale)} resolved playlist(s) of changed playlist {url}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get statistics about the playlist cache.
+
+        Returns:
+            Dict[str, Any]: Settings, entry counts and resolved playlist hits
+        """
+        items_count, parsed_count, size = self.db.execute(
+            'SELECT COUNT(*), COUNT(source_url), COALESCE(SUM(size), 0) FROM entries'
+        ).fetchone()
+        return {
+            "cache_dir": self.cache_dir,
+            "ttl": self.ttl,
+            "max_size": self.max_size,
+            "items_count": items_count,
+            "size": size,
+            "parsed_count": parsed_count,
+            "parsed_hits": self.parsed_hits,
+            "parsed_misses": self.parsed_misses
+        }
+
     async def clear(self) -> bool:
         """
         Clear all cached content.
@@ -236,17 +465,8 @@ class CacheManager:
         """
         try:
             async with self.lock:
-                # Remove all cache files
-                for key, info in self.cache_index.items():
-                    cache_path = info.get('path')
-                    if cache_path and os.path.exists(cache_path):
-                        os.remove(cache_path)
-                
-                # Clear the cache index
-                self.cache_index = {}
-                
-                # Save the cache index
-                await self._save_cache_index()
+                # Remove all entries and their files
+                self._delete_entries(self.db.execute('SELECT key, path FROM entries').fetchall())
                 
                 logger.info("Cache cleared")
                 return True
@@ -267,68 +487,45 @@ class CacheManager:
                 await asyncio.sleep(60)  # Wait a minute before retrying
     
     async def _cleanup_cache(self):
-        """Clean up expired and excess cache items."""
+        """Clean up expired, excess and orphaned cache items."""
         try:
-            current_time = time.time()
-            total_size = 0
-            items_to_remove = []
-            
-            # First pass: identify expired items and calculate total size
             async with self.lock:
-                for key, info in self.cache_index.items():
-                    if current_time - info['timestamp'] > self.ttl:
-                        items_to_remove.append(key)
-                    else:
-                        total_size += info.get('size', 0)
-            
-            # Remove expired items
-            for key in items_to_remove:
-                await self._remove_cache_item(key)
-            
-            # Second pass: if still over max size, remove oldest items
-            if total_size > self.max_size:
-                async with self.lock:
-                    # Sort items by timestamp (oldest first)
-                    sorted_items = sorted(
-                        self.cache_index.items(),
-                        key=lambda x: x[1]['timestamp']
-                    )
-                    
-                    # Remove oldest items until under max size
-                    for key, info in sorted_items:
+                # Remove expired items
+                expired = self.db.execute(
+                    'SELECT key, path FROM entries WHERE timestamp < ?', (time.time() - self.ttl,)
+                ).fetchall()
+                self._delete_entries(expired)
+                
+                # If still over max size, remove oldest items until under max size
+                total_size = self.db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+                excess = []
+                if total_size > self.max_size:
+                    for key, path, size in self.db.execute('SELECT key, path, size FROM entries ORDER BY timestamp'):
                         if total_size <= self.max_size:
                             break
-                        
-                        await self._remove_cache_item(key)
-                        total_size -= info.get('size', 0)
-            
-            # Save the cache index
-            await self._save_cache_index()
+                        excess.append((key, path))
+                        total_size -= size
+                self._delete_entries(excess)
+                
+                # Files older than any valid entry but without a row were left by a crash
+                orphans = []
+                cutoff = time.time() - self.ttl
+                for name in os.listdir(self.cache_dir):
+                    path = os.path.join(self.cache_dir, name)
+                    if not name.endswith(('.m3u8', '.plc', '.tmp')) or os.path.getmtime(path) > cutoff:
+                        continue
+                    key = name.split('.', 1)[0]
+                    if name.endswith('.tmp') or self.db.execute(
+                        'SELECT 1 FROM entries WHERE key = ?', (key,)
+                    ).fetchone() is None:
+                        orphans.append(path)
+                self._remove_files(orphans)
             
-            logger.debug(f"Cache cleanup completed. Current size: {total_size} bytes")
+            logger.debug(f"Cache cleanup completed. Removed {len(expired)} expired, {len(excess)} excess and "
+                         f"{len(orphans)} orphaned items, current size: {total_size} bytes")
         except Exception as e:
             logger.error(f"Error cleaning up cache: {str(e)}")
     
-    async def _remove_cache_item(self, key: str):
-        """
-        Remove a cache item.
-        
-        Args:
-            key: Cache key to remove
-        """
-        try:
-            async with self.lock:
-                if key in self.cache_index:
-                    # Remove the cache file
-                    cache_path = self._get_cache_path(key)
-                    if os.path.exists(cache_path):
-                        os.remove(cache_path)
-                    
-                    # Remove the entry from the cache index
-                    del self.cache_index[key]
-        except Exception as e:
-            logger.error(f"Error removing cache item {key}: {str(e)}")
-    
     async def stop(self):
         """Stop the cache manager and clean up resources."""
         if hasattr(self, 'cleanup_task') and self.cleanup_task:
@@ -338,8 +535,9 @@ class CacheManager:
             except asyncio.CancelledError:
                 pass
         
-        # Save the cache index
-        await self._save_cache_index()
+        # Fold the write-ahead log back into the database and close it
+        self.db.close()
+        self._initialized = False
         
         logger.info("Cache manager stopped")
 
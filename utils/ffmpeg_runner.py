@@ -0,0 +1,135 @@
+import logging
+import asyncio
+import platform
+import subprocess
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+async def create_ffmpeg_process(cmd: List[str], stdin: bool = False,
+                                stdout: bool = False) -> asyncio.subprocess.Process:
+    """
+    Start an ffmpeg process without blocking the event loop.
+
+    Args:
+        cmd: Command line to run
+        stdin: Whether to open a pipe to the process's stdin
+        stdout: Whether to capture the process's stdout
+
+    Returns:
+        asyncio.subprocess.Process: The started process
+    """
+    kwargs: Dict[str, Any] = {
+        'stdin': asyncio.subprocess.PIPE if stdin else asyncio.subprocess.DEVNULL,
+        'stdout': asyncio.subprocess.PIPE if stdout else asyncio.subprocess.DEVNULL,
+        'stderr': asyncio.subprocess.PIPE
+    }
+
+    # Use platform-specific settings
+    if platform.system().lower() == 'windows':
+        kwargs['creationflags'] = subprocess.CREATE_NO_WINDOW if hasattr(subprocess, 'CREATE_NO_WINDOW') else 0
+
+    return await asyncio.create_subprocess_exec(*cmd, **kwargs)
+
+async def kill_process(process: Optional[asyncio.subprocess.Process]) -> None:
+    """
+    Kill a child process if it is still running and reap it.
+
+    Args:
+        process: Process to kill
+    """
+    if process is None or process.returncode is not None:
+        return
+
+    try:
+        process.kill()
+    except ProcessLookupError:
+        pass
+
+    # Shield the reap so a second cancellation cannot leave a zombie behind
+    await asyncio.shield(process.wait())
+
+async def read_stderr_tail(process: asyncio.subprocess.Process, tail: Deque[str]) -> None:
+    """
+    Drain a process's stderr, keeping the last lines for error reporting.
+
+    Args:
+        process: Process to read from
+        tail: Bounded deque receiving the most recent lines
+    """
+    while True:
+        line = await process.stderr.readline()
+        if not line:
+            break
+        tail.append(line.decode('utf-8', errors='replace').rstrip())
+
+async def run_ffmpeg(cmd: List[str], timeout: Optional[float] = None, duration: float = 0,
+                     progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None) -> Tuple[int, str]:
+    """
+    Run an ffmpeg command asynchronously with ``-progress`` reporting.
+
+    The event loop keeps serving other work while ffmpeg runs. If the calling
+    task is cancelled or the timeout expires, the child process is killed
+    before the exception propagates.
+
+    Args:
+        cmd: Command line starting with 'ffmpeg'
+        timeout: Optional timeout in seconds
+        duration: Expected media duration in seconds, used to compute a percentage
+        progress_callback: Optional function called with each parsed progress block
+
+    Returns:
+        Tuple[int, str]: (return code, tail of the ffmpeg log)
+
+    Raises:
+        asyncio.TimeoutError: If the timeout expires
+    """
+    # Ask ffmpeg for machine-readable progress on stdout
+    cmd = [cmd[0], '-progress', 'pipe:1', '-nostats'] + cmd[1:]
+
+    process = await create_ffmpeg_process(cmd, stdout=True)
+    stderr_tail: Deque[str] = deque(maxlen=20)
+
+    async def read_progress():
+        block: Dict[str, Any] = {}
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                break
+
+            key, _, value = line.decode('utf-8', errors='replace').strip().partition('=')
+            if not key:
+                continue
+            block[key] = value
+
+            # Each block ends with a progress=continue|end line
+            if key == 'progress':
+                if duration > 0:
+                    try:
+                        out_time = int(block.get('out_time_us', 0)) / 1_000_000
+                        block['percent'] = max(0, min(100, int(out_time / duration * 100)))
+                    except ValueError:
+                        pass
+                if value == 'end':
+                    block['percent'] = 100
+
+                if progress_callback:
+                    try:
+                        progress_callback(block)
+                    except Exception as e:
+                        logger.debug(f"FFmpeg progress callback failed: {str(e)}")
+                block = {}
+
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(read_progress(), read_stderr_tail(process, stderr_tail), process.wait()),
+            timeout=timeout
+        )
+    except BaseException:
+        # Timeout or cancellation: never leave ffmpeg running
+        await kill_process(process)
+        raise
+
+    return process.returncode, '\n'.join(stderr_tail)
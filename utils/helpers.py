@@ -5,7 +5,8 @@ import logging
 import asyncio
 import secrets
 import hashlib
-from typing import Optional, Dict, Any, List
+import shutil
+from typing import Optional, Dict, Any, List, Callable, Set
 import aiohttp
 import aiofiles
 from urllib.parse import urlparse, urljoin
@@ -28,6 +29,9 @@ logger = logging.getLogger(__name__)
 # Active downloads tracking
 active_downloads: Dict[int, Dict[str, Any]] = {}
 
+# Temp directories of downloads that are still running
+active_temp_dirs: Set[str] = set()
+
 def is_valid_m3u8_url(url: str) -> bool:
     """
     Enhanced validation for M3U8 URLs with security checks.
@@ -148,18 +152,30 @@ def get_file_size(file_path: str) -> int:
     except (FileNotFoundError, OSError):
         return 0
 
-def create_secure_temp_dir(user_id: int) -> str:
+def get_temp_root() -> str:
     """
-    Create a secure temporary directory for a user's download session in the project root 'downloads_tmp' folder.
+    Get the project root 'downloads_tmp' folder that holds per-download temp directories.
+
+    Returns:
+        str: Path to the temp root
     """
-    import os
-    import secrets
-    import hashlib
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(project_root, 'downloads_tmp')
 
+def create_secure_temp_dir(user_id: int, job_key: Optional[str] = None) -> str:
+    """
+    Create a secure temporary directory for a user's download session in the project root 'downloads_tmp' folder.
+
+    Args:
+        user_id: Telegram user ID
+        job_key: Optional stable job identifier. When given, the same user and key always
+                 map to the same directory so an interrupted download can be resumed.
+
+    Returns:
+        str: Path to the temporary directory
+    """
     # Ensure the project root 'downloads_tmp' directory exists
-    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    print(f"[DEBUG] helpers.py project_root: {project_root}")
-    tmp_root = os.path.join(project_root, 'downloads_tmp')
+    tmp_root = get_temp_root()
     print(f"[DEBUG] helpers.py tmp_root: {tmp_root}")
     try:
         os.makedirs(tmp_root, exist_ok=True)
@@ -169,9 +185,12 @@ def create_secure_temp_dir(user_id: int) -> str:
         logger.warning(f"Could not set up tmp dir: {str(e)}")
         print(f"[DEBUG] Could not set up tmp dir: {str(e)}")
 
-    # Generate a unique directory name
-    random_token = secrets.token_hex(8)
-    hash_obj = hashlib.sha256(f"{user_id}_{random_token}".encode())
+    # Generate a unique directory name, or a stable one for resumable jobs
+    if job_key is not None:
+        hash_obj = hashlib.sha256(f"{user_id}_{job_key}".encode())
+    else:
+        random_token = secrets.token_hex(8)
+        hash_obj = hashlib.sha256(f"{user_id}_{random_token}".encode())
     dir_name = hash_obj.hexdigest()[:16]
     temp_dir = os.path.join(tmp_root, f"m3u8_{dir_name}")
     print(f"[DEBUG] helpers.py temp_dir: {temp_dir}")
@@ -182,8 +201,63 @@ def create_secure_temp_dir(user_id: int) -> str:
     except Exception as e:
         logger.warning(f"Could not set up temp dir: {str(e)}")
         print(f"[DEBUG] Could not set up temp dir: {str(e)}")
+    active_temp_dirs.add(temp_dir)
     return temp_dir
 
+def release_temp_dir(temp_dir: str) -> None:
+    """
+    Mark a temp directory as no longer used by a running download.
+
+    Args:
+        temp_dir: Path returned by create_secure_temp_dir
+    """
+    active_temp_dirs.discard(temp_dir)
+
+def cleanup_stale_temp_dirs(max_age: int) -> int:
+    """
+    Remove download temp directories that have not been touched for a while.
+
+    Directories of running downloads are kept however old they look, since
+    a long segment may be fetched without touching the directory.
+
+    Args:
+        max_age: Maximum age in seconds since the last modification
+
+    Returns:
+        int: Number of directories removed
+    """
+    tmp_root = get_temp_root()
+    if not os.path.isdir(tmp_root):
+        return 0
+
+    removed = 0
+    now = time.time()
+    for name in os.listdir(tmp_root):
+        # Only ever touch directories that follow our naming pattern
+        if not name.startswith('m3u8_'):
+            continue
+
+        path = os.path.join(tmp_root, name)
+        try:
+            if not os.path.isdir(path) or path in active_temp_dirs:
+                continue
+
+            # The segment journal is appended to while a download runs
+            last_modified = os.path.getmtime(path)
+            journal_path = os.path.join(path, 'journal.jsonl')
+            if os.path.exists(journal_path):
+                last_modified = max(last_modified, os.path.getmtime(journal_path))
+
+            if now - last_modified > max_age:
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        except OSError as e:
+            logger.warning(f"Could not remove stale temp directory {path}: {str(e)}")
+
+    if removed:
+        logger.info(f"Removed {removed} stale temp directories")
+    return removed
+
 async def fetch_content(url: str, headers: Optional[Dict[str, str]] = None,
                     max_size: int = 10 * 1024 * 1024) -> Optional[str]:
     """
@@ -197,10 +271,30 @@ async def fetch_content(url: str, headers: Optional[Dict[str, str]] = None,
     Returns:
         Optional[str]: Content as string or None if failed
     """
+    content = bytearray()
+    if not await stream_content(url, content.extend, headers, max_size):
+        return None
+    return content.decode('utf-8', errors='replace')
+
+async def stream_content(url: str, on_chunk: Callable[[bytes], None],
+                         headers: Optional[Dict[str, str]] = None,
+                         max_size: int = 10 * 1024 * 1024) -> bool:
+    """
+    Fetch content from a URL, handing the body on in chunks as they arrive instead of buffering it.
+
+    Args:
+        url: URL to fetch
+        on_chunk: Callback receiving each chunk of the body
+        headers: Optional HTTP headers
+        max_size: Maximum content size in bytes (default: 10MB)
+
+    Returns:
+        bool: True if the whole body was received, False if failed
+    """
     # Validate URL before proceeding
     if not is_valid_m3u8_url(url):
         logger.error(f"Invalid M3U8 URL: {url}")
-        return None
+        return False
 
     if not headers:
         headers = {
@@ -233,24 +327,30 @@ async def fetch_content(url: str, headers: Optional[Dict[str, str]] = None,
             content_length = response.content_length
             if content_length and content_length > max_size:
                 logger.error(f"Content too large: {content_length} bytes (max: {max_size})")
-                return None
-
-            # Read with size limit
-            content = await response.read()
-            if len(content) > max_size:
-                logger.error(f"Content too large: {len(content)} bytes (max: {max_size})")
-                return None
-
-            return content.decode('utf-8', errors='replace')
+                return False
+
+            # Read with size limit, handing each chunk on as it arrives
+            received = 0
+            try:
+                async for chunk in response.content.iter_chunked(64 * 1024):
+                    received += len(chunk)
+                    if received > max_size:
+                        logger.error(f"Content too large: more than {max_size} bytes")
+                        return False
+                    on_chunk(chunk)
+            finally:
+                response.release()
+
+            return True
         else:
             logger.error(f"Failed to fetch URL {url}, status code: {response.status}")
-            return None
+            return False
     except aiohttp.ClientError as e:
         logger.error(f"Client error fetching URL {url}: {str(e)}")
-        return None
+        return False
     except asyncio.TimeoutError:
         logger.error(f"Timeout fetching URL {url}")
-        return None
+        return False
     except Exception as e:
         logger.error(f"Error fetching URL {url}: {str(e)}")
-        return None
+        return False
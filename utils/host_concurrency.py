@@ -0,0 +1,268 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Deque, Dict
+from urllib.parse import urlparse
+
+from config.config import (
+    HOST_CONCURRENCY_INITIAL, HOST_CONCURRENCY_MIN, HOST_CONCURRENCY_MAX,
+    HOST_CONCURRENCY_BACKOFF, HOST_CONCURRENCY_LATENCY_FACTOR
+)
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+class AdaptiveLimiter:
+    """
+    An AIMD limit on the requests in flight to one host.
+
+    Completed requests are measured in windows of roughly ``limit`` requests.
+    When a window ran at the limit without any throttling, its throughput did
+    not drop and its latency stayed near the best window seen, the limit grows
+    by one.
+    Throttling responses, connection resets and latency blowups cut the limit
+    by a factor, at most once per couple of round trips so one burst of
+    errors counts once.
+    """
+
+    def __init__(self, host: str, initial: int = 8, min_limit: int = 1, max_limit: int = 32,
+                 backoff: float = 0.5, latency_factor: float = 2.0):
+        """
+        Initialize the limiter.
+
+        Args:
+            host: Host name the limiter applies to
+            initial: Starting limit
+            min_limit: Lowest the limit can be cut to
+            max_limit: Highest the limit can grow to
+            backoff: Factor the limit is multiplied by on congestion
+            latency_factor: Window latency over the baseline, as a multiple, that counts as congestion
+        """
+        self.host = host
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(self.max_limit, max(self.min_limit, initial)))
+        self.backoff = backoff
+        self.latency_factor = latency_factor
+        self.in_flight = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+
+        self.baseline_latency = 0.0
+        self.last_throughput = 0.0
+        self.last_cut = 0.0
+        self.increases = 0
+        self.decreases = 0
+        self._reset_window()
+
+    def _reset_window(self) -> None:
+        """Start a new measurement window."""
+        self.window_started = time.monotonic()
+        self.window_requests = 0
+        self.window_bytes = 0
+        self.window_latency = 0.0
+        self.window_saturated = False
+        self.window_congested = False
+
+    async def acquire(self) -> None:
+        """Wait until a request to the host may be sent."""
+        if self.in_flight < int(self.limit) and not self.waiters:
+            self._take()
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as we were cancelled
+                self.release()
+            elif waiter in self.waiters:
+                # _wake drops cancelled waiters it comes across
+                self.waiters.remove(waiter)
+            raise
+
+    def _take(self) -> None:
+        """Count a request as in flight."""
+        self.in_flight += 1
+        if self.in_flight >= int(self.limit):
+            self.window_saturated = True
+
+    def release(self) -> None:
+        """Free the slot of a finished request and wake waiters that now fit."""
+        self.in_flight -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        """Hand free slots to waiting requests."""
+        while self.waiters and self.in_flight < int(self.limit):
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                self._take()
+                waiter.set_result(None)
+
+    def record_success(self, latency: float, size: int) -> None:
+        """
+        Record a completed request.
+
+        Args:
+            latency: Seconds from sending the request to reading the whole body
+            size: Bytes received
+        """
+        self.window_requests += 1
+        self.window_bytes += size
+        self.window_latency += latency
+        if self.window_requests < max(1, int(self.limit)):
+            return
+
+        elapsed = max(time.monotonic() - self.window_started, 1e-6)
+        throughput = self.window_bytes / elapsed
+        latency = self.window_latency / self.window_requests
+
+        if not self.baseline_latency or latency < self.baseline_latency:
+            self.baseline_latency = latency
+
+        if latency > self.baseline_latency * self.latency_factor:
+            logger.info(f"Latency to {self.host} rose to {latency:.3f}s from {self.baseline_latency:.3f}s")
+            self._cut()
+        elif (self.window_saturated and not self.window_congested and
+              throughput >= self.last_throughput * 0.95 and self.limit < self.max_limit):
+            self.limit = min(self.max_limit, self.limit + 1)
+            self.increases += 1
+            self._wake()
+
+        # Let the baseline drift up slowly so a lasting change of route is accepted
+        self.baseline_latency *= 1.02
+        self.last_throughput = throughput
+        self._reset_window()
+
+    def record_congestion(self) -> None:
+        """Record a throttling response, a reset connection or a timeout."""
+        self._cut()
+        self.window_congested = True
+
+    def _cut(self) -> None:
+        """Cut the limit multiplicatively, ignoring signals from requests sent before the last cut."""
+        now = time.monotonic()
+        if now - self.last_cut < max(2 * self.baseline_latency, 0.05):
+            return
+
+        previous = self.limit
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+        self.last_cut = now
+        self.last_throughput = 0.0
+        self._reset_window()
+        if self.limit < previous:
+            self.decreases += 1
+            logger.info(f"Concurrency limit for {self.host} cut from {int(previous)} to {int(self.limit)}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get statistics about the limiter.
+
+        Returns:
+            Dict[str, Any]: Current limit, load and adjustment counts
+        """
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "waiting": len(self.waiters),
+            "baseline_latency": round(self.baseline_latency, 3),
+            "increases": self.increases,
+            "decreases": self.decreases
+        }
+
+class HostConcurrencyController:
+    """
+    Adaptive concurrency limits for every host segments are fetched from.
+
+    The limits sit in front of the connection pool, whose connector limits
+    remain the hard upper bound.
+    """
+
+    def __init__(self, initial: int = 8, min_limit: int = 1, max_limit: int = 32,
+                 backoff: float = 0.5, latency_factor: float = 2.0):
+        """
+        Initialize the controller.
+
+        Args:
+            initial: Starting limit of a new host
+            min_limit: Lowest a limit can be cut to
+            max_limit: Highest a limit can grow to
+            backoff: Factor a limit is multiplied by on congestion
+            latency_factor: Latency over the baseline, as a multiple, that counts as congestion
+        """
+        self.initial = initial
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_factor = latency_factor
+        self.limiters: Dict[str, AdaptiveLimiter] = {}
+
+    def get(self, url: str) -> AdaptiveLimiter:
+        """
+        Get the limiter of a URL's host.
+
+        Args:
+            url: Request URL
+
+        Returns:
+            AdaptiveLimiter: The host's limiter
+        """
+        host = urlparse(url).netloc.lower()
+        limiter = self.limiters.get(host)
+        if limiter is None:
+            limiter = AdaptiveLimiter(
+                host,
+                initial=self.initial,
+                min_limit=self.min_limit,
+                max_limit=self.max_limit,
+                backoff=self.backoff,
+                latency_factor=self.latency_factor
+            )
+            self.limiters[host] = limiter
+        return limiter
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get statistics about all hosts.
+
+        Returns:
+            Dict[str, Any]: Per-host limiter statistics
+        """
+        return {host: limiter.get_stats() for host, limiter in self.limiters.items()}
+
+# Global host concurrency controller
+host_concurrency = None
+
+def get_host_concurrency(initial: int = HOST_CONCURRENCY_INITIAL,
+                         min_limit: int = HOST_CONCURRENCY_MIN,
+                         max_limit: int = HOST_CONCURRENCY_MAX,
+                         backoff: float = HOST_CONCURRENCY_BACKOFF,
+                         latency_factor: float = HOST_CONCURRENCY_LATENCY_FACTOR) -> HostConcurrencyController:
+    """
+    Get or create the global host concurrency controller.
+
+    Args:
+        initial: Starting limit of a new host
+        min_limit: Lowest a limit can be cut to
+        max_limit: Highest a limit can grow to
+        backoff: Factor a limit is multiplied by on congestion
+        latency_factor: Latency over the baseline, as a multiple, that counts as congestion
+
+    Returns:
+        HostConcurrencyController: The global controller
+    """
+    global host_concurrency
+
+    if host_concurrency is None:
+        host_concurrency = HostConcurrencyController(
+            initial=initial,
+            min_limit=min_limit,
+            max_limit=max_limit,
+            backoff=backoff,
+            latency_factor=latency_factor
+        )
+
+    return host_concurrency
@@ -0,0 +1,234 @@
+import os
+import time
+import json
+import hashlib
+import logging
+import asyncio
+import aiofiles
+from typing import Any, Dict, Iterable, Optional
+
+import m3u8
+
+from config.config import DOWNLOAD_PATH, RESULT_CACHE_TTL, RESULT_CACHE_MAX_ENTRIES
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+def playlist_digest(playlist: m3u8.M3U8, extra_urls: Iterable[str] = ()) -> str:
+    """
+    Hash the segment list of a media playlist.
+
+    Segment URIs, byte ranges, durations and key URIs are covered, so a
+    re-encoded or re-cut stream published under the same URL hashes
+    differently.
+
+    Args:
+        playlist: Media playlist that was downloaded
+        extra_urls: Further inputs of the result, such as a separate audio playlist
+
+    Returns:
+        str: Hex digest
+    """
+    digest = hashlib.sha256()
+    for segment in playlist.segments:
+        key_uri = segment.key.uri if segment.key and segment.key.uri else ''
+        digest.update(f"{segment.uri}|{segment.byterange or ''}|{segment.duration}|{key_uri}\n".encode())
+    for url in extra_urls:
+        digest.update(f"+{url}\n".encode())
+    return digest.hexdigest()
+
+class ResultCache:
+    """
+    A persistent cache of finished uploads.
+
+    Entries map a request identity (canonical URL, job type and selection
+    preferences) to the Telegram file_id of the uploaded result and the digest
+    of the segment list it was built from. A hit is answered by resending the
+    file_id, without fetching the playlist, running ffmpeg or uploading again.
+    """
+
+    def __init__(self, cache_dir: str = 'cache', ttl: int = 86400, max_entries: int = 10000):
+        """
+        Initialize the result cache.
+
+        Args:
+            cache_dir: Directory holding the index file
+            ttl: Seconds an entry stays valid
+            max_entries: Entries kept before the oldest are dropped
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.index_path = os.path.join(cache_dir, 'results.json')
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.locks: Dict[str, asyncio.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load()
+
+    def _load(self) -> None:
+        """Load the index from disk, dropping expired entries."""
+        try:
+            if os.path.exists(self.index_path):
+                with open(self.index_path, 'r') as f:
+                    self.entries = json.load(f)
+                now = time.time()
+                self.entries = {
+                    key: entry for key, entry in self.entries.items()
+                    if now - entry.get('timestamp', 0) <= self.ttl
+                }
+                logger.info(f"Loaded result cache with {len(self.entries)} entries")
+        except Exception as e:
+            logger.error(f"Error loading result cache: {str(e)}")
+            self.entries = {}
+
+    async def _save(self) -> None:
+        """Write the index to disk, replacing the old file atomically."""
+        tmp_path = self.index_path + '.tmp'
+        try:
+            async with aiofiles.open(tmp_path, 'w') as f:
+                await f.write(json.dumps(self.entries))
+            os.replace(tmp_path, self.index_path)
+        except Exception as e:
+            logger.error(f"Error saving result cache: {str(e)}")
+
+    def lock(self, key: str) -> asyncio.Lock:
+        """
+        Get the lock serializing uploads of one identity.
+
+        Subscribers of a shared download that finish together take turns, so
+        the first one uploads and the rest resend its file_id.
+
+        Args:
+            key: Request identity
+
+        Returns:
+            asyncio.Lock: The identity's lock
+        """
+        lock = self.locks.get(key)
+        if lock is None:
+            lock = self.locks[key] = asyncio.Lock()
+        return lock
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a finished upload.
+
+        Args:
+            key: Request identity
+
+        Returns:
+            Optional[Dict[str, Any]]: Entry with 'file_id', 'kind' and 'digest', or None on a miss
+        """
+        entry = self.entries.get(key)
+        if entry is None or time.time() - entry['timestamp'] > self.ttl:
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return entry
+
+    async def set(self, key: str, file_id: str, kind: str, digest: str, size: int = 0) -> None:
+        """
+        Record a finished upload.
+
+        Args:
+            key: Request identity
+            file_id: Telegram file_id of the sent media
+            kind: Media kind used to resend it ('video', 'audio' or 'document')
+            digest: Digest of the segment list the file was built from
+            size: File size in bytes
+        """
+        previous = self.entries.get(key)
+        if previous is not None and previous['digest'] != digest:
+            logger.info(f"Segment list of {key} changed, replacing its cached result")
+
+        self.entries[key] = {
+            'file_id': file_id,
+            'kind': kind,
+            'digest': digest,
+            'size': size,
+            'timestamp': time.time()
+        }
+
+        if len(self.entries) > self.max_entries:
+            oldest = sorted(self.entries, key=lambda k: self.entries[k]['timestamp'])
+            for stale in oldest[:len(self.entries) - self.max_entries]:
+                del self.entries[stale]
+
+        await self._save()
+
+    async def invalidate(self, key: str) -> bool:
+        """
+        Drop a cached result.
+
+        Args:
+            key: Request identity
+
+        Returns:
+            bool: True if an entry was removed
+        """
+        if self.entries.pop(key, None) is None:
+            return False
+        await self._save()
+        return True
+
+    async def invalidate_url(self, prefix: str) -> int:
+        """
+        Drop every cached result of a URL, whatever the job type or preferences.
+
+        Args:
+            prefix: Canonical URL followed by the identity separator
+
+        Returns:
+            int: Number of entries removed
+        """
+        keys = [key for key in self.entries if key.startswith(prefix)]
+        for key in keys:
+            del self.entries[key]
+        if keys:
+            await self._save()
+        return len(keys)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get statistics about the result cache.
+
+        Returns:
+            Dict[str, Any]: Entry count, hits, misses and hit rate
+        """
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+        }
+
+# Global result cache
+result_cache = None
+
+def get_result_cache(cache_dir: str = os.path.join(DOWNLOAD_PATH, 'cache'),
+                     ttl: int = RESULT_CACHE_TTL,
+                     max_entries: int = RESULT_CACHE_MAX_ENTRIES) -> ResultCache:
+    """
+    Get or create the global result cache.
+
+    Args:
+        cache_dir: Directory holding the index file
+        ttl: Seconds an entry stays valid
+        max_entries: Entries kept before the oldest are dropped
+
+    Returns:
+        ResultCache: The global result cache
+    """
+    global result_cache
+
+    if result_cache is None:
+        result_cache = ResultCache(cache_dir=cache_dir, ttl=ttl, max_entries=max_entries)
+
+    return result_cache
@@ -0,0 +1,317 @@
+import time
+import random
+import logging
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Any, Deque, Dict, Optional
+from urllib.parse import urlparse
+
+from config.config import (
+    CIRCUIT_BREAKER_FAILURE_RATE, CIRCUIT_BREAKER_MIN_REQUESTS, CIRCUIT_BREAKER_OPEN_SECONDS
+)
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Statuses worth retrying: timeouts, rate limiting and transient server errors
+RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header.
+
+    Args:
+        value: Header value, either delay seconds or an HTTP date
+
+    Returns:
+        Optional[float]: Delay in seconds, or None if absent or invalid
+    """
+    if not value:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, OverflowError):
+        return None
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter and status-aware retryability.
+    """
+
+    def __init__(self, max_attempts: int = 10, base_delay: float = 0.5,
+                 max_delay: float = 30.0, max_retry_after: float = 60.0):
+        """
+        Initialize the retry policy.
+
+        Args:
+            max_attempts: Maximum attempts per request
+            base_delay: Delay ceiling of the first retry in seconds
+            max_delay: Upper bound of the backoff delay in seconds
+            max_retry_after: Longest Retry-After delay that is honoured
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+
+    @staticmethod
+    def is_retryable_status(status: int) -> bool:
+        """
+        Check whether an HTTP status is worth retrying.
+
+        Args:
+            status: HTTP status code
+
+        Returns:
+            bool: True for transient errors, False for errors like 403 or 404
+        """
+        return status in RETRYABLE_STATUSES
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """
+        Get the delay before the next attempt.
+
+        Full jitter spreads retries of many concurrent requests over the whole
+        interval instead of letting them hit the origin in lockstep.
+
+        Args:
+            attempt: Zero-based number of the attempt that just failed
+            retry_after: Delay requested by the server, if any
+
+        Returns:
+            float: Delay in seconds
+        """
+        ceiling = min(self.max_delay, self.base_delay * (2 ** attempt))
+        delay = random.uniform(0, ceiling)
+
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_retry_after))
+
+        return delay
+
+class RetryBudget:
+    """
+    A total number of retries shared by all requests of one download.
+
+    Once it is spent, further failures are final, so a dead origin fails the
+    job after a bounded amount of work instead of after every segment has
+    exhausted its own attempts.
+    """
+
+    def __init__(self, total: int):
+        """
+        Initialize the budget.
+
+        Args:
+            total: Number of retries allowed
+        """
+        self.total = max(0, total)
+        self.spent = 0
+
+    def try_spend(self) -> bool:
+        """
+        Spend one retry if any are left.
+
+        Returns:
+            bool: True if the retry may proceed
+        """
+        if self.spent >= self.total:
+            return False
+        self.spent += 1
+        return True
+
+    @property
+    def remaining(self) -> int:
+        """Number of retries left."""
+        return self.total - self.spent
+
+class CircuitBreaker:
+    """
+    A per-host circuit breaker driven by the recent error rate.
+
+    Closed: requests flow and outcomes are recorded. Open: requests are refused
+    without touching the network until the cool-down ends. Half-open: a single
+    probe request is let through; success closes the circuit, failure opens it
+    again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, host: str, failure_rate: float = 0.5, min_requests: int = 20,
+                 window: int = 50, open_seconds: float = 30.0, probe_timeout: float = 30.0):
+        """
+        Initialize the circuit breaker.
+
+        Args:
+            host: Host name the breaker protects
+            failure_rate: Error rate over the window that opens the circuit
+            min_requests: Outcomes needed in the window before the rate is trusted
+            window: Number of recent outcomes considered
+            open_seconds: Cool-down before a probe is allowed
+            probe_timeout: Time after which a probe that never reported back is abandoned
+        """
+        self.host = host
+        self.failure_rate = failure_rate
+        self.min_requests = min_requests
+        self.open_seconds = open_seconds
+        self.probe_timeout = probe_timeout
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.probe_started = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        """
+        Check whether a request may be sent to the host.
+
+        Returns:
+            bool: True if the request may proceed
+        """
+        now = time.monotonic()
+
+        if self.state == self.OPEN:
+            if now - self.opened_at < self.open_seconds:
+                self.rejected += 1
+                return False
+            self.state = self.HALF_OPEN
+            self.probe_started = 0.0
+
+        if self.state == self.HALF_OPEN:
+            if self.probe_started and now - self.probe_started < self.probe_timeout:
+                self.rejected += 1
+                return False
+            self.probe_started = now
+
+        return True
+
+    def record_success(self) -> None:
+        """Record a successful request."""
+        if self.state == self.HALF_OPEN:
+            logger.info(f"Circuit for {self.host} closed after a successful probe")
+            self.state = self.CLOSED
+            self.outcomes.clear()
+        self.outcomes.append(True)
+
+    def record_failure(self) -> None:
+        """Record a failed request."""
+        if self.state == self.HALF_OPEN:
+            self._open()
+            return
+
+        self.outcomes.append(False)
+        if self.state == self.CLOSED and len(self.outcomes) >= self.min_requests:
+            failures = self.outcomes.count(False)
+            if failures / len(self.outcomes) >= self.failure_rate:
+                self._open()
+
+    def _open(self) -> None:
+        """Open the circuit."""
+        if self.state != self.OPEN:
+            logger.warning(f"Circuit for {self.host} opened, shedding requests for {self.open_seconds} seconds")
+            self.times_opened += 1
+        self.state = self.OPEN
+        self.opened_at = time.monotonic()
+        self.outcomes.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get statistics about the circuit breaker.
+
+        Returns:
+            Dict[str, Any]: Circuit breaker statistics
+        """
+        failures = self.outcomes.count(False)
+        return {
+            "state": self.state,
+            "error_rate": round(failures / len(self.outcomes), 3) if self.outcomes else 0.0,
+            "recent_requests": len(self.outcomes),
+            "times_opened": self.times_opened,
+            "rejected": self.rejected
+        }
+
+class CircuitBreakerRegistry:
+    """
+    Circuit breakers for every host the downloader talks to.
+    """
+
+    def __init__(self, failure_rate: float = 0.5, min_requests: int = 20, open_seconds: float = 30.0):
+        """
+        Initialize the registry.
+
+        Args:
+            failure_rate: Error rate that opens a circuit
+            min_requests: Outcomes needed before the rate is trusted
+            open_seconds: Cool-down of an open circuit in seconds
+        """
+        self.failure_rate = failure_rate
+        self.min_requests = min_requests
+        self.open_seconds = open_seconds
+        self.breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, url: str) -> CircuitBreaker:
+        """
+        Get the circuit breaker of a URL's host.
+
+        Args:
+            url: Request URL
+
+        Returns:
+            CircuitBreaker: The host's circuit breaker
+        """
+        host = urlparse(url).netloc.lower()
+        breaker = self.breakers.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                host,
+                failure_rate=self.failure_rate,
+                min_requests=self.min_requests,
+                open_seconds=self.open_seconds
+            )
+            self.breakers[host] = breaker
+        return breaker
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get statistics about all circuit breakers.
+
+        Returns:
+            Dict[str, Any]: Per-host circuit breaker statistics
+        """
+        return {host: breaker.get_stats() for host, breaker in self.breakers.items()}
+
+# Global circuit breaker registry
+circuit_breakers = None
+
+def get_circuit_breakers(failure_rate: float = CIRCUIT_BREAKER_FAILURE_RATE,
+                         min_requests: int = CIRCUIT_BREAKER_MIN_REQUESTS,
+                         open_seconds: float = CIRCUIT_BREAKER_OPEN_SECONDS) -> CircuitBreakerRegistry:
+    """
+    Get or create the global circuit breaker registry.
+
+    Args:
+        failure_rate: Error rate that opens a circuit
+        min_requests: Outcomes needed before the rate is trusted
+        open_seconds: Cool-down of an open circuit in seconds
+
+    Returns:
+        CircuitBreakerRegistry: The global registry
+    """
+    global circuit_breakers
+
+    if circuit_breakers is None:
+        circuit_breakers = CircuitBreakerRegistry(
+            failure_rate=failure_rate,
+            min_requests=min_requests,
+            open_seconds=open_seconds
+        )
+
+    return circuit_breakers
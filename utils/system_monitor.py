@@ -7,13 +7,21 @@ from typing import Dict, Any
 
 from config.config import (
     BOT_START_TIME, TOTAL_COMPLETED_DOWNLOADS,
-    CACHE_ENABLED, RESOURCE_MONITOR_ENABLED
+    CACHE_ENABLED, RESULT_CACHE_ENABLED, SEGMENT_CACHE_ENABLED, RESOURCE_MONITOR_ENABLED,
+    HOST_CONCURRENCY_ENABLED
 )
 from utils.helpers import active_downloads, format_size
 from utils.system_checks import check_ffmpeg, get_platform_info
 from utils.connection_pool import get_connection_pool
 from utils.cache_manager import get_cache_manager
 from utils.resource_manager import get_resource_manager
+from utils.retry_policy import get_circuit_breakers
+from downloader.segment_hedger import get_hedge_stats
+from downloader.download_registry import get_download_registry
+from utils.result_cache import get_result_cache
+from utils.host_concurrency import get_host_concurrency
+from utils.bandwidth_governor import get_bandwidth_governor
+from downloader.segment_cache import get_segment_cache
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -108,7 +116,8 @@ def get_bot_stats() -> Dict[str, Any]:
         uptime_formatted += f"{int(seconds)}s"
 
         # Get active downloads
-        active_count = sum(1 for d in active_downloads.values() if d.get('status') == 'downloading')
+        # Subscribers of a shared download point at the same entry
+        active_count = len({id(d) for d in active_downloads.values() if d.get('status') == 'downloading'})
 
         # Get FFmpeg version
         ffmpeg_available, ffmpeg_message = check_ffmpeg()
@@ -136,7 +145,7 @@ def get_bot_stats() -> Dict[str, Any]:
 
 def get_all_stats() -> Dict[str, Any]:
     """
-    Get all statistics including system, bot, connection pool, cache, and resource manager stats.
+    Get all statistics including system, bot, connection pool, circuit breaker, host concurrency, hedging, shared download, result cache, segment cache, cache, and resource manager stats.
 
     Returns:
         Dict[str, Any]: All statistics
@@ -163,18 +172,52 @@ def get_all_stats() -> Dict[str, Any]:
         logger.error(f"Error getting connection pool stats: {str(e)}")
         connection_pool_stats = {"error": str(e)}
 
+    # Get per-host circuit breaker states
+    try:
+        circuit_breaker_stats = get_circuit_breakers().get_stats()
+    except Exception as e:
+        logger.error(f"Error getting circuit breaker stats: {str(e)}")
+        circuit_breaker_stats = {"error": str(e)}
+
+    # Get per-host adaptive concurrency limits if enabled
+    if HOST_CONCURRENCY_ENABLED:
+        host_concurrency_stats = get_host_concurrency().get_stats()
+    else:
+        host_concurrency_stats = {"enabled": False}
+
+    # Get bandwidth limits and current download rates
+    bandwidth_stats = get_bandwidth_governor().get_stats()
+
+    # Get hedged request counters
+    hedging_stats = get_hedge_stats().get_stats()
+
+    # Get shared download counters
+    shared_download_stats = get_download_registry().get_stats()
+
+    # Get completed-output cache stats if enabled
+    if RESULT_CACHE_ENABLED:
+        try:
+            result_cache_stats = get_result_cache().get_stats()
+        except Exception as e:
+            logger.error(f"Error getting result cache stats: {str(e)}")
+            result_cache_stats = {"error": str(e)}
+    else:
+        result_cache_stats = {"enabled": False}
+
+    # Get shared segment cache stats if enabled
+    if SEGMENT_CACHE_ENABLED:
+        try:
+            segment_cache_stats = get_segment_cache().get_stats()
+        except Exception as e:
+            logger.error(f"Error getting segment cache stats: {str(e)}")
+            segment_cache_stats = {"error": str(e)}
+    else:
+        segment_cache_stats = {"enabled": False}
+
     # Get cache stats if enabled
     if CACHE_ENABLED:
         try:
-            cache = get_cache_manager()
-            # We don't have a get_stats method for cache yet, so just provide basic info
-            cache_stats = {
-                "enabled": True,
-                "cache_dir": cache.cache_dir,
-                "ttl": cache.ttl,
-                "max_size": cache.max_size,
-                "items_count": len(cache.cache_index)
-            }
+            cache_stats = {"enabled": True, **get_cache_manager().get_stats()}
         except Exception as e:
             logger.error(f"Error getting cache stats: {str(e)}")
             cache_stats = {"error": str(e)}
@@ -197,6 +240,13 @@ def get_all_stats() -> Dict[str, Any]:
         'system': system_stats,
         'bot': bot_stats,
         'connection_pool': connection_pool_stats,
+        'circuit_breakers': circuit_breaker_stats,
+        'host_concurrency': host_concurrency_stats,
+        'bandwidth': bandwidth_stats,
+        'hedging': hedging_stats,
+        'shared_downloads': shared_download_stats,
+        'result_cache': result_cache_stats,
+        'segment_cache': segment_cache_stats,
         'cache': cache_stats,
         'resource_manager': resource_manager_stats
     }